@@ -0,0 +1,199 @@
+"""Index and download a synthetic library from a local fake server, end to end.
+
+Every engine runs in its own process so that peak RSS is measured per run. The fake
+server runs in another process, it doesn't count towards the memory or CPU of a run.
+
+python -m benchmarks.e2e --albums 20 --items-per-album 200 --api-latency 0.05
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, Optional
+
+import httplib2  # type: ignore
+from googleapiclient.discovery import build  # type: ignore
+
+from benchmarks.fake_server import FakeLibraryConfig, FakePhotosServer
+from gpsync.google_photos.client import GooglePhotosClient
+from gpsync.google_photos.rate_limit import EndpointLimits, RateLimiter, RateLimits
+from gpsync.google_photos.transport import create_transport
+from gpsync.index.indexer import DownloadEngine, GooglePhotosIndexer
+
+
+def create_client(
+    server_url: str,
+    num_threads: int = 8,
+    rate_limits: Optional[RateLimits] = None,
+) -> GooglePhotosClient:
+    """Client for the API served at `server_url`, without credentials."""
+    service = build(
+        "photoslibrary",
+        "v1",
+        discoveryServiceUrl=server_url + "/$discovery/rest?version={apiVersion}",
+        static_discovery=False,
+        http=httplib2.Http(),
+    )
+    return GooglePhotosClient(
+        client=service,
+        transport=create_transport(pool_size=num_threads),
+        rate_limiter=RateLimiter(rate_limits or RateLimits()),
+    )
+
+
+def unthrottled_limits(num_threads: int) -> RateLimits:
+    """Limits that leave throughput to the server and the sync path being measured."""
+    return RateLimits(
+        api=EndpointLimits(rate=10_000, burst=10_000, max_concurrency=num_threads),
+        content=EndpointLimits(rate=10_000, burst=10_000, max_concurrency=num_threads),
+        backoff_base=0.01,
+        backoff_cap=0.1,
+    )
+
+
+def server_stats(server_url: str) -> Dict[str, Any]:
+    with urllib.request.urlopen(server_url + "/stats") as response:
+        return json.load(response)
+
+
+def run(
+    server_url: str,
+    base_path: str,
+    engine: DownloadEngine = DownloadEngine.THREADS,
+    num_threads: int = 8,
+    rate_limits: Optional[RateLimits] = None,
+) -> Dict[str, Any]:
+    """Index every album and download its content into `base_path`.
+
+    Returns the number of items and bytes downloaded, how long each phase took and the
+    API calls the server answered during the run."""
+    client = create_client(server_url, num_threads, rate_limits)
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{base_path}/index.db"
+    )
+    calls_before = server_stats(server_url)["calls"]
+
+    start = time.perf_counter()
+    indexer.index_albums()
+    indexer.index_all_album_content(num_threads=num_threads, engine=engine)
+    indexed = time.perf_counter()
+    indexer.download_indexed_content(
+        f"{base_path}/photos", num_threads=num_threads, engine=engine
+    )
+    downloaded = time.perf_counter()
+    client.transport.close()
+
+    store = os.path.join(base_path, "photos", ".gpsync", "store")
+    filenames = os.listdir(store) if os.path.isdir(store) else []
+    calls_after = server_stats(server_url)["calls"]
+    return {
+        "engine": engine.value,
+        "items": len(filenames),
+        "bytes": sum(os.path.getsize(os.path.join(store, f)) for f in filenames),
+        "index_seconds": indexed - start,
+        "download_seconds": downloaded - indexed,
+        "api_calls": {
+            name: count - calls_before.get(name, 0)
+            for name, count in calls_after.items()
+        },
+    }
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_in_child(
+    connection: Any,
+    server_url: str,
+    engine: DownloadEngine,
+    num_threads: int,
+    rate_limits: Optional[RateLimits],
+) -> None:
+    with tempfile.TemporaryDirectory() as base_path:
+        result = run(server_url, base_path, engine, num_threads, rate_limits)
+
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    connection.send(result)
+
+
+def _serve(config: FakeLibraryConfig, connection: Any) -> None:
+    with FakePhotosServer(config) as server:
+        connection.send(server.url)
+        # Serves until the parent closes its end of the pipe.
+        try:
+            connection.recv_bytes()
+        except EOFError:
+            pass
+
+
+def report(result: Dict[str, Any]) -> None:
+    seconds = result["index_seconds"] + result["download_seconds"]
+    items = max(result["items"], 1)
+    api_calls = sum(result["api_calls"].values())
+    print(
+        f"{result['engine']:<8} {result['items']:>8} items "
+        f"{result['items'] / seconds:10,.1f} items/s "
+        f"{result['bytes'] / seconds / 1e6:8,.1f} MB/s "
+        f"{result['peak_rss_bytes'] / 1e6:8,.1f} MB peak RSS "
+        f"{api_calls / items:6.3f} API calls/item "
+        f"(index {result['index_seconds']:.2f}s, "
+        f"download {result['download_seconds']:.2f}s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-threads", type=int, default=8)
+    parser.add_argument(
+        "--engine", type=DownloadEngine, choices=list(DownloadEngine), default=None
+    )
+    parser.add_argument(
+        "--rate-limited",
+        action="store_true",
+        help="Keep the client's default rate limits instead of lifting them",
+    )
+    for name, field in FakeLibraryConfig.__fields__.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=field.type_, default=field.default
+        )
+    args = vars(parser.parse_args())
+    num_threads = args.pop("num_threads")
+    engine = args.pop("engine")
+    engines = [engine] if engine is not None else list(DownloadEngine)
+    rate_limits = None if args.pop("rate_limited") else unthrottled_limits(num_threads)
+
+    context = multiprocessing.get_context("spawn")
+    server_connection, child_connection = context.Pipe()
+    server = context.Process(
+        target=_serve, args=(FakeLibraryConfig(**args), child_connection)
+    )
+    server.start()
+    child_connection.close()
+    server_url = server_connection.recv()
+    try:
+        for engine in engines:
+            receiver, sender = context.Pipe(duplex=False)
+            child = context.Process(
+                target=_run_in_child,
+                args=(sender, server_url, engine, num_threads, rate_limits),
+            )
+            child.start()
+            sender.close()
+            report(receiver.recv())
+            child.join()
+    finally:
+        server_connection.close()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
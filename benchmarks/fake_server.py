@@ -0,0 +1,539 @@
+"""Local stand-in for the Photos Library API and the content host behind base URLs.
+
+Serves a synthetic library through the endpoints the client calls, with the discovery
+document `googleapiclient.discovery.build` needs:
+
+    albums.list, sharedAlbums.list, mediaItems.search, mediaItems.get,
+    mediaItems.batchGet and `{baseUrl}=d` / `{baseUrl}=dv` downloads
+
+Latency, page sizes, throttling (429 with Retry-After), expired base URLs (403) and the
+size of the content are configurable. Request counters are served at /stats.
+
+python -m benchmarks.fake_server --albums 10 --items-per-album 100
+"""
+
+import argparse
+import http.server
+import io
+import json
+import random
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+from pydantic import BaseModel
+
+CONTENT_CHUNK_SIZE = 64 * 1024
+
+
+class FakeLibraryConfig(BaseModel):
+    albums: int = 10
+    items_per_album: int = 100
+    # Albums shared with the user, listed by sharedAlbums.list.
+    shared_albums: int = 0
+    # Fraction of media items that are also in the next album.
+    shared_item_fraction: float = 0.0
+    video_fraction: float = 0.1
+    description_fraction: float = 0.5
+    photo_size: int = 256 * 1024
+    video_size: int = 4 * 1024 * 1024
+    # Largest page returned, whatever page size the client asks for.
+    max_page_size: int = 100
+    # Seconds every API and content request takes before it is answered.
+    api_latency: float = 0.0
+    content_latency: float = 0.0
+    # Fraction of API requests answered with 429 and a Retry-After of `retry_after`.
+    throttle_rate: float = 0.0
+    retry_after: float = 0.0
+    # Fraction of media items whose first download is answered with 403, like a base
+    # URL that expired.
+    expired_rate: float = 0.0
+    seed: int = 0
+
+
+def discovery_document(root_url: str) -> Dict[str, Any]:
+    """Discovery document with just the Photos Library methods the client calls."""
+    page_parameters = {
+        "pageSize": {"type": "integer", "format": "int32", "location": "query"},
+        "pageToken": {"type": "string", "location": "query"},
+        "excludeNonAppCreatedData": {"type": "boolean", "location": "query"},
+    }
+
+    def method(name: str, path: str, http_method: str, **extra: Any) -> Dict[str, Any]:
+        # Responses without a schema would be returned as bytes instead of parsed.
+        return {
+            "id": f"photoslibrary.{name}",
+            "path": path,
+            "flatPath": path,
+            "httpMethod": http_method,
+            "parameters": {},
+            "parameterOrder": [],
+            "response": {"$ref": "Response"},
+            **extra,
+        }
+
+    return {
+        "kind": "discovery#restDescription",
+        "discoveryVersion": "v1",
+        "id": "photoslibrary:v1",
+        "name": "photoslibrary",
+        "version": "v1",
+        "protocol": "rest",
+        "rootUrl": f"{root_url}/",
+        "servicePath": "",
+        "baseUrl": f"{root_url}/",
+        "batchPath": "batch",
+        "parameters": {},
+        "schemas": {
+            name: {"id": name, "type": "object", "properties": {}}
+            for name in ("Response", "SearchMediaItemsRequest")
+        },
+        "resources": {
+            "albums": {
+                "methods": {
+                    "list": method(
+                        "albums.list", "v1/albums", "GET", parameters=page_parameters
+                    )
+                }
+            },
+            "sharedAlbums": {
+                "methods": {
+                    "list": method(
+                        "sharedAlbums.list",
+                        "v1/sharedAlbums",
+                        "GET",
+                        parameters=page_parameters,
+                    )
+                }
+            },
+            "mediaItems": {
+                "methods": {
+                    "search": method(
+                        "mediaItems.search",
+                        "v1/mediaItems:search",
+                        "POST",
+                        request={"$ref": "SearchMediaItemsRequest"},
+                    ),
+                    "get": method(
+                        "mediaItems.get",
+                        "v1/mediaItems/{+mediaItemId}",
+                        "GET",
+                        parameters={
+                            "mediaItemId": {
+                                "type": "string",
+                                "required": True,
+                                "location": "path",
+                                "pattern": "^[^/]+$",
+                            }
+                        },
+                        parameterOrder=["mediaItemId"],
+                    ),
+                    "batchGet": method(
+                        "mediaItems.batchGet",
+                        "v1/mediaItems:batchGet",
+                        "GET",
+                        parameters={
+                            "mediaItemIds": {
+                                "type": "string",
+                                "location": "query",
+                                "repeated": True,
+                            }
+                        },
+                    ),
+                }
+            },
+        },
+    }
+
+
+def make_content(size: int, photo: bool) -> bytes:
+    """Content of `size` bytes, a decodable JPEG padded after its end for photos."""
+    if not photo:
+        return bytes(size)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), color=(200, 120, 40)).save(buffer, format="JPEG")
+    jpeg = buffer.getvalue()
+    return jpeg + bytes(max(size - len(jpeg), 0))
+
+
+class FakePhotosServer:
+    """Photos Library API and content host for a synthetic library, on a local port."""
+
+    def __init__(self, config: Optional[FakeLibraryConfig] = None, port: int = 0):
+        self.config = config or FakeLibraryConfig()
+        self.calls: Dict[str, int] = {}
+        self.content_requests = 0
+        self.content_bytes = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self._expired: set = set()
+
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", port), self._handler()
+        )
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self.discovery_url = self.url + "/$discovery/rest?version={apiVersion}"
+
+        self._discovery = json.dumps(discovery_document(self.url)).encode()
+        self._photo = make_content(self.config.photo_size, photo=True)
+        self._video = make_content(self.config.video_size, photo=False)
+        self._build_library()
+
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-photos-server", daemon=True
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakePhotosServer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    @property
+    def num_media_items(self) -> int:
+        return len(self.media_items)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "content_requests": self.content_requests,
+                "content_bytes": self.content_bytes,
+            }
+
+    def _build_library(self) -> None:
+        config = self.config
+        self.albums: List[Dict[str, Any]] = []
+        self.shared_albums: List[Dict[str, Any]] = []
+        self.album_media_items: Dict[str, List[Dict[str, Any]]] = {}
+        self.media_items: Dict[str, Dict[str, Any]] = {}
+
+        num_albums = config.albums + config.shared_albums
+        for album_number in range(num_albums):
+            album_id = f"album{album_number:06d}"
+            self.album_media_items[album_id] = []
+            for index in range(config.items_per_album):
+                item = self._make_media_item(
+                    album_number * config.items_per_album + index
+                )
+                self.media_items[item["id"]] = item
+                self.album_media_items[album_id].append(item)
+
+        album_ids = list(self.album_media_items)
+        item_ids = {
+            album_id: {item["id"] for item in items}
+            for album_id, items in self.album_media_items.items()
+        }
+        for position, album_id in enumerate(album_ids):
+            items = self.album_media_items[album_id]
+            for item in items:
+                if self._random.random() < config.shared_item_fraction:
+                    next_album_id = album_ids[(position + 1) % len(album_ids)]
+                    if item["id"] not in item_ids[next_album_id]:
+                        item_ids[next_album_id].add(item["id"])
+                        self.album_media_items[next_album_id].append(item)
+
+        for position, album_id in enumerate(album_ids):
+            items = self.album_media_items[album_id]
+            album = {
+                "id": album_id,
+                "title": f"Album {position}",
+                "mediaItemsCount": str(len(items)),
+            }
+            if items:
+                album["coverPhotoMediaItemId"] = items[0]["id"]
+            if position < config.albums:
+                self.albums.append(album)
+            else:
+                self.shared_albums.append(album)
+
+    def _make_media_item(self, index: int) -> Dict[str, Any]:
+        config = self.config
+        media_item_id = f"AF1Qip{index:012d}"
+        video = self._random.random() < config.video_fraction
+        creation_time = time.strftime(
+            "%Y-%m-%dT%H:%M:%SZ", time.gmtime(1262304000 + index * 3600)
+        )
+        metadata: Dict[str, Any] = {
+            "creationTime": creation_time,
+            "width": "4032",
+            "height": "3024",
+        }
+        if video:
+            metadata["video"] = {"fps": 30.0, "status": "READY"}
+        else:
+            metadata["photo"] = {"cameraMake": "Camera"}
+
+        item: Dict[str, Any] = {
+            "id": media_item_id,
+            "productUrl": f"https://photos.google.com/lr/photo/{media_item_id}",
+            "baseUrl": f"{self.url}/content/{media_item_id}",
+            "mimeType": "video/mp4" if video else "image/jpeg",
+            "mediaMetadata": metadata,
+            "filename": f"{'VID' if video else 'IMG'}_{index}.{'mp4' if video else 'jpg'}",
+        }
+        if self._random.random() < config.description_fraction:
+            item["description"] = f"Description of {index}"
+        if self._random.random() < config.expired_rate:
+            self._expired.add(media_item_id)
+
+        return item
+
+    def _page(
+        self, items: List[Any], page_size: Optional[str], page_token: Optional[str]
+    ) -> Tuple[List[Any], Optional[str]]:
+        size = min(
+            int(page_size or self.config.max_page_size), self.config.max_page_size
+        )
+        start = int(page_token or 0)
+        end = start + size
+        return items[start:end], (str(end) if end < len(items) else None)
+
+    def _throttled(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.throttle_rate
+
+    def _handler(self) -> Any:
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                self._route("GET")
+
+            def do_POST(self) -> None:
+                self._route("POST")
+
+            def _route(self, method: str) -> None:
+                url = urllib.parse.urlsplit(self.path)
+                path = urllib.parse.unquote(url.path)
+                query = urllib.parse.parse_qs(url.query)
+                body: Dict[str, Any] = {}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = json.loads(self.rfile.read(length))
+
+                if path.startswith("/content/"):
+                    self._content(path[len("/content/") :])
+                elif path == "/$discovery/rest":
+                    self._send(200, server._discovery)
+                elif path == "/stats":
+                    self._json(200, server.stats())
+                else:
+                    self._api(method, path, query, body)
+
+            def _api(
+                self,
+                method: str,
+                path: str,
+                query: Dict[str, List[str]],
+                body: Dict[str, Any],
+            ) -> None:
+                try:
+                    name, response = server._api_response(method, path, query, body)
+                except ValueError:
+                    self._json(400, error(400, "INVALID_ARGUMENT"))
+                    return
+
+                with server._lock:
+                    server.calls[name] = server.calls.get(name, 0) + 1
+
+                if server.config.api_latency:
+                    time.sleep(server.config.api_latency)
+
+                if response is None:
+                    self._json(404, error(404, "NOT_FOUND"))
+                elif server._throttled():
+                    self._json(
+                        429,
+                        error(429, "RESOURCE_EXHAUSTED"),
+                        {"Retry-After": str(server.config.retry_after)},
+                    )
+                else:
+                    self._json(200, response)
+
+            def _content(self, url: str) -> None:
+                media_item_id, _, kind = url.partition("=")
+                item = server.media_items.get(media_item_id)
+                if server.config.content_latency:
+                    time.sleep(server.config.content_latency)
+
+                with server._lock:
+                    server.content_requests += 1
+                    expired = media_item_id in server._expired
+                    server._expired.discard(media_item_id)
+
+                if item is None or kind not in ("d", "dv"):
+                    self._send(404, b"")
+                    return
+
+                if expired:
+                    self._send(403, b"")
+                    return
+
+                content = server._video if kind == "dv" else server._photo
+                start = 0
+                headers = {"Content-Type": item["mimeType"]}
+                range_header = self.headers.get("Range")
+                if range_header:
+                    start = int(range_header.split("=")[1].split("-")[0])
+                    headers["Content-Range"] = (
+                        f"bytes {start}-{len(content) - 1}/{len(content)}"
+                    )
+
+                view = memoryview(content)[start:]
+                self._send(206 if range_header else 200, b"", headers, len(view))
+                for offset in range(0, len(view), CONTENT_CHUNK_SIZE):
+                    self.wfile.write(view[offset : offset + CONTENT_CHUNK_SIZE])
+                with server._lock:
+                    server.content_bytes += len(view)
+
+            def _json(
+                self,
+                status: int,
+                response: Any,
+                headers: Optional[Dict[str, str]] = None,
+            ) -> None:
+                headers = {"Content-Type": "application/json", **(headers or {})}
+                self._send(status, json.dumps(response).encode(), headers)
+
+            def _send(
+                self,
+                status: int,
+                body: bytes,
+                headers: Optional[Dict[str, str]] = None,
+                length: Optional[int] = None,
+            ) -> None:
+                self.send_response(status)
+                for header, value in (headers or {}).items():
+                    self.send_header(header, value)
+                self.send_header(
+                    "Content-Length", str(len(body) if length is None else length)
+                )
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def _api_response(
+        self,
+        method: str,
+        path: str,
+        query: Dict[str, List[str]],
+        body: Dict[str, Any],
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Name of the API method at `path` and its response, None if there is none."""
+
+        def first(name: str) -> Optional[str]:
+            values = query.get(name)
+            return values[0] if values else None
+
+        if method == "GET" and path in ("/v1/albums", "/v1/sharedAlbums"):
+            shared = path == "/v1/sharedAlbums"
+            albums, token = self._page(
+                self.shared_albums if shared else self.albums,
+                first("pageSize"),
+                first("pageToken"),
+            )
+            response: Dict[str, Any] = {"sharedAlbums" if shared else "albums": albums}
+            if token is not None:
+                response["nextPageToken"] = token
+            return ("sharedAlbums.list" if shared else "albums.list"), response
+
+        if method == "POST" and path == "/v1/mediaItems:search":
+            album_id = body.get("albumId")
+            filters = body.get("filters")
+            if album_id is not None:
+                if filters is not None:
+                    raise ValueError("albumId can't be combined with filters")
+
+                items = self.album_media_items.get(album_id, [])
+            else:
+                items = [
+                    item
+                    for item in self.media_items.values()
+                    if matches_date_filter(item, (filters or {}).get("dateFilter"))
+                ]
+            items, token = self._page(
+                items, body.get("pageSize"), body.get("pageToken")
+            )
+            response = {"mediaItems": items}
+            if token is not None:
+                response["nextPageToken"] = token
+            return "mediaItems.search", response
+
+        if method == "GET" and path == "/v1/mediaItems:batchGet":
+            return "mediaItems.batchGet", {
+                "mediaItemResults": [
+                    (
+                        {"mediaItem": self.media_items[media_item_id]}
+                        if media_item_id in self.media_items
+                        else {"status": {"code": 5, "message": "NOT_FOUND"}}
+                    )
+                    for media_item_id in query.get("mediaItemIds", [])
+                ]
+            }
+
+        if method == "GET" and path.startswith("/v1/mediaItems/"):
+            media_item_id = path[len("/v1/mediaItems/") :]
+            return "mediaItems.get", self.media_items.get(media_item_id)
+
+        return "unknown", None
+
+
+def matches_date_filter(
+    item: Dict[str, Any], date_filter: Optional[Dict[str, Any]]
+) -> bool:
+    """Whether the item was created in one of the date filter's ranges."""
+    if not date_filter:
+        return True
+
+    created = item["mediaMetadata"]["creationTime"][:10]
+    for date_range in date_filter.get("ranges") or []:
+        start, end = (
+            "{year:04d}-{month:02d}-{day:02d}".format(**date_range[bound])
+            for bound in ("startDate", "endDate")
+        )
+        if start <= created <= end:
+            return True
+
+    return False
+
+
+def error(code: int, status: str) -> Dict[str, Any]:
+    return {"error": {"code": code, "message": status, "status": status}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8080)
+    for name, field in FakeLibraryConfig.__fields__.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=field.type_, default=field.default
+        )
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+
+    server = FakePhotosServer(FakeLibraryConfig(**args), port=port)
+    print(f"Serving {server.num_media_items} media items on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
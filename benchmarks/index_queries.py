@@ -0,0 +1,145 @@
+"""Time the hot index queries against a synthetic library.
+
+python -m benchmarks.index_queries --rows 1000000
+"""
+
+import argparse
+import datetime
+import os
+import statistics
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, List
+
+from sqlalchemy import func, insert, text
+from sqlmodel import Session, select
+
+from gpsync.index.database import get_engine, under_path
+from gpsync.index.indexer import chunks
+from gpsync.models.index import Album, AlbumContentLink, Content, Download, DownloadRun
+
+BASE_PATH = "/photos"
+ITEMS_PER_ALBUM = 100
+ID_BATCH_SIZE = 500
+
+
+def populate(session: Session, rows: int):
+    num_albums = max(rows // ITEMS_PER_ALBUM, 1)
+    session.execute(
+        insert(Album.__table__),  # type: ignore
+        [{"id": f"album{i}", "title": f"Album {i}"} for i in range(num_albums)],
+    )
+
+    download_run_id = uuid.uuid4()
+    session.execute(
+        insert(DownloadRun.__table__),  # type: ignore
+        [{"id": download_run_id, "base_filepath": BASE_PATH}],
+    )
+
+    start = datetime.datetime(2010, 1, 1)
+    for batch in chunks(range(rows), 50_000):
+        session.execute(
+            insert(Content.__table__),  # type: ignore
+            [
+                {
+                    "id": f"content{i}",
+                    "base_url": f"https://lh3.googleusercontent.com/{i}",
+                    "download_url": f"https://lh3.googleusercontent.com/{i}=d",
+                    "google_photos_filename": f"IMG_{i}.jpg",
+                    "content_creation_time": start + datetime.timedelta(minutes=7 * i),
+                    "height": 3024,
+                    "width": 4032,
+                    "mime_type": "image/jpeg",
+                    "created_at": start,
+                    "updated_at": start,
+                }
+                for i in batch
+            ],
+        )
+        session.execute(
+            insert(AlbumContentLink.__table__),  # type: ignore
+            [
+                {
+                    "album_id": f"album{i % num_albums}",
+                    "content_id": f"content{i}",
+                    "indexed_at": start,
+                }
+                for i in batch
+            ],
+        )
+        # Half of the library has been downloaded.
+        session.execute(
+            insert(Download.__table__),  # type: ignore
+            [
+                {
+                    "local_filepath": f"{BASE_PATH}/Album {i % num_albums}/IMG_{i}.jpg",
+                    "local_filename": f"IMG_{i}.jpg",
+                    "content_id": f"content{i}",
+                    "download_run_id": download_run_id,
+                    "timestamp": start,
+                }
+                for i in batch
+                if i % 2 == 0
+            ],
+        )
+
+    session.commit()
+
+
+def measure(name: str, query: Callable[[], Any], repeats: int = 200):
+    query()  # Warm the page cache.
+    timings: List[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        query()
+        timings.append(time.perf_counter() - start)
+
+    median = statistics.median(timings) * 1000
+    p95 = sorted(timings)[int(repeats * 0.95)] * 1000
+    print(f"{name:<40} median {median:8.3f} ms  p95 {p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = get_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        with Session(engine) as session:
+            start = time.perf_counter()
+            populate(session, args.rows)
+            print(f"Populated {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+            content_ids = [f"content{i}" for i in range(0, ID_BATCH_SIZE * 7, 7)]
+            downloaded = (
+                select(Download.local_filepath)
+                .where(Download.content_id.in_(content_ids))  # type: ignore
+                .where(under_path(Download.local_filepath, BASE_PATH))
+            )
+            by_album = select(AlbumContentLink.content_id).where(
+                AlbumContentLink.album_id == "album42"
+            )
+            day = datetime.datetime(2012, 6, 1)
+            by_time = select(func.count(Content.id)).where(  # type: ignore
+                Content.content_creation_time >= day,
+                Content.content_creation_time < day + datetime.timedelta(days=1),
+            )
+
+            for name, statement in [
+                (f"downloaded IN ({ID_BATCH_SIZE} ids) under path", downloaded),
+                ("content by album", by_album),
+                ("content by creation time (1 day)", by_time),
+            ]:
+                compiled = statement.compile(
+                    dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+                )
+                plan = session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+                measure(name, lambda: session.exec(statement).all())
+                for row in plan:
+                    print(f"    {row[-1]}")
+
+
+if __name__ == "__main__":
+    main()
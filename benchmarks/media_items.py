@@ -0,0 +1,113 @@
+"""Compare parsing and converting media items as pydantic models and as records.
+
+python -m benchmarks.media_items --items 100000
+"""
+
+import argparse
+import datetime
+import gc
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from gpsync.google_photos.records import MediaItemRecord
+from gpsync.google_photos.schemas.media_items import MediaItem
+from gpsync.models.index import Content
+
+
+def make_items(num_items: int) -> List[Dict[str, Any]]:
+    start = datetime.datetime(2010, 1, 1)
+    items = []
+    for i in range(num_items):
+        creation_time = start + datetime.timedelta(minutes=7 * i)
+        metadata: Dict[str, Any] = {
+            "creationTime": creation_time.isoformat() + "Z",
+            "width": "4032",
+            "height": "3024",
+        }
+        if i % 10:
+            metadata["photo"] = {"cameraMake": "Camera", "focalLength": 4.2}
+        else:
+            metadata["video"] = {"fps": 30.0, "status": "READY"}
+
+        items.append(
+            {
+                "id": f"AGj1epU{i:020d}mJvN2Qx5dGh8sKvXcZ",
+                "productUrl": f"https://photos.google.com/lr/photo/{i}",
+                "baseUrl": f"https://lh3.googleusercontent.com/lr/{i:040d}",
+                "mimeType": "video/mp4" if "video" in metadata else "image/jpeg",
+                "mediaMetadata": metadata,
+                "filename": f"IMG_{i}.jpg",
+            }
+        )
+
+    return items
+
+
+def throughput(name: str, func: Callable[[], List[Any]], num_items: int):
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    kept = func()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+
+    print(
+        f"{name:<40} {num_items / elapsed:12,.0f} items/s "
+        f"{size / num_items:8,.0f} bytes/item"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=100_000)
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+    updated_at = datetime.datetime.utcnow()
+    media_items = [MediaItem(**item) for item in items]
+    contents = [Content.from_media_item(media_item) for media_item in media_items]
+    records = [MediaItemRecord.from_api(item) for item in items]
+
+    print("Parse API responses")
+    throughput(
+        "MediaItem(**item)", lambda: [MediaItem(**item) for item in items], args.items
+    )
+    throughput(
+        "MediaItemRecord.from_api(item)",
+        lambda: [MediaItemRecord.from_api(item) for item in items],
+        args.items,
+    )
+
+    print("Convert parsed media items to index rows")
+    throughput(
+        "Content.from_media_item(...).dict()",
+        lambda: [Content.from_media_item(item).dict() for item in media_items],
+        args.items,
+    )
+    throughput(
+        "MediaItemRecord.to_content_row()",
+        lambda: [record.to_content_row(updated_at) for record in records],
+        args.items,
+    )
+
+    print("Convert index rows for downloading")
+    throughput(
+        "Content.to_media_item()",
+        lambda: [content.to_media_item() for content in contents],
+        args.items,
+    )
+    throughput(
+        "MediaItemRecord.from_content(content)",
+        lambda: [MediaItemRecord.from_content(content) for content in contents],
+        args.items,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,17 @@
+import datetime
+import uuid
+from contextlib import ExitStack, closing
 from typing import List, Optional
 
 import typer
 
-from gpsync.google_photos.client import GooglePhotosClient
-from gpsync.google_photos.creds import fetch_or_load_credentials
-from gpsync.index.indexer import GooglePhotosIndexer
-from pillow_heif import register_heif_opener
+from gpsync.google_photos.discovery import DEFAULT_DISCOVERY_CACHE_FILEPATH
+from gpsync.index.options import DEFAULT_DATABASE_URL, DownloadEngine, DownloadOrder
 
-register_heif_opener()
+# Only light modules are imported up front. The API client, image libraries, SQLModel
+# and tqdm are imported by the commands that use them, so `--help`, `status` and
+# `download --dry-run` start quickly. Those read the index with the standard library's
+# sqlite3.
 app = typer.Typer()
 
 
@@ -16,19 +20,193 @@ def download(
     creds_path: str = "",
     download_path: str = "",
     album_titles: Optional[List[str]] = None,
-    start_date: Optional[
-        str
-    ] = None,  # TODO: Is this needed or can the Indexer handle this?
-    end_date: Optional[
-        str
-    ] = None,  # TODO: Is this needed or can the Indexer handle this?
+    start_date: Optional[datetime.datetime] = typer.Option(
+        None,
+        formats=["%Y-%m-%d"],
+        help="Only sync content created on or after this date.",
+    ),
+    end_date: Optional[datetime.datetime] = typer.Option(
+        None,
+        formats=["%Y-%m-%d"],
+        help="Only sync content created on or before this date.",
+    ),
+    library: bool = typer.Option(
+        False,
+        help="Also index media items that aren't in any album. The date range is "
+        "applied by the API for these.",
+    ),
+    reencode_photos: bool = False,
+    num_threads: int = typer.Option(
+        8, help="Download threads, only used with --engine threads."
+    ),
+    http2: bool = False,
+    engine: DownloadEngine = DownloadEngine.THREADS,
+    concurrency: int = typer.Option(
+        64, help="In-flight downloads, only used with --engine asyncio."
+    ),
+    order: DownloadOrder = typer.Option(
+        DownloadOrder.INDEX, help="Order in which media items are downloaded."
+    ),
+    bandwidth_limit: Optional[str] = typer.Option(
+        None, help="Bytes per second for all downloads together, e.g. 2M."
+    ),
+    bandwidth_schedule: Optional[List[str]] = typer.Option(
+        None,
+        help="Bandwidth for a time of day, e.g. 09:00-18:00=1M or "
+        "22:00-07:00=unlimited. Overrides --bandwidth-limit while it applies.",
+    ),
+    metrics_textfile: Optional[str] = typer.Option(
+        None,
+        help="Keep Prometheus metrics of the sync in this file, e.g. for the textfile "
+        "collector of node_exporter.",
+    ),
+    metrics_port: Optional[int] = typer.Option(
+        None, help="Serve Prometheus metrics of the sync on this local port."
+    ),
+    byte_budget: Optional[str] = typer.Option(
+        None,
+        help="Stop the run after downloading this much, e.g. 10G. The next run "
+        "picks up where it stopped.",
+    ),
+    database_url: str = DEFAULT_DATABASE_URL,
+    full_sync: bool = typer.Option(
+        False, help="Index every album, even the ones that haven't changed."
+    ),
+    photo_processes: int = typer.Option(
+        0, help="Processes for embedding descriptions and re-encoding photos."
+    ),
+    discovery_cache_path: str = typer.Option(
+        DEFAULT_DISCOVERY_CACHE_FILEPATH,
+        help="Where the Photos Library API discovery document is cached.",
+    ),
+    dry_run: bool = typer.Option(
+        False,
+        help="Print what would be downloaded according to the index and exit, "
+        "without credentials or API calls.",
+    ),
 ):
+    from gpsync.index.window import DateWindow
+
+    window = DateWindow(
+        start_date=start_date.date() if start_date is not None else None,
+        end_date=end_date.date() if end_date is not None else None,
+    )
+    if dry_run:
+        from gpsync.index.planner import plan_downloads
+        from gpsync.index.readonly import connect_readonly
+
+        try:
+            connection = connect_readonly(database_url)
+        except ValueError as error:
+            raise typer.BadParameter(str(error), param_hint="--database-url")
+
+        with closing(connection):
+            plan = plan_downloads(connection, download_path, window)
+
+        for album in plan.albums:
+            typer.echo(
+                f"{album.title}: {album.items} media items, "
+                f"~{album.estimated_bytes / 1e6:,.1f} MB"
+            )
+        typer.echo(
+            f"Total: {plan.items} media items to download, "
+            f"~{plan.estimated_bytes / 1e6:,.1f} MB"
+        )
+        return
+
+    from gpsync.google_photos.bandwidth import (
+        BandwidthLimiter,
+        BandwidthSchedule,
+        BandwidthWindow,
+        parse_size,
+    )
+
+    try:
+        schedule = BandwidthSchedule(
+            bytes_per_second=parse_size(bandwidth_limit) if bandwidth_limit else None,
+            windows=[BandwidthWindow.parse(spec) for spec in bandwidth_schedule or []],
+        )
+        budget_bytes = parse_size(byte_budget) if byte_budget else None
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+
+    from gpsync.content.content_types import SaveMode, register_image_openers
+    from gpsync.google_photos.async_client import AsyncLimits
+    from gpsync.google_photos.client import GooglePhotosClient
+    from gpsync.google_photos.creds import fetch_or_load_credentials
+    from gpsync.index.indexer import GooglePhotosIndexer
+    from gpsync.metrics import MetricsServer, TextfileExporter
+
+    register_image_openers()
     credentials = fetch_or_load_credentials(creds_path, cache_filepath="creds.pickle")
-    client = GooglePhotosClient.from_credentials(credentials)
-    indexer = GooglePhotosIndexer(client=client)
-    indexer.index_albums(album_titles=album_titles)
-    indexer.index_all_album_content()
-    indexer.download_indexed_content(download_path)
+    client = GooglePhotosClient.from_credentials(
+        credentials,
+        num_threads=num_threads,
+        http2=http2,
+        discovery_cache_filepath=discovery_cache_path,
+        bandwidth_limiter=BandwidthLimiter(schedule),
+    )
+    photo_save_mode = SaveMode.REENCODE if reencode_photos else SaveMode.ORIGINAL
+    indexer = GooglePhotosIndexer(
+        client=client, photo_save_mode=photo_save_mode, database_url=database_url
+    )
+    # Metrics are exported with the ID of the download run they belong to.
+    download_run_id = uuid.uuid4()
+    labels = {"download_run": str(download_run_id)}
+    with ExitStack() as exporters:
+        if metrics_textfile is not None:
+            exporters.enter_context(TextfileExporter(metrics_textfile, labels=labels))
+        if metrics_port is not None:
+            server = exporters.enter_context(MetricsServer(metrics_port, labels=labels))
+            typer.echo(f"Serving metrics at {server.url}")
+
+        indexer.index_albums(album_titles=album_titles)
+        async_limits = AsyncLimits(download_concurrency=concurrency)
+        indexer.index_all_album_content(
+            engine=engine, async_limits=async_limits, full=full_sync, window=window
+        )
+        if library:
+            indexer.index_library_content(window=window)
+
+        stats = indexer.download_indexed_content(
+            download_path,
+            num_threads=num_threads,
+            engine=engine,
+            async_limits=async_limits,
+            photo_processes=photo_processes,
+            window=window,
+            order=order,
+            byte_budget=budget_bytes,
+            download_run_id=download_run_id,
+        )
+
+    typer.echo(
+        f"Downloaded with {stats.requests} requests over {stats.connections} connections "
+        f"({stats.hits} pool hits, {stats.misses} misses)"
+    )
+
+
+@app.command()
+def status(
+    download_path: Optional[str] = typer.Option(
+        None, help="Also count the content downloaded under this path."
+    ),
+    database_url: str = DEFAULT_DATABASE_URL,
+):
+    """Summarize the index, without credentials or API calls."""
+    from gpsync.index.status import index_status
+
+    try:
+        summary = index_status(database_url, base_path=download_path)
+    except ValueError as error:
+        raise typer.BadParameter(str(error), param_hint="--database-url")
+
+    typer.echo(f"Albums: {summary.albums} ({summary.albums_to_sync} to sync)")
+    typer.echo(f"Indexed media items: {summary.content}")
+    if summary.downloaded is not None:
+        typer.echo(f"Downloaded under {download_path}: {summary.downloaded}")
+    typer.echo(f"Partial downloads: {summary.partial_downloads}")
+    typer.echo(f"Last synced: {summary.last_synced_at or 'never'}")
 
 
 if __name__ == "__main__":
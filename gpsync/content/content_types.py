@@ -1,56 +1,213 @@
+import io
+import os
+import struct
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor
+from enum import Enum
+from typing import Optional
+from xml.sax.saxutils import escape
 
-import piexif  # type: ignore
-import piexif.helper  # type: ignore
-from PIL import Image
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from gpsync.google_photos.schemas.media_items import MediaItem
+from gpsync.utils import move_into_place, temporary_filepath
+
+JPEG_MAGIC = b"\xff\xd8"
+
+XMP_SIDECAR_TEMPLATE = """<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+  <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+    <rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">
+      <dc:description>
+        <rdf:Alt>
+          <rdf:li xml:lang="x-default">{description}</rdf:li>
+        </rdf:Alt>
+      </dc:description>
+    </rdf:Description>
+  </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>
+"""
+
+
+class SaveMode(str, Enum):
+    # Write the downloaded bytes unchanged. The description is spliced into the EXIF
+    # segment of JPEGs and written to an XMP sidecar for every other format.
+    ORIGINAL = "ORIGINAL"
+
+    # Decode the photo with PIL and re-encode it with the description in its EXIF.
+    REENCODE = "REENCODE"
 
 
 class GooglePhotosContent(BaseModel, ABC):
+    """Downloaded Google Photos content backed by a temporary file on disk."""
+
     media_item: MediaItem
+    filepath: str
 
     class Config:
         arbitrary_types_allowed = True
 
+    def save(self, path: str, executor: Optional[Executor] = None) -> None:
+        self.prepare(executor)
+        self.commit(path)
+
+    def prepare(self, executor: Optional[Executor] = None) -> None:
+        """Process the temporary file before it is moved into place, e.g. embed metadata.
+
+        CPU bound processing runs on `executor` when one is given, which can be a
+        process pool."""
+
     @abstractmethod
-    def save(self, path: str) -> None:
+    def commit(self, path: str) -> None:
+        """Move the temporary file to `path`."""
         raise NotImplementedError()
 
+    def discard(self) -> None:
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
 
 class GooglePhoto(GooglePhotosContent):
-    image: Image.Image
+    save_mode: SaveMode = SaveMode.ORIGINAL
+
+    # Set by `prepare` when the description couldn't be embedded in the photo.
+    _needs_sidecar: bool = PrivateAttr(default=False)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def prepare(self, executor: Optional[Executor] = None) -> None:
+        args = (self.filepath, self.media_item.description, self.save_mode)
+        if executor is None:
+            self._needs_sidecar = process_photo(*args)
+        else:
+            self._needs_sidecar = executor.submit(process_photo, *args).result()
+
+    def commit(self, path: str) -> None:
+        move_into_place(self.filepath, path)
+
+        if self._needs_sidecar:
+            write_xmp_sidecar(f"{path}.xmp", self.media_item.description or "")
 
+
+class GoogleVideo(GooglePhotosContent):
     class Config:
         arbitrary_types_allowed = True
 
-    def save(self, path: str) -> None:
+    def commit(self, path: str) -> None:
+        move_into_place(self.filepath, path)
+
+
+def process_photo(
+    filepath: str, description: Optional[str], save_mode: SaveMode
+) -> bool:
+    """Embed `description` in the photo at `filepath` according to `save_mode`.
+
+    Returns whether the description still has to be written to a sidecar. Only takes
+    and returns picklable values, so it can run in a worker process that reads and
+    rewrites the file itself."""
+    if save_mode == SaveMode.REENCODE:
+        reencode_photo(filepath, description)
+        return False
+
+    return not embed_description(filepath, description)
+
+
+def embed_description(filepath: str, description: Optional[str]) -> bool:
+    """Splice the description into a JPEG, returning whether the photo has it now."""
+    if not description:
+        return True
+
+    if not is_jpeg(filepath):
+        return False
+
+    try:
+        insert_exif_description(filepath, description)
+        return True
+    except (ValueError, struct.error):
+        # Malformed EXIF must not cost us the photo, keep the original bytes and
+        # record the description in a sidecar instead.
+        return False
+
+
+def reencode_photo(filepath: str, description: Optional[str]) -> None:
+    # Image libraries are imported by the paths that process photos, not at startup.
+    import piexif  # type: ignore
+    from PIL import Image
+
+    with Image.open(filepath) as image:
         try:
-            exif_dict = piexif.load(self.image.info["exif"])
-            exif_dict["Exif"][
-                piexif.ExifIFD.UserComment
-            ] = piexif.helper.UserComment.dump(
-                self.media_item.description or "", encoding="unicode"
-            )
-
-            # This is a known bug with piexif (https://github.com/hMatoba/Piexif/issues/95)
-            if 41729 in exif_dict["Exif"]:
-                exif_dict["Exif"][41729] = bytes(exif_dict["Exif"][41729])
-
-            exif_bytes = piexif.dump(exif_dict)
+            exif_dict = piexif.load(image.info["exif"])
+            exif_bytes = dump_exif_with_description(exif_dict, description)
         except KeyError:
             exif_bytes = None
 
-        self.image.save(path, exif=exif_bytes)
+        encoded_filepath = temporary_filepath(filepath)
+        try:
+            image.save(encoded_filepath, format=image.format, exif=exif_bytes)
+        except BaseException:
+            if os.path.exists(encoded_filepath):
+                os.remove(encoded_filepath)
+            raise
 
+    os.replace(encoded_filepath, filepath)
 
-class GoogleVideo(GooglePhotosContent):
-    video: bytes
 
-    class Config:
-        arbitrary_types_allowed = True
+def register_image_openers() -> None:
+    """Let PIL decode HEIF photos, which iPhones upload.
+
+    Also used as the initializer of photo processing worker processes, which don't
+    inherit the registration when they are spawned rather than forked."""
+    from pillow_heif import register_heif_opener  # type: ignore
+
+    register_heif_opener()
+
+
+def is_jpeg(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(JPEG_MAGIC)) == JPEG_MAGIC
+
+
+def insert_exif_description(path: str, description: str) -> None:
+    """Splice the description into the EXIF segment of a JPEG without decoding it.
+
+    The file is only replaced once the new segment has been built, so a failure leaves
+    `path` untouched."""
+    import piexif  # type: ignore
+
+    with open(path, "rb") as file:
+        image_bytes = file.read()
+
+    exif_bytes = dump_exif_with_description(piexif.load(image_bytes), description)
+    output = io.BytesIO()
+    piexif.insert(exif_bytes, image_bytes, output)
+
+    staged_filepath = temporary_filepath(path)
+    with open(staged_filepath, "wb") as file:
+        file.write(output.getbuffer())
+
+    os.replace(staged_filepath, path)
+
+
+def dump_exif_with_description(exif_dict: dict, description: Optional[str]) -> bytes:
+    import piexif  # type: ignore
+    import piexif.helper  # type: ignore
+
+    exif_dict["Exif"][piexif.ExifIFD.UserComment] = piexif.helper.UserComment.dump(
+        description or "", encoding="unicode"
+    )
+
+    # This is a known bug with piexif (https://github.com/hMatoba/Piexif/issues/95)
+    if 41729 in exif_dict["Exif"]:
+        exif_dict["Exif"][41729] = bytes(exif_dict["Exif"][41729])
+
+    return piexif.dump(exif_dict)
+
+
+def write_xmp_sidecar(path: str, description: str) -> None:
+    staged_filepath = temporary_filepath(path)
+    with open(staged_filepath, "w", encoding="utf-8") as file:
+        file.write(XMP_SIDECAR_TEMPLATE.format(description=escape(description)))
 
-    def save(self, path: str) -> None:
-        with open(path, "wb") as file:
-            file.write(self.video)
+    os.replace(staged_filepath, path)
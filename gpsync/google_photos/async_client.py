@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import Executor
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+import httpx
+from pydantic import BaseModel, Field, PrivateAttr
+
+from gpsync.content.content_types import GooglePhotosContent, SaveMode
+from gpsync.google_photos.bandwidth import ByteBudget, ByteBudgetExhausted
+from gpsync.google_photos.client import (
+    DOWNLOAD_CHUNK_SIZE,
+    GooglePhotosClient,
+    create_google_photos_content,
+)
+from gpsync.google_photos.partial import Checkpoint, PartialFile
+from gpsync.google_photos.rate_limit import (
+    RETRYABLE_STATUS_CODES,
+    AsyncRateLimiter,
+    EndpointClass,
+    Throttled,
+    parse_retry_after,
+)
+from gpsync.google_photos.records import MediaItemRecord
+from gpsync.google_photos.schemas.albums import Album
+from gpsync.google_photos.schemas.media_items import MediaItem, SearchMediaItemsRequest
+from gpsync.google_photos.transport import TransportStats
+from gpsync.metrics import (
+    BYTES_DOWNLOADED,
+    DOWNLOAD_SECONDS,
+    HTTP_ERRORS,
+    QUEUE_DEPTH,
+    SAVE_SECONDS,
+    URL_REFRESHES,
+)
+
+T = TypeVar("T")
+
+# Marks that a download worker has drained the queue of pending media items.
+_WORKER_DONE = object()
+
+
+class AsyncLimits(BaseModel):
+    """Concurrency limits for each stage of the asyncio download engine."""
+
+    # Google Photos Library API calls (paging and URL refreshes) run on threads.
+    api_concurrency: int = 4
+
+    # In-flight content downloads, each one is a coroutine rather than a thread.
+    download_concurrency: int = 64
+
+    # Chunks being written to disk and downloads being saved concurrently.
+    write_concurrency: int = 8
+
+    # Media items buffered between paging and the download workers.
+    queue_size: int = 256
+
+
+class AsyncGooglePhotosClient(BaseModel):
+    """asyncio download engine built on top of a `GooglePhotosClient`.
+
+    Must be used as an async context manager, which owns the HTTP connection pool and
+    the per-stage concurrency limits:
+
+        async with AsyncGooglePhotosClient(client=client) as async_client:
+            async for content in async_client.download_album(album, download_dir):
+                await async_client.save(content, path)
+    """
+
+    client: GooglePhotosClient
+    limits: AsyncLimits = Field(default_factory=AsyncLimits)
+
+    _http: Optional[httpx.AsyncClient] = PrivateAttr(default=None)
+    _stats: TransportStats = PrivateAttr(default_factory=TransportStats)
+    _api_semaphore: Optional[asyncio.Semaphore] = PrivateAttr(default=None)
+    _write_semaphore: Optional[asyncio.Semaphore] = PrivateAttr(default=None)
+    _rate_limiter: Optional[AsyncRateLimiter] = PrivateAttr(default=None)
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    async def __aenter__(self) -> AsyncGooglePhotosClient:
+        self._http = httpx.AsyncClient(
+            http2=self.client.http2,
+            limits=httpx.Limits(
+                max_connections=self.limits.download_concurrency,
+                max_keepalive_connections=self.limits.download_concurrency,
+            ),
+            follow_redirects=True,
+        )
+        self._api_semaphore = asyncio.Semaphore(self.limits.api_concurrency)
+        self._write_semaphore = asyncio.Semaphore(self.limits.write_concurrency)
+        self._rate_limiter = self.client.rate_limiter.for_asyncio()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            raise RuntimeError(
+                "AsyncGooglePhotosClient must be used as an async context manager"
+            )
+
+        return self._http
+
+    @property
+    def rate_limiter(self) -> AsyncRateLimiter:
+        if self._rate_limiter is None:
+            raise RuntimeError(
+                "AsyncGooglePhotosClient must be used as an async context manager"
+            )
+
+        return self._rate_limiter
+
+    def stats(self) -> TransportStats:
+        return self._stats.copy()
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self._stats.connections += 1
+
+    async def _call_api(self, func: Callable[..., T], *args: Any) -> T:
+        assert self._api_semaphore is not None
+        async with self._api_semaphore:
+            return await asyncio.to_thread(func, *args)
+
+    async def iter_album_media_items(self, album: Album) -> AsyncIterator[MediaItem]:
+        async for records in self.iter_album_media_item_pages(album):
+            for record in records:
+                yield record.to_media_item()
+
+    async def iter_album_media_item_pages(
+        self, album: Album
+    ) -> AsyncIterator[List[MediaItemRecord]]:
+        request = SearchMediaItemsRequest(album_id=album.id, page_size=100)
+        while True:
+            records, next_page_token = await self._call_api(
+                self.client.search_media_item_records, request
+            )
+            yield records
+
+            if next_page_token is None:
+                break
+
+            request.page_token = next_page_token
+
+    async def get_media_item(self, media_item_id: str) -> MediaItem:
+        return await self._call_api(self.client.get_media_item, media_item_id)
+
+    async def batch_get_media_items(self, media_item_ids: List[str]) -> List[MediaItem]:
+        return await self._call_api(self.client.batch_get_media_items, media_item_ids)
+
+    async def download_media_item(
+        self,
+        media_item: MediaItem,
+        download_dir: Optional[str] = None,
+        photo_save_mode: SaveMode = SaveMode.ORIGINAL,
+        checkpoint: Optional[Checkpoint] = None,
+        budget: Optional[ByteBudget] = None,
+    ) -> GooglePhotosContent:
+        with DOWNLOAD_SECONDS.time():
+            filepath = await self._download_to_file(
+                media_item, download_dir, checkpoint, budget
+            )
+
+        return create_google_photos_content(media_item, filepath, photo_save_mode)
+
+    async def _download_to_file(
+        self,
+        media_item: MediaItem,
+        download_dir: Optional[str],
+        checkpoint: Optional[Checkpoint],
+        budget: Optional[ByteBudget],
+    ) -> str:
+        filepath = await self.rate_limiter.call(
+            EndpointClass.CONTENT,
+            self._stream_download,
+            media_item.download_url,
+            media_item,
+            download_dir,
+            checkpoint,
+            budget,
+        )
+        is_download_url_stale = filepath is None
+        if is_download_url_stale:
+            URL_REFRESHES.inc(reason="expired")
+            media_item_with_refreshed_download_url = await self.get_media_item(
+                media_item.id
+            )
+            filepath = await self.rate_limiter.call(
+                EndpointClass.CONTENT,
+                self._stream_download,
+                media_item_with_refreshed_download_url.download_url,
+                media_item,
+                download_dir,
+                checkpoint,
+                budget,
+            )
+
+        if filepath is None:
+            raise RuntimeError(f"Failed to download media_item {media_item.filename}")
+
+        return filepath
+
+    async def _stream_download(
+        self,
+        url: str,
+        media_item: MediaItem,
+        download_dir: Optional[str],
+        checkpoint: Optional[Checkpoint] = None,
+        budget: Optional[ByteBudget] = None,
+    ) -> Optional[str]:
+        """Stream `url` to a temporary file, returning None if the URL has expired."""
+        assert self._write_semaphore is not None
+        if budget is not None:
+            budget.check()
+
+        part = await asyncio.to_thread(
+            PartialFile, download_dir, media_item.id, checkpoint
+        )
+        self._stats.requests += 1
+        async with self.http.stream(
+            "GET",
+            url,
+            headers=part.request_headers,
+            extensions={"trace": self._trace},
+        ) as response:
+            if response.status_code == 403:
+                HTTP_ERRORS.inc(endpoint_class=EndpointClass.CONTENT.value, status=403)
+                return None
+
+            if response.status_code == 416 and part.is_complete(response.headers):
+                return part.filepath
+
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                HTTP_ERRORS.inc(
+                    endpoint_class=EndpointClass.CONTENT.value,
+                    status=response.status_code,
+                )
+                raise Throttled(
+                    response.status_code,
+                    parse_retry_after(response.headers.get("Retry-After")),
+                )
+
+            if response.status_code >= 400:
+                raise RuntimeError(
+                    f"Failed to download media_item {media_item.filename}"
+                )
+
+            file = await asyncio.to_thread(
+                part.open, response.status_code, response.headers
+            )
+            try:
+                with file:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        bandwidth_limiter = self.client.bandwidth_limiter
+                        if bandwidth_limiter is not None:
+                            wait_time = bandwidth_limiter.reserve(len(chunk))
+                            if wait_time:
+                                await asyncio.sleep(wait_time)
+                        async with self._write_semaphore:
+                            await asyncio.to_thread(part.write, file, chunk)
+                        BYTES_DOWNLOADED.inc(len(chunk))
+                        if budget is not None:
+                            budget.spend(len(chunk))
+
+                return part.finish()
+            except BaseException:
+                part.abandon()
+                raise
+
+    async def download_media_items(
+        self,
+        media_items: Union[Iterable[MediaItem], AsyncIterable[MediaItem]],
+        download_dir: Optional[str] = None,
+        photo_save_mode: SaveMode = SaveMode.ORIGINAL,
+        checkpoint: Optional[Checkpoint] = None,
+        budget: Optional[ByteBudget] = None,
+    ) -> AsyncIterator[GooglePhotosContent]:
+        """Download media items, yielding content in the order downloads complete.
+
+        Media items are fed through a bounded queue to `download_concurrency` workers so
+        a slow item only occupies one worker instead of stalling the others. Once
+        `budget` is spent the remaining media items are skipped."""
+        num_workers = self.limits.download_concurrency
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.limits.queue_size)
+        completed: asyncio.Queue = asyncio.Queue()
+
+        async def produce() -> None:
+            try:
+                if isinstance(media_items, AsyncIterable):
+                    async for media_item in media_items:
+                        await pending.put(media_item)
+                else:
+                    for media_item in media_items:
+                        await pending.put(media_item)
+            except asyncio.CancelledError:
+                # Workers are being cancelled too, nothing is left to drain the queue.
+                raise
+            except Exception as error:
+                await completed.put(error)
+
+            for _ in range(num_workers):
+                await pending.put(None)
+
+        async def work() -> None:
+            while True:
+                media_item = await pending.get()
+                QUEUE_DEPTH.set(pending.qsize(), queue="download")
+                if media_item is None:
+                    break
+
+                try:
+                    content = await self.download_media_item(
+                        media_item, download_dir, photo_save_mode, checkpoint, budget
+                    )
+                    await completed.put(content)
+                except ByteBudgetExhausted:
+                    continue
+                except Exception as error:
+                    await completed.put(error)
+
+            await completed.put(_WORKER_DONE)
+
+        tasks: List[asyncio.Task] = [asyncio.create_task(produce())]
+        tasks.extend(asyncio.create_task(work()) for _ in range(num_workers))
+
+        num_workers_done = 0
+        try:
+            while num_workers_done < num_workers:
+                result = await completed.get()
+                if result is _WORKER_DONE:
+                    num_workers_done += 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            # Content that was downloaded but never yielded still owns a temporary file.
+            while not completed.empty():
+                result = completed.get_nowait()
+                if isinstance(result, GooglePhotosContent):
+                    result.discard()
+
+    async def save(
+        self,
+        content: GooglePhotosContent,
+        path: str,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        """Save content on a thread so that moving or rewriting it doesn't block downloads.
+
+        Photos are processed on `executor` when one is given."""
+        assert self._write_semaphore is not None
+        async with self._write_semaphore:
+            with SAVE_SECONDS.time(step="process"):
+                await asyncio.to_thread(content.prepare, executor)
+            with SAVE_SECONDS.time(step="store"):
+                await asyncio.to_thread(content.commit, path)
+
+    def download_album(
+        self,
+        album: Album,
+        download_dir: Optional[str] = None,
+        photo_save_mode: SaveMode = SaveMode.ORIGINAL,
+    ) -> AsyncIterator[GooglePhotosContent]:
+        """Page through an album and download its media items as pages arrive."""
+        return self.download_media_items(
+            self.iter_album_media_items(album), download_dir, photo_save_mode
+        )
@@ -0,0 +1,152 @@
+import datetime
+import re
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from pydantic import BaseModel
+
+from gpsync.google_photos.rate_limit import TokenBucket
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+SIZE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?", re.IGNORECASE)
+
+# A window without a limit, e.g. "00:00-07:00=unlimited".
+UNLIMITED = "unlimited"
+
+
+class ByteBudgetExhausted(Exception):
+    """Raised by a download that ran out of the run's byte budget."""
+
+
+def parse_size(value: str) -> int:
+    """Parse a number of bytes such as "500", "1.5M" or "10GiB", in powers of 1024."""
+    match = SIZE_PATTERN.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid size {value!r}, expected e.g. 500K, 10M or 2G")
+
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+class BandwidthWindow(BaseModel):
+    """Time of day during which downloads are limited to `bytes_per_second`.
+
+    A window that ends at or before its start runs past midnight."""
+
+    start: datetime.time
+    end: datetime.time
+    # None for no limit.
+    bytes_per_second: Optional[int]
+
+    @staticmethod
+    def parse(spec: str) -> "BandwidthWindow":
+        """Parse "HH:MM-HH:MM=RATE", e.g. "09:00-18:00=2M" or "22:00-07:00=unlimited"."""
+        try:
+            times, rate = spec.split("=")
+            start, end = times.split("-")
+            return BandwidthWindow(
+                start=datetime.time.fromisoformat(start.strip()),
+                end=datetime.time.fromisoformat(end.strip()),
+                bytes_per_second=(
+                    None if rate.strip().lower() == UNLIMITED else parse_size(rate)
+                ),
+            )
+        except ValueError as error:
+            raise ValueError(
+                f"Invalid bandwidth window {spec!r}, expected e.g. 09:00-18:00=2M"
+            ) from error
+
+    def contains(self, time_of_day: datetime.time) -> bool:
+        if self.start < self.end:
+            return self.start <= time_of_day < self.end
+
+        return time_of_day >= self.start or time_of_day < self.end
+
+
+class BandwidthSchedule(BaseModel):
+    """Download bandwidth for each time of day.
+
+    The first window that contains the time of day applies, `bytes_per_second` applies
+    outside of all of them. None means no limit."""
+
+    bytes_per_second: Optional[int] = None
+    windows: List[BandwidthWindow] = []
+
+    def rate_at(self, time_of_day: datetime.time) -> Optional[int]:
+        for window in self.windows:
+            if window.contains(time_of_day):
+                return window.bytes_per_second
+
+        return self.bytes_per_second
+
+
+class BandwidthLimiter:
+    """Process-wide token bucket of bytes shared by every download worker.
+
+    Workers take tokens for each chunk they read, so together they never download
+    faster than the rate the schedule sets for the current time of day. The bucket
+    holds a second worth of bytes for bursts."""
+
+    def __init__(
+        self,
+        schedule: BandwidthSchedule,
+        clock: Callable[[], float] = time.monotonic,
+        now: Callable[[], datetime.datetime] = datetime.datetime.now,
+        sleep: Callable[[float], Any] = time.sleep,
+    ):
+        self.schedule = schedule
+        self._clock = clock
+        self._now = now
+        self._sleep = sleep
+        self._bucket: Optional[TokenBucket] = None
+        self._lock = threading.Lock()
+
+    def reserve(self, num_bytes: int) -> float:
+        """Take `num_bytes` and return how long to wait before using them."""
+        rate = self.schedule.rate_at(self._now().time())
+        if rate is None:
+            return 0.0
+
+        with self._lock:
+            if self._bucket is None:
+                self._bucket = TokenBucket(rate, capacity=rate, clock=self._clock)
+            elif rate != self._bucket.rate:
+                self._bucket.set_rate(rate, capacity=rate)
+            bucket = self._bucket
+
+        return bucket.reserve(num_bytes)
+
+    def throttle(self, num_bytes: int) -> None:
+        wait_time = self.reserve(num_bytes)
+        if wait_time:
+            self._sleep(wait_time)
+
+
+class ByteBudget:
+    """Bytes a single run may download, shared by its download workers.
+
+    Downloads stop once the budget is spent. The download that spends the last of it
+    is cut short and, when it's large enough to resume, kept for the next run."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent >= self.limit
+
+    def check(self) -> None:
+        if self.exhausted:
+            raise ByteBudgetExhausted(f"Byte budget of {self.limit} bytes is spent")
+
+    def spend(self, num_bytes: int) -> None:
+        with self._lock:
+            self.spent += num_bytes
+            overspent = self.spent > self.limit
+
+        if overspent:
+            raise ByteBudgetExhausted(f"Byte budget of {self.limit} bytes is spent")
@@ -1,17 +1,47 @@
 from __future__ import annotations
 
-import io
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Optional
+import datetime
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 
-import requests
+import httplib2  # type: ignore
 from google.oauth2.credentials import Credentials  # type: ignore
-from googleapiclient.discovery import Resource, build  # type: ignore
-from PIL import Image
-from pydantic import BaseModel
+from google_auth_httplib2 import AuthorizedHttp  # type: ignore
+from googleapiclient.discovery import Resource, build_from_document  # type: ignore
+from googleapiclient.errors import HttpError  # type: ignore
+from googleapiclient.http import HttpRequest  # type: ignore
+from pydantic import BaseModel, Field, PrivateAttr
 from tqdm import tqdm
 
-from gpsync.content.content_types import GooglePhoto, GooglePhotosContent, GoogleVideo
+from gpsync.content.content_types import (
+    GooglePhoto,
+    GooglePhotosContent,
+    GoogleVideo,
+    SaveMode,
+)
+from gpsync.google_photos.bandwidth import BandwidthLimiter, ByteBudget
+from gpsync.google_photos.discovery import (
+    DEFAULT_DISCOVERY_CACHE_FILEPATH,
+    DISCOVERY_CACHE_TTL,
+    load_discovery_document,
+)
+from gpsync.google_photos.partial import (
+    TEMPORARY_FILE_SUFFIX,
+    Checkpoint,
+    PartialFile,
+)
+from gpsync.google_photos.rate_limit import (
+    RETRYABLE_STATUS_CODES,
+    EndpointClass,
+    EndpointLimits,
+    RateLimiter,
+    RateLimits,
+    Throttled,
+    parse_retry_after,
+)
+from gpsync.google_photos.records import MediaItemRecord
 from gpsync.google_photos.schemas.albums import (
     Album,
     ListAlbumsRequest,
@@ -20,85 +50,195 @@ from gpsync.google_photos.schemas.albums import (
     ListSharedAlbumsResponse,
 )
 from gpsync.google_photos.schemas.media_items import (
+    BatchGetMediaItemsRequest,
+    BatchGetMediaItemsResponse,
+    Filters,
     GetMediaItemRequest,
     MediaItem,
     SearchMediaItemsRequest,
     SearchMediaItemsResponse,
 )
+from gpsync.google_photos.transport import (
+    ContentResponse,
+    ContentTransport,
+    RequestsTransport,
+    TransportStats,
+    create_transport,
+)
+from gpsync.metrics import (
+    API_CALLS,
+    BYTES_DOWNLOADED,
+    DOWNLOAD_SECONDS,
+    HTTP_ERRORS,
+    URL_REFRESHES,
+)
+
+# Size of the buffer used when streaming content to disk. Peak memory for downloads is
+# bounded by num_threads * DOWNLOAD_CHUNK_SIZE rather than by the size of the media.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+# Maximum number of media items mediaItems.batchGet returns per request.
+BATCH_GET_MAX_MEDIA_ITEMS = 50
 
 
 class GooglePhotosClient(BaseModel):
     client: Resource
+    credentials: Optional[Credentials] = None
+    transport: ContentTransport = Field(default_factory=RequestsTransport)
+    http2: bool = False
+    rate_limiter: RateLimiter = Field(default_factory=RateLimiter)
+    # Caps the bytes per second of all content downloads together.
+    bandwidth_limiter: Optional[BandwidthLimiter] = None
+
+    # httplib2 connections are not thread-safe, so each thread executes API requests
+    # through its own authorized connection.
+    _thread_local: threading.local = PrivateAttr(default_factory=threading.local)
 
     class Config:
         arbitrary_types_allowed = True
 
     @staticmethod
-    def from_credentials(credentials: Credentials) -> GooglePhotosClient:
+    def from_credentials(
+        credentials: Credentials,
+        num_threads: int = 8,
+        http2: bool = False,
+        discovery_cache_filepath: str = DEFAULT_DISCOVERY_CACHE_FILEPATH,
+        discovery_cache_ttl: datetime.timedelta = DISCOVERY_CACHE_TTL,
+        bandwidth_limiter: Optional[BandwidthLimiter] = None,
+    ) -> GooglePhotosClient:
         if not credentials.valid:
             raise ValueError("Must provide valid credentials")
 
-        client = build(
-            "photoslibrary",
-            "v1",
+        # The discovery document is cached on disk, so most runs build the client
+        # without a round-trip to the discovery endpoint.
+        client = build_from_document(
+            load_discovery_document(discovery_cache_filepath, discovery_cache_ttl),
             credentials=credentials,
-            static_discovery=False,
         )
 
-        return GooglePhotosClient(client=client)
+        transport = create_transport(pool_size=num_threads, http2=http2)
+        rate_limits = RateLimits()
+        rate_limits.content = EndpointLimits(
+            rate=rate_limits.content.rate,
+            burst=rate_limits.content.burst,
+            max_concurrency=num_threads,
+        )
+        return GooglePhotosClient(
+            client=client,
+            credentials=credentials,
+            transport=transport,
+            http2=http2,
+            rate_limiter=RateLimiter(rate_limits),
+            bandwidth_limiter=bandwidth_limiter,
+        )
+
+    def _execute(self, request: HttpRequest) -> Any:
+        return self.rate_limiter.call(EndpointClass.API, self._execute_once, request)
+
+    def _execute_once(self, request: HttpRequest) -> Any:
+        API_CALLS.inc(endpoint=api_endpoint(request))
+        try:
+            http = getattr(self._thread_local, "http", None)
+            if http is None:
+                http = httplib2.Http()
+                if self.credentials is not None:
+                    http = AuthorizedHttp(self.credentials, http=http)
+                self._thread_local.http = http
+
+            return request.execute(http=http)
+        except HttpError as error:
+            status_code = int(error.resp.status)
+            if status_code in RETRYABLE_STATUS_CODES:
+                HTTP_ERRORS.inc(
+                    endpoint_class=EndpointClass.API.value, status=status_code
+                )
+                raise Throttled(
+                    status_code, parse_retry_after(error.resp.get("retry-after"))
+                ) from error
+
+            raise
 
     def list_albums(self, request: ListAlbumsRequest) -> ListAlbumsResponse:
-        response = self.client.albums().list(**request.dict(by_alias=True)).execute()
+        response = self._execute(
+            self.client.albums().list(**request.dict(by_alias=True))
+        )
         return ListAlbumsResponse(**response)
 
     def list_all_albums(self, include_shared: bool = False) -> List[Album]:
+        return list(self.iter_albums(include_shared=include_shared))
+
+    def iter_albums(self, include_shared: bool = False) -> Iterator[Album]:
+        """Yield albums as their pages arrive, only one page is held at a time."""
         request = ListAlbumsRequest()
-        response = self.list_albums(request)
-        albums = response.albums
+        while True:
+            response = self.list_albums(request)
+            yield from response.albums
+
+            if response.next_page_token is None:
+                break
 
-        while response.next_page_token is not None:
             request = ListAlbumsRequest(page_token=response.next_page_token)
-            response = self.list_albums(request)
-            albums.extend(response.albums)
 
         if include_shared:
-            shared_albums = self.list_all_shared_albums()
-            albums.extend(shared_albums)
-
-        return albums
+            yield from self.iter_shared_albums()
 
     def list_shared_albums(
         self, request: ListSharedAlbumsRequest
     ) -> ListSharedAlbumsResponse:
-        response = (
-            self.client.sharedAlbums().list(**request.dict(by_alias=True)).execute()
+        response = self._execute(
+            self.client.sharedAlbums().list(**request.dict(by_alias=True))
         )
         return ListSharedAlbumsResponse(**response)
 
     def list_all_shared_albums(self) -> List[Album]:
-        request = ListSharedAlbumsRequest()
-        response = self.list_shared_albums(request)
-        shared_albums = response.shared_albums
+        return list(self.iter_shared_albums())
 
-        while response.next_page_token is not None:
-            request = ListSharedAlbumsRequest(page_token=response.next_page_token)
+    def iter_shared_albums(self) -> Iterator[Album]:
+        request = ListSharedAlbumsRequest()
+        while True:
             response = self.list_shared_albums(request)
-            shared_albums.extend(response.shared_albums)
+            yield from response.shared_albums
+
+            if response.next_page_token is None:
+                break
 
-        return shared_albums
+            request = ListSharedAlbumsRequest(page_token=response.next_page_token)
 
     def get_media_item(self, media_item_id: str) -> MediaItem:
         request = GetMediaItemRequest(media_item_id=media_item_id)
-        response = self.client.mediaItems().get(**request.dict(by_alias=True)).execute()
+        response = self._execute(
+            self.client.mediaItems().get(**request.dict(by_alias=True))
+        )
         return MediaItem(**response)
 
+    def batch_get_media_items(self, media_item_ids: List[str]) -> List[MediaItem]:
+        """Get media items with fresh base URLs, up to 50 per request.
+
+        Media items that can't be found or accessed anymore are left out."""
+        media_items: List[MediaItem] = []
+        for start in range(0, len(media_item_ids), BATCH_GET_MAX_MEDIA_ITEMS):
+            request = BatchGetMediaItemsRequest(
+                media_item_ids=media_item_ids[start : start + BATCH_GET_MAX_MEDIA_ITEMS]
+            )
+            response = BatchGetMediaItemsResponse(
+                **self._execute(
+                    self.client.mediaItems().batchGet(**request.dict(by_alias=True))
+                )
+            )
+            media_items.extend(
+                result.media_item
+                for result in response.media_item_results
+                if result.media_item is not None
+            )
+
+        return media_items
+
     def search_media_items(
         self, request_body: SearchMediaItemsRequest
     ) -> SearchMediaItemsResponse:
-        response = (
-            self.client.mediaItems()
-            .search(body=request_body.dict(by_alias=True))
-            .execute()
+        response = self._execute(
+            self.client.mediaItems().search(body=request_body.dict(by_alias=True))
         )
         return SearchMediaItemsResponse(**response)
 
@@ -110,57 +250,197 @@ class GooglePhotosClient(BaseModel):
         this does not allow the content to be linked back to the album that it is shared under.
         There may be some hacks for this, but currently it is unknown whether it is possible
         to easily connect archived media back to the album."""
-        request = SearchMediaItemsRequest(album_id=album.id, page_size=100)
-        response = self.search_media_items(request)
-        media_items = response.media_items
+        return [
+            record.to_media_item()
+            for records in self.iter_album_media_item_pages(album)
+            for record in records
+        ]
 
-        while response.next_page_token is not None:
-            request.page_token = response.next_page_token
-            response = self.search_media_items(request)
-            media_items.extend(response.media_items)
+    def search_media_item_records(
+        self, request_body: SearchMediaItemsRequest
+    ) -> Tuple[List[MediaItemRecord], Optional[str]]:
+        """`search_media_items` parsed into records, returned with the next page token."""
+        response = self._execute(
+            self.client.mediaItems().search(body=request_body.dict(by_alias=True))
+        )
+        fetched_at = datetime.datetime.utcnow()
+        records = [
+            MediaItemRecord.from_api(item, fetched_at)
+            for item in response.get("mediaItems", [])
+        ]
+        return records, response.get("nextPageToken")
 
-        return media_items
+    def iter_album_media_item_pages(
+        self, album: Album
+    ) -> Iterator[List[MediaItemRecord]]:
+        """Yield the pages of `search_non_archived_album_media_items` as they arrive.
+
+        Memory stays bound by the page size however large the album is."""
+        return self._iter_search_pages(
+            SearchMediaItemsRequest(album_id=album.id, page_size=100)
+        )
+
+    def iter_media_item_pages(
+        self, filters: Optional[Filters] = None
+    ) -> Iterator[List[MediaItemRecord]]:
+        """Yield pages of media items across the whole library, as they arrive.
+
+        Unlike album searches, library searches can be filtered, e.g. by date, so only
+        the media items that match are listed."""
+        return self._iter_search_pages(
+            SearchMediaItemsRequest(filters=filters, page_size=100)
+        )
+
+    def _iter_search_pages(
+        self, request: SearchMediaItemsRequest
+    ) -> Iterator[List[MediaItemRecord]]:
+        while True:
+            records, next_page_token = self.search_media_item_records(request)
+            yield records
+
+            if next_page_token is None:
+                break
+
+            request.page_token = next_page_token
 
     def download_media_item(
-        self, media_item: MediaItem
+        self,
+        media_item: MediaItem,
+        download_dir: Optional[str] = None,
+        photo_save_mode: SaveMode = SaveMode.ORIGINAL,
+        checkpoint: Optional[Checkpoint] = None,
+        budget: Optional[ByteBudget] = None,
     ) -> Optional[GooglePhotosContent]:
-        response = requests.get(media_item.download_url)
-        is_download_url_stale = response.status_code == 403
+        """Stream a media item to a temporary file in `download_dir`.
+
+        The returned content only references the temporary file, calling `save` moves it
+        into place. `download_dir` should be on the same filesystem as the final
+        destination so that the move is an atomic rename.
+
+        A partial download left in `download_dir` is resumed. Large downloads report
+        their progress to `checkpoint` and are kept for the next attempt if they fail.
+        Raises `ByteBudgetExhausted` once `budget` is spent.
+        """
+        with DOWNLOAD_SECONDS.time():
+            filepath = self._download_to_file(
+                media_item, download_dir, checkpoint, budget
+            )
+
+        return create_google_photos_content(media_item, filepath, photo_save_mode)
+
+    def _download_to_file(
+        self,
+        media_item: MediaItem,
+        download_dir: Optional[str],
+        checkpoint: Optional[Checkpoint],
+        budget: Optional[ByteBudget],
+    ) -> str:
+        filepath = self.rate_limiter.call(
+            EndpointClass.CONTENT,
+            self._stream_download,
+            media_item.download_url,
+            media_item,
+            download_dir,
+            checkpoint,
+            budget,
+        )
+        is_download_url_stale = filepath is None
         if is_download_url_stale:
+            URL_REFRESHES.inc(reason="expired")
             media_item_with_refreshed_download_url = self.get_media_item(media_item.id)
-            response = requests.get(media_item_with_refreshed_download_url.download_url)
+            filepath = self.rate_limiter.call(
+                EndpointClass.CONTENT,
+                self._stream_download,
+                media_item_with_refreshed_download_url.download_url,
+                media_item,
+                download_dir,
+                checkpoint,
+                budget,
+            )
 
-        if response.status_code >= 400:
+        if filepath is None:
             raise RuntimeError(f"Failed to download media_item {media_item.filename}")
 
-        google_photos_content: Optional[GooglePhotosContent] = None
-        if media_item.media_metadata.photo is not None:
-            image = Image.open(io.BytesIO(response.content))
-            google_photos_content = GooglePhoto(media_item=media_item, image=image)
-        elif media_item.media_metadata.video is not None:
-            google_photos_content = GoogleVideo(
-                media_item=media_item, video=response.content
-            )
-        else:
-            raise ValueError(
-                "media_item is neither a photo nor a video, this shouldn't happen."
+        return filepath
+
+    def _stream_download(
+        self,
+        url: str,
+        media_item: MediaItem,
+        download_dir: Optional[str],
+        checkpoint: Optional[Checkpoint] = None,
+        budget: Optional[ByteBudget] = None,
+    ) -> Optional[str]:
+        """Stream `url` to a temporary file, returning None if the URL has expired."""
+        if budget is not None:
+            budget.check()
+
+        part = PartialFile(download_dir, media_item.id, checkpoint)
+        with self.transport.stream(url, headers=part.request_headers) as response:
+            if response.status_code == 403:
+                HTTP_ERRORS.inc(endpoint_class=EndpointClass.CONTENT.value, status=403)
+                return None
+
+            if response.status_code == 416 and part.is_complete(response.headers):
+                return part.filepath
+
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                HTTP_ERRORS.inc(
+                    endpoint_class=EndpointClass.CONTENT.value,
+                    status=response.status_code,
+                )
+                raise Throttled(
+                    response.status_code,
+                    parse_retry_after(response.headers.get("Retry-After")),
+                )
+
+            if response.status_code >= 400:
+                raise RuntimeError(
+                    f"Failed to download media_item {media_item.filename}"
+                )
+
+            return stream_to_partial_file(
+                response, part, self.bandwidth_limiter, budget
             )
 
-        return google_photos_content
+    def connection_pool_stats(self) -> TransportStats:
+        return self.transport.stats()
 
     def download_media_items(
-        self, media_items: List[MediaItem], desc: str, num_threads: int = 8
+        self,
+        media_items: List[MediaItem],
+        desc: str,
+        num_threads: int = 8,
+        download_dir: Optional[str] = None,
+        photo_save_mode: SaveMode = SaveMode.ORIGINAL,
+        checkpoint: Optional[Checkpoint] = None,
     ) -> List[GooglePhotosContent]:
-        with ThreadPoolExecutor(max_workers=num_threads) as executor:
-            google_photos_content: List[GooglePhotosContent] = list(
-                tqdm(
-                    executor.map(self.download_media_item, media_items),  # type: ignore
-                    unit=" media items",
-                    desc=desc,
-                    total=len(media_items),
-                )
+        def download(media_item: MediaItem) -> Optional[GooglePhotosContent]:
+            return self.download_media_item(
+                media_item,
+                download_dir=download_dir,
+                photo_save_mode=photo_save_mode,
+                checkpoint=checkpoint,
             )
 
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [
+                executor.submit(download, media_item) for media_item in media_items
+            ]
+            try:
+                google_photos_content: List[GooglePhotosContent] = [
+                    future.result()  # type: ignore
+                    for future in tqdm(
+                        futures,
+                        unit=" media items",
+                        desc=desc,
+                        total=len(media_items),
+                    )
+                ]
+            except BaseException:
+                discard_downloaded_content(futures)
+                raise
+
         return google_photos_content
 
     def download_album(
@@ -173,3 +453,85 @@ class GooglePhotosClient(BaseModel):
             num_threads=num_threads,
         )
         return google_photos_content
+
+
+def api_endpoint(request: HttpRequest) -> str:
+    """Name of the API method a request calls, e.g. "mediaItems.search"."""
+    method_id = getattr(request, "methodId", None) or "unknown"
+    return method_id.removeprefix("photoslibrary.")
+
+
+def create_google_photos_content(
+    media_item: MediaItem,
+    filepath: str,
+    photo_save_mode: SaveMode = SaveMode.ORIGINAL,
+) -> GooglePhotosContent:
+    google_photos_content: GooglePhotosContent
+    if media_item.media_metadata.photo is not None:
+        google_photos_content = GooglePhoto(
+            media_item=media_item, filepath=filepath, save_mode=photo_save_mode
+        )
+    elif media_item.media_metadata.video is not None:
+        google_photos_content = GoogleVideo(media_item=media_item, filepath=filepath)
+    else:
+        os.remove(filepath)
+        raise ValueError(
+            "media_item is neither a photo nor a video, this shouldn't happen."
+        )
+
+    return google_photos_content
+
+
+def discard_downloaded_content(
+    futures: List[Future[Optional[GooglePhotosContent]]],
+) -> None:
+    """Remove the temporary files of downloads that finished but were never returned."""
+    for future in futures:
+        future.cancel()
+
+    for future in futures:
+        if future.cancelled() or future.exception() is not None:
+            continue
+
+        content = future.result()
+        if content is not None:
+            content.discard()
+
+
+def remove_temporary_files(directory: str, keep: Iterable[str] = ()) -> None:
+    """Sweep temporary files left behind in `directory` by a run that was killed.
+
+    Partial downloads in `keep` are left in place to be resumed."""
+    if not os.path.isdir(directory):
+        return
+
+    keep = {os.path.abspath(filepath) for filepath in keep}
+    for filename in os.listdir(directory):
+        filepath = os.path.abspath(os.path.join(directory, filename))
+        if filename.endswith(TEMPORARY_FILE_SUFFIX) and filepath not in keep:
+            os.remove(filepath)
+
+
+def stream_to_partial_file(
+    response: ContentResponse,
+    part: PartialFile,
+    bandwidth_limiter: Optional[BandwidthLimiter] = None,
+    budget: Optional[ByteBudget] = None,
+) -> str:
+    file = part.open(response.status_code, response.headers)
+    try:
+        with file:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                # Pausing between reads backs the connection up, so the server slows
+                # down too.
+                if bandwidth_limiter is not None:
+                    bandwidth_limiter.throttle(len(chunk))
+                part.write(file, chunk)
+                BYTES_DOWNLOADED.inc(len(chunk))
+                if budget is not None:
+                    budget.spend(len(chunk))
+
+        return part.finish()
+    except BaseException:
+        part.abandon()
+        raise
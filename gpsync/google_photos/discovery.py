@@ -0,0 +1,92 @@
+import datetime
+import json
+import os
+import time
+from typing import Optional
+
+from gpsync.utils import create_directories, temporary_filepath
+
+DISCOVERY_URL = "https://photoslibrary.googleapis.com/$discovery/rest?version=v1"
+
+# Cached next to the credentials, the document only changes with the API.
+DEFAULT_DISCOVERY_CACHE_FILEPATH = "photoslibrary.v1.json"
+DISCOVERY_CACHE_TTL = datetime.timedelta(days=7)
+
+
+class DiscoveryError(RuntimeError):
+    pass
+
+
+def load_discovery_document(
+    cache_filepath: str = DEFAULT_DISCOVERY_CACHE_FILEPATH,
+    ttl: datetime.timedelta = DISCOVERY_CACHE_TTL,
+    discovery_url: str = DISCOVERY_URL,
+) -> str:
+    """Discovery document of the Photos Library API, read from the cache while it's fresh.
+
+    An expired cache is refreshed, and is still used if the discovery endpoint can't be
+    reached so that a hiccup doesn't fail the whole sync."""
+    cached = read_cached_document(cache_filepath)
+    if cached is not None and time.time() - os.path.getmtime(cache_filepath) < (
+        ttl.total_seconds()
+    ):
+        return cached
+
+    try:
+        document = fetch_discovery_document(discovery_url)
+    except DiscoveryError:
+        if cached is not None:
+            return cached
+
+        raise
+
+    write_cached_document(cache_filepath, document)
+    return document
+
+
+def fetch_discovery_document(discovery_url: str = DISCOVERY_URL) -> str:
+    # Only imported when the cache has to be refreshed.
+    import httplib2  # type: ignore
+
+    try:
+        response, content = httplib2.Http(timeout=30).request(discovery_url)
+    except (httplib2.HttpLib2Error, OSError) as error:
+        raise DiscoveryError(f"Fetching {discovery_url} failed: {error}") from error
+
+    if response.status != 200:
+        raise DiscoveryError(
+            f"Fetching {discovery_url} failed with status {response.status}"
+        )
+
+    document = content.decode()
+    if not is_discovery_document(document):
+        raise DiscoveryError(f"{discovery_url} did not return a discovery document")
+
+    return document
+
+
+def is_discovery_document(document: str) -> bool:
+    try:
+        return "resources" in json.loads(document)
+    except ValueError:
+        return False
+
+
+def read_cached_document(cache_filepath: str) -> Optional[str]:
+    """The cached document, None if there is none or it's unreadable."""
+    try:
+        with open(cache_filepath) as file:
+            document = file.read()
+    except OSError:
+        return None
+
+    return document if is_discovery_document(document) else None
+
+
+def write_cached_document(cache_filepath: str, document: str) -> None:
+    # Written next to the cache and renamed, a concurrent run never reads half of it.
+    create_directories(cache_filepath)
+    staged_filepath = temporary_filepath(cache_filepath)
+    with open(staged_filepath, "w") as file:
+        file.write(document)
+    os.replace(staged_filepath, cache_filepath)
@@ -0,0 +1,142 @@
+import os
+import re
+import tempfile
+from typing import BinaryIO, Callable, Dict, Literal, Mapping, Optional, Tuple
+
+TEMPORARY_FILE_SUFFIX = ".part"
+
+# Downloads smaller than this restart from scratch instead of being resumed, checkpoints
+# aren't worth an index write for them.
+RESUMABLE_MIN_SIZE = 16 * 1024 * 1024
+
+# Bytes downloaded between checkpoints of a resumable download.
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024
+
+# Called with (media_item_id, part_filepath, offset, total_bytes) as a resumable
+# download makes progress.
+Checkpoint = Callable[[str, str, int, int], None]
+
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)")
+
+
+class IncompleteDownload(RuntimeError):
+    pass
+
+
+def part_filepath(directory: Optional[str], media_item_id: str) -> str:
+    """Stable path of a media item's partial download, so a later run can resume it."""
+    directory = directory or tempfile.gettempdir()
+    return os.path.join(directory, f"{media_item_id}{TEMPORARY_FILE_SUFFIX}")
+
+
+def parse_content_range(value: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    """Parse the start and total length of a `Content-Range: bytes start-end/total`."""
+    if value is None:
+        return None, None
+
+    match = CONTENT_RANGE_PATTERN.fullmatch(value.strip())
+    if match is None:
+        return None, None
+
+    start, total = match.groups()
+    return (
+        None if start is None else int(start),
+        None if total == "*" else int(total),
+    )
+
+
+class PartialFile:
+    """Partial download of a media item, resumed from wherever a previous run stopped.
+
+    The bytes already on disk are requested with a `Range` header. If the server ignores
+    the range the file is rewritten from the start. Once the response is exhausted the
+    file has to be exactly as long as the server said it would be."""
+
+    def __init__(
+        self,
+        directory: Optional[str],
+        media_item_id: str,
+        checkpoint: Optional[Checkpoint] = None,
+    ):
+        self.media_item_id = media_item_id
+        self.filepath = part_filepath(directory, media_item_id)
+        self.offset = (
+            os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+        )
+        self.total: Optional[int] = None
+        self._checkpoint = checkpoint
+        self._checkpointed_offset = -1
+
+    @property
+    def request_headers(self) -> Dict[str, str]:
+        # Lengths and ranges have to refer to the bytes that end up on disk.
+        headers = {"Accept-Encoding": "identity"}
+        if self.offset:
+            headers["Range"] = f"bytes={self.offset}-"
+
+        return headers
+
+    @property
+    def resumable(self) -> bool:
+        return (
+            self._checkpoint is not None
+            and self.total is not None
+            and self.total >= RESUMABLE_MIN_SIZE
+        )
+
+    def open(self, status_code: int, headers: Mapping[str, str]) -> BinaryIO:
+        start, total = parse_content_range(headers.get("Content-Range"))
+        mode: Literal["ab", "wb"]
+        if status_code == 206 and start == self.offset:
+            mode = "ab"
+            self.total = total
+        else:
+            mode = "wb"
+            self.offset = 0
+            content_length = headers.get("Content-Length")
+            self.total = int(content_length) if content_length is not None else None
+
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        file = open(self.filepath, mode)
+        self.checkpoint()
+        return file
+
+    def write(self, file: BinaryIO, chunk: bytes) -> None:
+        file.write(chunk)
+        self.offset += len(chunk)
+        if self.offset - self._checkpointed_offset >= CHECKPOINT_INTERVAL:
+            file.flush()
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        if not self.resumable or self.offset == self._checkpointed_offset:
+            return
+
+        assert self._checkpoint is not None and self.total is not None
+        self._checkpoint(self.media_item_id, self.filepath, self.offset, self.total)
+        self._checkpointed_offset = self.offset
+
+    def finish(self) -> str:
+        if self.total is not None and self.offset != self.total:
+            if self.offset > self.total:
+                # Can't be resumed, the next attempt starts over.
+                os.remove(self.filepath)
+
+            raise IncompleteDownload(
+                f"Downloaded {self.offset} of {self.total} bytes of "
+                f"media item {self.media_item_id}"
+            )
+
+        return self.filepath
+
+    def is_complete(self, headers: Mapping[str, str]) -> bool:
+        """Whether a 416 response means the file was already downloaded in full."""
+        _, total = parse_content_range(headers.get("Content-Range"))
+        return total is not None and self.offset == total
+
+    def abandon(self) -> None:
+        """Keep a resumable download for the next run, otherwise remove it."""
+        if self.resumable:
+            self.checkpoint()
+        elif os.path.exists(self.filepath):
+            os.remove(self.filepath)
@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import email.utils
+import math
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from enum import Enum
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+
+from pydantic import BaseModel, Field
+
+T = TypeVar("T")
+
+# Responses that mean "slow down" rather than "this request is wrong".
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Concurrent requests tend to be throttled together, so a burst of throttled responses
+# only shrinks the concurrency limit once per interval.
+DECREASE_INTERVAL = 1.0
+
+
+class EndpointClass(str, Enum):
+    # Photos Library API calls (listing, searching and getting media items).
+    API = "api"
+    # Content downloads from base URLs.
+    CONTENT = "content"
+
+
+class EndpointLimits(BaseModel):
+    # Sustained requests per second and how many requests can be made in a burst.
+    rate: float
+    burst: int
+    # Upper bound for the adaptive concurrency limit.
+    max_concurrency: int
+
+
+class RateLimits(BaseModel):
+    """Limits for each class of endpoint and how throttled requests are retried."""
+
+    api: EndpointLimits = Field(
+        default_factory=lambda: EndpointLimits(rate=20, burst=50, max_concurrency=8)
+    )
+    content: EndpointLimits = Field(
+        default_factory=lambda: EndpointLimits(rate=100, burst=200, max_concurrency=64)
+    )
+    max_retries: int = 6
+    # Without a Retry-After header, retries back off exponentially from `backoff_base`
+    # up to `backoff_cap` seconds, with full jitter.
+    backoff_base: float = 1.0
+    backoff_cap: float = 60.0
+
+    def for_endpoint(self, endpoint: EndpointClass) -> EndpointLimits:
+        return self.api if endpoint == EndpointClass.API else self.content
+
+
+class Throttled(Exception):
+    """Raised for a response that should be retried once the limiter allows it."""
+
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"Throttled with status {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class RateLimitExceeded(RuntimeError):
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header, which is either delta-seconds or an HTTP date."""
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max((retry_at - now).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that lets callers take tokens on credit.
+
+    `reserve` always takes a token and returns how long the caller has to wait for the
+    bucket to have refilled it, so it works for both threads and coroutines."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            return max(-self._tokens / self.rate, 0.0)
+
+    def set_rate(self, rate: float, capacity: float) -> None:
+        """Change the rate from now on, tokens taken on credit are still owed."""
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = capacity
+            self._tokens = min(self._tokens, capacity)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+
+class AimdConcurrency:
+    """Concurrency limit with additive increase and multiplicative decrease.
+
+    Every successful request grows the limit by 1/limit, so a full window of successes
+    grows it by one. A throttled request halves it."""
+
+    def __init__(
+        self,
+        maximum: int,
+        minimum: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._clock = clock
+        self._last_decrease = -math.inf
+        self._condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+
+            self.in_flight += 1
+            return True
+
+    def acquire(self) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self) -> None:
+        with self._condition:
+            limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            if int(limit) > int(self.limit):
+                self._condition.notify()
+            self.limit = limit
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            now = self._clock()
+            if now - self._last_decrease < DECREASE_INTERVAL:
+                return
+
+            self._last_decrease = now
+            self.limit = max(float(self.minimum), self.limit / 2)
+
+
+class RateLimiter:
+    """Rate and concurrency limiter shared by API calls and content downloads.
+
+    Each class of endpoint has a token bucket for its request rate and an AIMD
+    concurrency limit. A Retry-After on a throttled response pauses every request to
+    that class of endpoint, not just the one that is retried."""
+
+    def __init__(
+        self,
+        limits: Optional[RateLimits] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Any] = time.sleep,
+    ):
+        self.limits = limits or RateLimits()
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets: Dict[EndpointClass, TokenBucket] = {}
+        self._concurrency: Dict[EndpointClass, AimdConcurrency] = {}
+        for endpoint in EndpointClass:
+            endpoint_limits = self.limits.for_endpoint(endpoint)
+            self._buckets[endpoint] = TokenBucket(
+                endpoint_limits.rate, endpoint_limits.burst, clock=clock
+            )
+            self._concurrency[endpoint] = AimdConcurrency(
+                endpoint_limits.max_concurrency, clock=clock
+            )
+        self._paused_until = {endpoint: -math.inf for endpoint in EndpointClass}
+        self._lock = threading.Lock()
+
+    def concurrency(self, endpoint: EndpointClass) -> AimdConcurrency:
+        return self._concurrency[endpoint]
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after
+
+        ceiling = min(self.limits.backoff_cap, self.limits.backoff_base * 2**attempt)
+        return random.uniform(0, ceiling)
+
+    def _wait_time(self, endpoint: EndpointClass) -> float:
+        with self._lock:
+            paused = max(self._paused_until[endpoint] - self._clock(), 0.0)
+
+        return max(paused, self._buckets[endpoint].reserve())
+
+    def _throttled(self, endpoint: EndpointClass, throttled: Throttled) -> None:
+        self._concurrency[endpoint].on_throttle()
+        if throttled.retry_after is not None:
+            with self._lock:
+                self._paused_until[endpoint] = max(
+                    self._paused_until[endpoint],
+                    self._clock() + throttled.retry_after,
+                )
+
+    @contextmanager
+    def limit(self, endpoint: EndpointClass) -> Iterator[None]:
+        """Wait for a request slot, raise `Throttled` inside to report throttling."""
+        wait_time = self._wait_time(endpoint)
+        if wait_time:
+            self._sleep(wait_time)
+
+        concurrency = self._concurrency[endpoint]
+        concurrency.acquire()
+        try:
+            yield
+        except Throttled as throttled:
+            self._throttled(endpoint, throttled)
+            raise
+        else:
+            concurrency.on_success()
+        finally:
+            concurrency.release()
+
+    def call(self, endpoint: EndpointClass, func: Callable[..., T], *args: Any) -> T:
+        """Call `func` within the limits, retrying while it raises `Throttled`."""
+        for attempt in range(self.limits.max_retries + 1):
+            try:
+                with self.limit(endpoint):
+                    return func(*args)
+            except Throttled as throttled:
+                if attempt == self.limits.max_retries:
+                    raise RateLimitExceeded(
+                        f"Still throttled after {attempt + 1} attempts"
+                    ) from throttled
+
+                self._sleep(self.backoff(attempt, throttled.retry_after))
+
+        raise AssertionError("unreachable")
+
+    def for_asyncio(self) -> AsyncRateLimiter:
+        """Create a view of this limiter for coroutines on the running event loop."""
+        return AsyncRateLimiter(self)
+
+
+class AsyncRateLimiter:
+    """asyncio counterpart of `RateLimiter.limit` and `RateLimiter.call`.
+
+    Shares the buckets, concurrency limits and pauses of the `RateLimiter` it was
+    created from, but waits without blocking the event loop."""
+
+    def __init__(self, limiter: RateLimiter):
+        self._limiter = limiter
+        self._conditions = {endpoint: asyncio.Condition() for endpoint in EndpointClass}
+
+    @asynccontextmanager
+    async def limit(self, endpoint: EndpointClass) -> AsyncIterator[None]:
+        wait_time = self._limiter._wait_time(endpoint)
+        if wait_time:
+            await asyncio.sleep(wait_time)
+
+        concurrency = self._limiter.concurrency(endpoint)
+        condition = self._conditions[endpoint]
+        async with condition:
+            await condition.wait_for(concurrency.try_acquire)
+
+        try:
+            yield
+        except Throttled as throttled:
+            self._limiter._throttled(endpoint, throttled)
+            raise
+        else:
+            concurrency.on_success()
+        finally:
+            concurrency.release()
+            async with condition:
+                condition.notify()
+
+    async def call(
+        self, endpoint: EndpointClass, func: Callable[..., Awaitable[T]], *args: Any
+    ) -> T:
+        limits = self._limiter.limits
+        for attempt in range(limits.max_retries + 1):
+            try:
+                async with self.limit(endpoint):
+                    return await func(*args)
+            except Throttled as throttled:
+                if attempt == limits.max_retries:
+                    raise RateLimitExceeded(
+                        f"Still throttled after {attempt + 1} attempts"
+                    ) from throttled
+
+                await asyncio.sleep(
+                    self._limiter.backoff(attempt, throttled.retry_after)
+                )
+
+        raise AssertionError("unreachable")
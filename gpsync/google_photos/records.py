@@ -0,0 +1,179 @@
+import datetime
+from typing import Any, Dict, Optional
+
+from gpsync.google_photos.schemas.media_items import (
+    MediaItem,
+    MediaMetadata,
+    Photo,
+    Video,
+    VideoProcessingStatus,
+)
+
+
+def parse_creation_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class MediaItemRecord:
+    """The fields of a media item that indexing and downloading need.
+
+    Large libraries hold hundreds of thousands of media items, so on the hot paths they
+    are slotted records parsed straight from API responses and index rows instead of
+    pydantic models. `MediaItem` is still used at the edges, e.g. for the media items
+    that are handed to the client to download."""
+
+    __slots__ = (
+        "id",
+        "base_url",
+        "mime_type",
+        "filename",
+        "content_creation_time",
+        "width",
+        "height",
+        "is_video",
+        "description",
+        "fps",
+        "status",
+        "base_url_fetched_at",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        base_url: str,
+        mime_type: str,
+        filename: str,
+        content_creation_time: datetime.datetime,
+        width: int,
+        height: int,
+        is_video: bool,
+        description: Optional[str] = None,
+        fps: Optional[float] = None,
+        status: Optional[VideoProcessingStatus] = None,
+        base_url_fetched_at: Optional[datetime.datetime] = None,
+    ):
+        self.id = id
+        self.base_url = base_url
+        self.mime_type = mime_type
+        self.filename = filename
+        self.content_creation_time = content_creation_time
+        self.width = width
+        self.height = height
+        self.is_video = is_video
+        self.description = description
+        self.fps = fps
+        self.status = status
+        self.base_url_fetched_at = base_url_fetched_at
+
+    def __repr__(self) -> str:
+        return f"MediaItemRecord(id={self.id!r}, filename={self.filename!r})"
+
+    @property
+    def download_url(self) -> str:
+        return self.base_url + ("=dv" if self.is_video else "=d")
+
+    @staticmethod
+    def from_api(
+        item: Dict[str, Any], fetched_at: Optional[datetime.datetime] = None
+    ) -> "MediaItemRecord":
+        """Parse a media item of an API response, raising ValueError if it's malformed.
+
+        Checks what `MediaItem` would for the fields that are kept."""
+        try:
+            metadata = item["mediaMetadata"]
+            video = metadata.get("video")
+            if video is None and metadata.get("photo") is None:
+                raise ValueError("neither a photo nor a video")
+
+            return MediaItemRecord(
+                id=str(item["id"]),
+                base_url=str(item["baseUrl"]),
+                mime_type=str(item["mimeType"]),
+                filename=str(item["filename"]),
+                content_creation_time=parse_creation_time(metadata["creationTime"]),
+                width=int(metadata["width"]),
+                height=int(metadata["height"]),
+                is_video=video is not None,
+                description=item.get("description"),
+                fps=float(video["fps"]) if video is not None else None,
+                status=(
+                    VideoProcessingStatus(video["status"])
+                    if video is not None
+                    else None
+                ),
+                base_url_fetched_at=fetched_at,
+            )
+        except (KeyError, TypeError, ValueError) as error:
+            raise ValueError(
+                f"Malformed media item {item.get('id')!r}: {error!r}"
+            ) from error
+
+    @staticmethod
+    def from_content(content: Any) -> "MediaItemRecord":
+        """Create a record from a `Content` row, or a row of some of its columns."""
+        return MediaItemRecord(
+            id=content.id,
+            base_url=content.base_url,
+            mime_type=content.mime_type,
+            filename=content.google_photos_filename,
+            content_creation_time=content.content_creation_time,
+            width=content.width,
+            height=content.height,
+            is_video="video" in content.mime_type,
+            description=content.description,
+            fps=content.fps,
+            status=content.status,
+            base_url_fetched_at=content.base_url_fetched_at,
+        )
+
+    def to_content_row(self, updated_at: datetime.datetime) -> Dict[str, Any]:
+        """Columns of the `Content` row of this media item, for bulk upserts."""
+        return {
+            "id": self.id,
+            "base_url": self.base_url,
+            "download_url": self.download_url,
+            "base_url_fetched_at": self.base_url_fetched_at or updated_at,
+            "google_photos_filename": self.filename,
+            "content_creation_time": self.content_creation_time,
+            "height": self.height,
+            "width": self.width,
+            "mime_type": self.mime_type,
+            "description": self.description,
+            "fps": self.fps,
+            "status": self.status,
+            "created_at": updated_at,
+            "updated_at": updated_at,
+        }
+
+    def to_media_item(self) -> MediaItem:
+        photo: Optional[Photo] = None
+        video: Optional[Video] = None
+
+        if "image" in self.mime_type:
+            photo = Photo()
+        elif "video" in self.mime_type:
+            if self.fps is None or self.status is None:
+                raise ValueError("fps and status cannot be None for videos")
+
+            video = Video(fps=self.fps, status=self.status)
+        else:
+            raise ValueError(
+                "media_item is neither a photo nor a video, this shouldn't happen."
+            )
+
+        media_metadata = MediaMetadata(
+            creation_time=self.content_creation_time.isoformat().replace("+00:00", "Z"),
+            width=str(self.width),
+            height=str(self.height),
+            photo=photo,
+            video=video,
+        )
+        return MediaItem(
+            id=self.id,
+            product_url="",
+            base_url=self.base_url,
+            mime_type=self.mime_type,
+            filename=self.filename,
+            description=self.description,
+            media_metadata=media_metadata,
+        )
@@ -161,3 +161,22 @@ class SearchMediaItemsRequest(GoogleApiBaseModel):
 class SearchMediaItemsResponse(GoogleApiBaseModel):
     media_items: List[MediaItem] = Field(default_factory=list)
     next_page_token: Optional[str] = None
+
+
+class BatchGetMediaItemsRequest(GoogleApiBaseModel):
+    # At most 50 media items can be requested at a time.
+    media_item_ids: List[str]
+
+
+class Status(GoogleApiBaseModel):
+    code: Optional[int] = None
+    message: Optional[str] = None
+
+
+class MediaItemResult(GoogleApiBaseModel):
+    media_item: Optional[MediaItem] = None
+    status: Optional[Status] = None
+
+
+class BatchGetMediaItemsResponse(GoogleApiBaseModel):
+    media_item_results: List[MediaItemResult] = Field(default_factory=list)
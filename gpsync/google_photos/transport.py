@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+import httpx
+import requests
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+
+
+class TransportStats(BaseModel):
+    """Connection pool counters for a transport.
+
+    Every request either reuses a pooled keep-alive connection (a hit) or has to open a
+    new connection (a miss)."""
+
+    requests: int = 0
+    connections: int = 0
+
+    @property
+    def hits(self) -> int:
+        return max(self.requests - self.connections, 0)
+
+    @property
+    def misses(self) -> int:
+        return self.connections
+
+
+class ContentResponse(ABC):
+    status_code: int
+    headers: Mapping[str, str]
+
+    @abstractmethod
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        raise NotImplementedError()
+
+
+class ContentTransport(ABC):
+    """Thread-safe HTTP transport shared by every download worker of a client."""
+
+    @abstractmethod
+    @contextmanager
+    def stream(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Iterator[ContentResponse]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def stats(self) -> TransportStats:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def close(self) -> None:
+        raise NotImplementedError()
+
+
+class RequestsContentResponse(ContentResponse):
+    def __init__(self, response: requests.Response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._response = response
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        return self._response.iter_content(chunk_size=chunk_size)
+
+
+class RequestsTransport(ContentTransport):
+    """HTTP/1.1 keep-alive transport backed by a pooled `requests.Session`."""
+
+    def __init__(self, pool_size: int = 8):
+        self._session = requests.Session()
+        self._adapter = HTTPAdapter(pool_maxsize=pool_size, pool_block=True)
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+
+    @contextmanager
+    def stream(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Iterator[ContentResponse]:
+        with self._session.get(url, headers=headers, stream=True) as response:
+            yield RequestsContentResponse(response)
+
+    def stats(self) -> TransportStats:
+        stats = TransportStats()
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+
+            stats.requests += pool.num_requests
+            stats.connections += pool.num_connections
+
+        return stats
+
+    def close(self) -> None:
+        self._session.close()
+
+
+class HttpxContentResponse(ContentResponse):
+    def __init__(self, response: httpx.Response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._response = response
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        return self._response.iter_bytes(chunk_size=chunk_size)
+
+
+class HttpxTransport(ContentTransport):
+    """Keep-alive transport backed by `httpx`, optionally negotiating HTTP/2."""
+
+    def __init__(self, pool_size: int = 8, http2: bool = True):
+        self._client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            follow_redirects=True,
+        )
+        self._lock = threading.Lock()
+        self._stats = TransportStats()
+
+    def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._stats.connections += 1
+
+    @contextmanager
+    def stream(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Iterator[ContentResponse]:
+        with self._lock:
+            self._stats.requests += 1
+
+        with self._client.stream(
+            "GET", url, headers=headers, extensions={"trace": self._trace}
+        ) as response:
+            yield HttpxContentResponse(response)
+
+    def stats(self) -> TransportStats:
+        with self._lock:
+            return self._stats.copy()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def create_transport(pool_size: int = 8, http2: bool = False) -> ContentTransport:
+    if http2:
+        return HttpxTransport(pool_size=pool_size, http2=True)
+
+    return RequestsTransport(pool_size=pool_size)
@@ -0,0 +1,95 @@
+"""The index database, kept free of the API client so that it's cheap to import."""
+
+from typing import Any, Dict, List, Type
+
+from sqlalchemy import and_, event
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.future import Engine
+from sqlalchemy.pool import QueuePool
+from sqlmodel import Session, SQLModel, create_engine
+
+from gpsync.index.options import DEFAULT_DATABASE_URL
+from gpsync.models.migrations import migrate
+
+IN_MEMORY_SQLITE_URLS = {"sqlite://", "sqlite:///:memory:"}
+
+SQLITE_PRAGMAS = {
+    # Readers (progress, queries) don't block the writer and vice versa.
+    "journal_mode": "WAL",
+    # Durable under WAL, only the last transactions can be lost on power failure.
+    "synchronous": "NORMAL",
+    # Negative values are in KiB, so this is a 64MiB page cache per connection.
+    "cache_size": -64000,
+    # Wait for a competing writer instead of failing with "database is locked".
+    "busy_timeout": 5000,
+}
+
+
+def get_engine(url: str = DEFAULT_DATABASE_URL, pool_size: int = 8) -> Engine:
+    """Create an engine for the index and make sure its schema exists.
+
+    This is relatively expensive, create one engine and reuse it for every session. The
+    tables are those of the models imported from `gpsync.models.index`."""
+    if url.startswith("sqlite") and url not in IN_MEMORY_SQLITE_URLS:
+        engine = create_engine(
+            url,
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            connect_args={"check_same_thread": False},
+        )
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    else:
+        engine = create_engine(url)
+
+    SQLModel.metadata.create_all(engine)
+    migrate(engine)
+    return engine
+
+
+def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+def under_path(column: Any, base_path: str) -> Any:
+    """Filter `column` to file paths inside `base_path`.
+
+    Unlike LIKE 'base_path%' this is a range over the column, so SQLite can serve it from
+    an index. "0" is the character after "/", so the range covers exactly the paths
+    starting with "base_path/"."""
+    base_path = base_path.rstrip("/")
+    return and_(column >= f"{base_path}/", column < f"{base_path}0")
+
+
+def upsert(
+    session: Session,
+    model: Type[SQLModel],
+    rows: List[Dict[str, Any]],
+    update_columns: List[str],
+):
+    """Bulk `INSERT ... ON CONFLICT (primary key) DO UPDATE` of `rows` into `model`.
+
+    With no `update_columns`, existing rows are left untouched."""
+    if not rows:
+        return
+
+    table = model.__table__  # type: ignore
+    insert = (
+        postgresql_insert
+        if session.get_bind().dialect.name == "postgresql"
+        else sqlite_insert
+    )
+    statement = insert(table).values(rows)
+    primary_key = [column.name for column in table.primary_key.columns]
+    if update_columns:
+        statement = statement.on_conflict_do_update(
+            index_elements=primary_key,
+            set_={column: statement.excluded[column] for column in update_columns},
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=primary_key)
+
+    session.execute(statement)
@@ -1,160 +1,1107 @@
-from typing import Generator, List, Optional, TypeVar
+import asyncio
+import datetime
+import hashlib
+import itertools
+import os
+import queue
+import uuid
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
-from pydantic import BaseModel
-from sqlalchemy.future import Engine
-from sqlmodel import Session, SQLModel, create_engine, select
+from pydantic import BaseModel, PrivateAttr
+from sqlalchemy import String, bindparam, column, delete, text, update
+from sqlalchemy.future import Connection, Engine
+from sqlalchemy.sql.selectable import TextualSelect
+from sqlmodel import Session, select
 from tqdm import tqdm
 
-from gpsync.google_photos.client import GooglePhotosClient
+from gpsync.content.content_types import (
+    GooglePhotosContent,
+    SaveMode,
+    register_image_openers,
+)
+from gpsync.google_photos.async_client import AsyncGooglePhotosClient, AsyncLimits
+from gpsync.google_photos.bandwidth import ByteBudget, ByteBudgetExhausted
+from gpsync.google_photos.client import (
+    BATCH_GET_MAX_MEDIA_ITEMS,
+    GooglePhotosClient,
+    remove_temporary_files,
+)
+from gpsync.google_photos.partial import Checkpoint
+from gpsync.google_photos.records import MediaItemRecord
+from gpsync.google_photos.schemas.albums import Album as GooglePhotosAlbum
+from gpsync.google_photos.schemas.media_items import MediaItem
+from gpsync.google_photos.transport import TransportStats
+from gpsync.index.database import (
+    IN_MEMORY_SQLITE_URLS,
+    get_engine,
+    upsert,
+)
+from gpsync.index.options import DEFAULT_DATABASE_URL, DownloadEngine, DownloadOrder
+from gpsync.index.pipeline import Pipeline, PipelineLimits, Stage
+from gpsync.index.planner import (
+    COUNT_PLANNED_CONTENT,
+    CREATE_PLANNED_DOWNLOADS,
+    CREATE_PLANNED_DOWNLOADS_INDEX,
+    DELETE_PLANNED_DOWNLOAD,
+    DELETE_PLANNED_DOWNLOADS,
+    DOWNLOADS_IN_DIRECTORY,
+    INSERT_PLANNED_DOWNLOAD,
+    NO_ALBUM,
+    PLANNED_CONTENT,
+    SCHEDULERS,
+    DownloadScheduler,
+    by_id,
+    missing_album_content,
+    planned_albums,
+)
+from gpsync.index.window import DateWindow
+from gpsync.metrics import (
+    COMMIT_SECONDS,
+    SAVE_SECONDS,
+    SKIPPED_MEDIA_ITEMS,
+    URL_REFRESHES,
+)
 from gpsync.models.index import Album as AlbumIndex
+from gpsync.models.index import AlbumContentLink as AlbumContentLinkIndex
 from gpsync.models.index import Content as ContentIndex
 from gpsync.models.index import Download as DownloadIndex
 from gpsync.models.index import DownloadRun as DownloadRunIndex
-from gpsync.utils import create_directories
+from gpsync.models.index import PartialDownload as PartialDownloadIndex
+from gpsync.utils import create_directories, link_into_place
 
 T = TypeVar("T")
 
+# Downloads are staged inside the destination so that moving them into place is a rename.
+STAGING_DIRECTORY = ".gpsync"
 
-def get_engine(url: str = "sqlite:///sqlite.db") -> Engine:
-    engine = create_engine(url)
-    SQLModel.metadata.create_all(engine)
-    return engine
+# Every media item is stored once in here and linked into the directory of each of its
+# albums.
+STORE_DIRECTORY = f"{STAGING_DIRECTORY}/store"
 
+# Base URLs expire after 60 minutes, refresh them a bit before that.
+BASE_URL_TTL = datetime.timedelta(minutes=50)
 
-def chunks(items: List[T], chunk_size: int = 50) -> Generator[List[T], List[T], None]:
-    for i in range(0, len(items), chunk_size):
-        yield items[i : i + chunk_size]
+# Number of downloads saved between commits when results are handled as they complete.
+COMMIT_INTERVAL = 50
+
+
+def chunks(items: Iterable[T], chunk_size: int = 50) -> Generator[List[T], None, None]:
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+
+        yield chunk
 
 
 class GooglePhotosIndexer(BaseModel):
     client: GooglePhotosClient
+    photo_save_mode: SaveMode = SaveMode.ORIGINAL
+    database_url: str = DEFAULT_DATABASE_URL
 
-    def index_albums(self, album_titles: Optional[List[str]] = None):
-        albums = self.client.list_all_albums(include_shared=True)
+    # Rows written per bulk upsert and IDs looked up per query.
+    batch_size: int = 500
 
-        if album_titles is not None:
-            albums = [album for album in albums if album.title in album_titles]
+    _engine: Optional[Engine] = PrivateAttr(default=None)
 
-        with Session(get_engine()) as session:
-            for album in albums:
-                indexed_album = session.get(AlbumIndex, album.id)
+    @property
+    def engine(self) -> Engine:
+        if self._engine is None:
+            self._engine = get_engine(self.database_url)
 
-                if indexed_album is not None:
-                    continue
+        return self._engine
 
-                session.add(AlbumIndex(id=album.id, title=album.title))
+    def index_albums(self, album_titles: Optional[List[str]] = None):
+        # Albums are upserted as their pages arrive rather than listed up front.
+        albums: Iterable[GooglePhotosAlbum] = self.client.iter_albums(
+            include_shared=True
+        )
+
+        if album_titles is not None:
+            albums = (album for album in albums if album.title in album_titles)
+
+        with Session(self.engine) as session:
+            for batch in chunks(albums, self.batch_size):
+                # Titles of known albums are kept, they name the download directories.
+                upsert(
+                    session,
+                    AlbumIndex,
+                    [
+                        {
+                            "id": album.id,
+                            "title": album.title,
+                            "media_items_count": (
+                                int(album.media_items_count)
+                                if album.media_items_count is not None
+                                else None
+                            ),
+                            "cover_photo_media_item_id": album.cover_photo_media_item_id,
+                        }
+                        for album in batch
+                    ],
+                    update_columns=["media_items_count", "cover_photo_media_item_id"],
+                )
 
             session.commit()
 
-    def index_album_content(self, album_id: str):
-        with Session(get_engine()) as session:
+    def index_album_content(self, album_id: str, window: Optional[DateWindow] = None):
+        with Session(self.engine) as session:
             album = session.get(AlbumIndex, album_id)
             if album is None:
                 return
 
-            google_photos_album = album.to_google_photos_api_album()
-            media_items = self.client.search_non_archived_album_media_items(
-                google_photos_album
-            )
-            for media_item in tqdm(
-                media_items,
+            indexed_at = datetime.datetime.utcnow()
+            with tqdm(
                 unit=" media items",
                 desc=f"Indexing {album.title} media items",
-                total=len(media_items),
-            ):
-                indexed_content = session.get(ContentIndex, media_item.id)
-
-                if indexed_content is None:
-                    content = ContentIndex.from_media_item(media_item)
-                else:
-                    content = indexed_content
-
-                    # Google Photos provides presigned URLs. They expire after some amount of time (1 hour?)
-                    # and caching these URLs results in 403 after the expiry. We reuse the indexed content to
-                    # avoid violating the primary key constraint, but we have to update the URL so that we
-                    # don't get 403s when downloading the content.
-                    content.base_url = media_item.base_url
-                    download_url_extension = (
-                        "=dv" if media_item.media_metadata.video is not None else "=d"
+                total=album.media_items_count,
+            ) as progress:
+                for media_items in self.client.iter_album_media_item_pages(
+                    album.to_google_photos_api_album()
+                ):
+                    self._index_media_items(
+                        session, album_id, media_items, indexed_at, window
                     )
-                    content.download_url = media_item.base_url + download_url_extension
+                    progress.update(len(media_items))
+
+            self._finish_album_sync(session, album, indexed_at, window)
 
-                content.album_id = album_id
+    def index_library_content(self, window: Optional[DateWindow] = None):
+        """Index media items across the whole library, including those in no album.
 
-                session.add(content)
+        The date window is pushed down into the search, so only that slice of the
+        library is listed."""
+        indexed_at = datetime.datetime.utcnow()
+        filters = window.to_filters() if window is not None else None
+        with Session(self.engine) as session, tqdm(
+            unit=" media items", desc="Indexing library media items"
+        ) as progress:
+            for media_items in self.client.iter_media_item_pages(filters):
+                self._index_media_items(session, None, media_items, indexed_at)
+                progress.update(len(media_items))
 
             session.commit()
 
-    def index_all_album_content(self, num_threads: int = 8):
-        with Session(get_engine()) as session:
-            album_ids = session.exec(select(AlbumIndex.id)).all()
+    def _index_media_items(
+        self,
+        session: Session,
+        album_id: Optional[str],
+        media_items: Iterable[MediaItemRecord],
+        indexed_at: datetime.datetime,
+        window: Optional[DateWindow] = None,
+    ):
+        """Upsert `media_items` into the index and link them to the album, if any.
 
-        for album_id in album_ids:
-            self.index_album_content(album_id)
+        Media items outside `window` are dropped as they stream past."""
+        if window is not None:
+            media_items = (
+                media_item
+                for media_item in media_items
+                if window.contains(media_item.content_creation_time)
+            )
 
-    def download_indexed_content(
+        for batch in chunks(media_items, self.batch_size):
+            rows = []
+            links = []
+            for media_item in batch:
+                rows.append(media_item.to_content_row(indexed_at))
+                if album_id is not None:
+                    links.append(
+                        {
+                            "album_id": album_id,
+                            "content_id": media_item.id,
+                            "indexed_at": indexed_at,
+                        }
+                    )
+
+            # Google Photos provides presigned URLs. They expire after some amount of time (1 hour?)
+            # and caching these URLs results in 403 after the expiry. Indexed content keeps its
+            # primary key, but we have to update the URL so that we don't get 403s when
+            # downloading the content.
+            upsert(
+                session,
+                ContentIndex,
+                rows,
+                update_columns=[
+                    "base_url",
+                    "download_url",
+                    "base_url_fetched_at",
+                    "updated_at",
+                ],
+            )
+            upsert(session, AlbumContentLinkIndex, links, update_columns=["indexed_at"])
+
+    def _finish_album_sync(
         self,
-        base_path: str,
-        content: Optional[List[ContentIndex]] = None,
+        session: Session,
+        album: AlbumIndex,
+        indexed_at: datetime.datetime,
+        window: Optional[DateWindow] = None,
     ):
-        with Session(get_engine()) as session:
-            if content is None:
-                content = list(session.exec(select(ContentIndex)))
-
-            content_ids = [item.id for item in content]
-            downloaded = set(
-                session.exec(
-                    select(DownloadIndex.content_id)
-                    .where(DownloadIndex.content_id.in_(content_ids))  # type: ignore
-                    .where(DownloadIndex.local_filepath.startswith(base_path))
+        """Commit an album whose pages were all indexed as of `indexed_at`.
+
+        Content that wasn't on any of the pages was removed from the album and is
+        unlinked from it. With a bounded `window`, only the content inside it was
+        indexed: links outside it are kept and the album isn't marked as synced, so
+        that a later sync still indexes all of it."""
+        unlink = (
+            delete(AlbumContentLinkIndex)
+            .where(AlbumContentLinkIndex.album_id == album.id)
+            .where(AlbumContentLinkIndex.indexed_at < indexed_at)
+        )
+        if window is not None and window.bounded:
+            unlink = unlink.where(
+                AlbumContentLinkIndex.content_id.in_(  # type: ignore
+                    select(ContentIndex.id).where(
+                        window.where(ContentIndex.content_creation_time)
+                    )
+                )
+            ).execution_options(synchronize_session=False)
+        else:
+            album.mark_synced()
+            session.add(album)
+
+        session.execute(unlink)
+        session.commit()
+
+    def index_all_album_content(
+        self,
+        num_threads: int = 8,
+        engine: DownloadEngine = DownloadEngine.THREADS,
+        async_limits: Optional[AsyncLimits] = None,
+        full: bool = False,
+        window: Optional[DateWindow] = None,
+    ):
+        """Index the content of every album that changed since it was last indexed.
+
+        Run `index_albums` first, it records the state the albums are compared against.
+        With `full`, every album is indexed again. With `window`, only content created
+        inside it is indexed. Album searches can't be filtered by the API, so albums
+        are still listed in full and the window is applied as their pages stream in."""
+        if engine == DownloadEngine.ASYNCIO:
+            asyncio.run(
+                self._index_all_album_content_async(
+                    async_limits or AsyncLimits(), full, window
                 )
             )
+            return
 
-            media_items = [
-                item.to_media_item() for item in content if item.id not in downloaded
-            ]
+        # Paging is bound by API round-trips, so albums are paged by a pool of workers
+        # while this thread is the only one writing to the index. Pages are written as
+        # they arrive, so memory doesn't grow with the size of an album.
+        indexed_at = datetime.datetime.utcnow()
+        with Session(self.engine, expire_on_commit=False) as session:
+            albums = self._albums_to_sync(session, full)
+
+            def page(
+                album: Tuple[AlbumIndex, GooglePhotosAlbum],
+            ) -> Iterator[Tuple[AlbumIndex, Optional[List[MediaItemRecord]]]]:
+                album_index, google_photos_album = album
+                for media_items in self.client.iter_album_media_item_pages(
+                    google_photos_album
+                ):
+                    yield album_index, media_items
+
+                # Marks the end of the album.
+                yield album_index, None
+
+            pipeline = Pipeline(
+                [Stage("page", page, num_threads, many=True)],
+                queue_size=2 * num_threads,
+            )
+            num_media_items: Dict[str, int] = {}
+            with tqdm(
+                unit=" albums", desc="Indexing albums", total=len(albums)
+            ) as progress:
+                for album, media_items in pipeline.run(
+                    # Converted here, so workers don't touch the session's objects.
+                    [(album, album.to_google_photos_api_album()) for album in albums]
+                ):
+                    if media_items is not None:
+                        self._index_media_items(
+                            session, album.id, media_items, indexed_at, window
+                        )
+                        num_media_items[album.id] = num_media_items.get(
+                            album.id, 0
+                        ) + len(media_items)
+                        continue
+
+                    self._finish_album_sync(session, album, indexed_at, window)
+                    progress.set_postfix_str(
+                        f"{album.title}: {num_media_items.pop(album.id, 0)} media items"
+                    )
+                    progress.update()
+
+    async def _index_all_album_content_async(
+        self, limits: AsyncLimits, full: bool, window: Optional[DateWindow]
+    ):
+        """Page albums concurrently, writing pages as they arrive.
+
+        Each album is committed once its paging finishes."""
+        indexed_at = datetime.datetime.utcnow()
+        with Session(self.engine, expire_on_commit=False) as session:
+            albums = self._albums_to_sync(session, full)
+
+            async with AsyncGooglePhotosClient(
+                client=self.client, limits=limits
+            ) as async_client:
+                with tqdm(
+                    unit=" albums", desc="Indexing albums", total=len(albums)
+                ) as progress:
+
+                    async def page(album: AlbumIndex):
+                        num_media_items = 0
+                        async for (
+                            media_items
+                        ) in async_client.iter_album_media_item_pages(
+                            album.to_google_photos_api_album()
+                        ):
+                            # Runs on the event loop, so the session is never used
+                            # concurrently.
+                            self._index_media_items(
+                                session, album.id, media_items, indexed_at, window
+                            )
+                            num_media_items += len(media_items)
+
+                        self._finish_album_sync(session, album, indexed_at, window)
+                        progress.set_postfix_str(
+                            f"{album.title}: {num_media_items} media items"
+                        )
+                        progress.update()
+
+                    await asyncio.gather(*(page(album) for album in albums))
+
+    def _albums_to_sync(self, session: Session, full: bool) -> List[AlbumIndex]:
+        albums = session.exec(select(AlbumIndex)).all()
+        if full:
+            return albums
+
+        changed = [album for album in albums if album.needs_sync]
+        if len(changed) < len(albums):
+            tqdm.write(f"Skipping {len(albums) - len(changed)} unchanged albums")
+
+        return changed
+
+    def download_indexed_content(
+        self,
+        base_path: str,
+        num_threads: int = 8,
+        engine: DownloadEngine = DownloadEngine.THREADS,
+        async_limits: Optional[AsyncLimits] = None,
+        pipeline_limits: Optional[PipelineLimits] = None,
+        photo_processes: int = 0,
+        window: Optional[DateWindow] = None,
+        order: DownloadOrder = DownloadOrder.INDEX,
+        byte_budget: Optional[int] = None,
+        download_run_id: Optional[uuid.UUID] = None,
+    ) -> TransportStats:
+        """Download indexed content that isn't under `base_path` yet.
+
+        What to download is planned in SQL, see `planner`, and streamed from the index
+        to the download workers in `order`. With `window`, only content created inside
+        it is downloaded. With `byte_budget`, the run stops once it has downloaded that
+        many bytes. What was saved until then is committed and large downloads that were
+        cut short are resumed by the next run.
+
+        The run is recorded with `download_run_id`, e.g. the ID its metrics are exported
+        with, or a new one. `pipeline_limits` configures the threads engine and defaults to `num_threads`
+        download workers. With `photo_processes`, descriptions are embedded and photos
+        re-encoded in that many worker processes instead of on threads. Returns the
+        connection pool stats of the engine that ran the downloads."""
+        # Content is read by download workers after commits, it must not be expired.
+        # The plan is held by a connection of its own, downloads are streamed from it
+        # while the session commits them.
+        with Session(
+            self.engine, expire_on_commit=False
+        ) as session, self.engine.connect() as planning:
+            self._plan_filepaths(planning, base_path, window)
+
+            # Content that is already stored only has to be linked into new albums.
+            store_path = f"{base_path}/{STORE_DIRECTORY}"
+            os.makedirs(store_path, exist_ok=True)
+            stored = self._stored_content(planning, store_path)
 
             # TODO: fix this and don't just create DownloadRuns for all albums
             albums = list(session.exec(select(AlbumIndex)))
 
-            download_run = DownloadRunIndex(base_filepath=base_path, albums=albums)
+            staging_path = f"{base_path}/{STAGING_DIRECTORY}"
+            partial_downloads = session.exec(select(PartialDownloadIndex)).all()
+            remove_temporary_files(
+                staging_path,
+                keep=[partial.part_filepath for partial in partial_downloads],
+            )
+
+            # Download workers checkpoint through their own sessions, so this session
+            # must not hold SQLite's write lock while they run. Nothing here queries
+            # again until the next commit, so the run is only flushed on commit.
+            download_run = DownloadRunIndex(
+                id=download_run_id or uuid.uuid4(),
+                base_filepath=base_path,
+                albums=albums,
+            )
+            if window is not None:
+                download_run.start_date = window.start_date
+                if window.end_date is not None:
+                    download_run.end_date = window.end_date
             session.add(download_run)
 
-            for chunk in chunks(media_items):
-                # TODO: figure out how to prevent the 403s from rate limiting due to Google API design
-                # See: https://stackoverflow.com/a/42369913
-                google_photos_content = self.client.download_media_items(
-                    chunk,
-                    "Downloading indexed media items",
+            for content_id, stored_filepath, local_filepaths in stored:
+                link_content(stored_filepath, local_filepaths)
+                for local_filepath in local_filepaths:
+                    session.add(
+                        self._to_download(content_id, local_filepath, download_run)
+                    )
+            if stored:
+                # Committed before any download starts, so the lock is released again.
+                self._commit_downloads(
+                    session,
+                    [content_id for content_id, _, _ in stored],
+                    queue.SimpleQueue(),
+                )
+                # Linked content has its downloads now, only the content to fetch is
+                # left in the plan.
+                planning.execute(
+                    text(DELETE_PLANNED_DOWNLOAD),
+                    [{"content_id": content_id} for content_id, _, _ in stored],
                 )
 
-                for item in google_photos_content:
-                    content_id = item.media_item.id
+            num_pending = planning.execute(text(COUNT_PLANNED_CONTENT)).scalar_one()
+            planning.commit()
+            pending = self._planned_records(planning, order)
+
+            budget = ByteBudget(byte_budget) if byte_budget is not None else None
+            with photo_process_pool(photo_processes) as executor:
+                if engine == DownloadEngine.ASYNCIO:
+                    stats = asyncio.run(
+                        self._download_media_items_async(
+                            session,
+                            pending,
+                            num_pending,
+                            store_path,
+                            staging_path,
+                            download_run,
+                            async_limits or AsyncLimits(),
+                            executor,
+                            budget,
+                        )
+                    )
+                else:
+                    limits = pipeline_limits or PipelineLimits(
+                        fetch_workers=num_threads
+                    )
+                    # Embed workers just wait on the process pool, it takes one for each
+                    # process to keep them all busy.
+                    limits = limits.copy(
+                        update={
+                            "embed_workers": max(limits.embed_workers, photo_processes)
+                        }
+                    )
+                    stats = self._download_media_items(
+                        session,
+                        pending,
+                        num_pending,
+                        store_path,
+                        staging_path,
+                        download_run,
+                        limits,
+                        executor,
+                        budget,
+                    )
+
+            if budget is not None and budget.exhausted:
+                tqdm.write(
+                    f"Stopped after the byte budget of {budget.limit} bytes, the rest "
+                    "is downloaded by the next run"
+                )
+
+            return stats
+
+    def _download_media_items(
+        self,
+        session: Session,
+        pending: Iterable[Tuple[MediaItemRecord, List[str]]],
+        num_pending: int,
+        store_path: str,
+        staging_path: str,
+        download_run: DownloadRunIndex,
+        limits: PipelineLimits,
+        executor: Optional[Executor] = None,
+        budget: Optional[ByteBudget] = None,
+    ) -> TransportStats:
+        """Download through a pipeline of fetch, embed and write stages.
+
+        Each stage has its own workers, so the network and the disk are kept busy at the
+        same time. Content is written to the store and linked to the file paths it's
+        `pending` with, saved downloads are committed to the index on this thread. Once
+        `budget` is spent, no more downloads are started."""
+        refreshed: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        checkpoint = self._checkpoint_callback()
+        progress = tqdm(
+            unit=" media items",
+            desc="Downloading indexed media items",
+            total=num_pending,
+        )
+        # File paths of the content that is being downloaded, by content ID.
+        in_flight: Dict[str, List[str]] = {}
+
+        def fresh_media_items() -> Iterator[MediaItem]:
+            for chunk in chunks(pending, BATCH_GET_MAX_MEDIA_ITEMS):
+                if budget is not None and budget.exhausted:
+                    return
+
+                records = [record for record, _ in chunk]
+                stale_ids = self._stale_content_ids(records)
+                media_items = self._with_fresh_base_urls(
+                    records,
+                    stale_ids,
+                    self.client.batch_get_media_items(stale_ids),
+                    refreshed,
+                )
+                skip_progress(progress, len(chunk) - len(media_items))
+                in_flight.update(take_filepaths(chunk, media_items))
+                yield from media_items
+
+        def fetch(media_item: MediaItem) -> Optional[GooglePhotosContent]:
+            # Throttled downloads are retried by the client's rate limiter.
+            try:
+                return self.client.download_media_item(
+                    media_item,
+                    download_dir=staging_path,
+                    photo_save_mode=self.photo_save_mode,
+                    checkpoint=checkpoint,
+                    budget=budget,
+                )
+            except ByteBudgetExhausted:
+                in_flight.pop(media_item.id, None)
+                return None
+
+        def embed(item: GooglePhotosContent) -> Optional[GooglePhotosContent]:
+            try:
+                with SAVE_SECONDS.time(step="process"):
+                    item.prepare(executor)
+            except ValueError:
+                in_flight.pop(item.media_item.id, None)
+                skip_content(item)
+                return None
+
+            return item
+
+        def write(item: GooglePhotosContent) -> Tuple[GooglePhotosContent, List[str]]:
+            media_item = item.media_item
+            stored_filepath = store_filepath(
+                store_path, media_item.id, media_item.filename
+            )
+            with SAVE_SECONDS.time(step="store"):
+                item.commit(stored_filepath)
+            local_filepaths = in_flight.pop(media_item.id)
+            with SAVE_SECONDS.time(step="link"):
+                link_content(stored_filepath, local_filepaths)
+            return item, local_filepaths
+
+        pipeline = Pipeline(
+            [
+                Stage("fetch", fetch, limits.fetch_workers),
+                Stage("embed", embed, limits.embed_workers),
+                Stage("write", write, limits.write_workers),
+            ],
+            queue_size=limits.queue_size,
+            discard=discard_content,
+        )
+
+        stats_before = self.client.connection_pool_stats()
+        saved: List[str] = []
+        with progress:
+            try:
+                for item, filepaths in pipeline.run(fresh_media_items()):
+                    for local_filepath in filepaths:
+                        session.add(
+                            self._to_download(
+                                item.media_item.id, local_filepath, download_run
+                            )
+                        )
+                    saved.append(item.media_item.id)
+                    progress.update()
+                    if len(saved) == COMMIT_INTERVAL:
+                        self._commit_downloads(session, saved, refreshed)
+                        saved = []
+            finally:
+                # Files that made it into place are recorded even if the run failed.
+                self._commit_downloads(session, saved, refreshed)
+
+        stats = self.client.connection_pool_stats()
+        return TransportStats(
+            requests=stats.requests - stats_before.requests,
+            connections=stats.connections - stats_before.connections,
+        )
 
-                    album_title = session.exec(
-                        select(AlbumIndex.title)
-                        .where(AlbumIndex.id == ContentIndex.album_id)
-                        .where(ContentIndex.id == content_id)
-                    ).first()
-                    album_title = album_title or "No Album"
+    async def _download_media_items_async(
+        self,
+        session: Session,
+        pending: Iterable[Tuple[MediaItemRecord, List[str]]],
+        num_pending: int,
+        store_path: str,
+        staging_path: str,
+        download_run: DownloadRunIndex,
+        limits: AsyncLimits,
+        executor: Optional[Executor] = None,
+        budget: Optional[ByteBudget] = None,
+    ) -> TransportStats:
+        async with AsyncGooglePhotosClient(
+            client=self.client, limits=limits
+        ) as async_client:
+            refreshed: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+            progress = tqdm(
+                unit=" media items",
+                desc="Downloading indexed media items",
+                total=num_pending,
+            )
+            # File paths of the content that is being downloaded, by content ID.
+            in_flight: Dict[str, List[str]] = {}
 
-                    local_filename = item.media_item.filename
-                    local_filepath = f"{base_path}/{album_title}/{local_filename}"
+            async def fresh_media_items() -> AsyncIterator[MediaItem]:
+                for chunk in chunks(pending, BATCH_GET_MAX_MEDIA_ITEMS):
+                    if budget is not None and budget.exhausted:
+                        return
 
-                    create_directories(local_filepath)
+                    records = [record for record, _ in chunk]
+                    stale_ids = self._stale_content_ids(records)
+                    fresh = await async_client.batch_get_media_items(stale_ids)
+                    media_items = self._with_fresh_base_urls(
+                        records, stale_ids, fresh, refreshed
+                    )
+                    skip_progress(progress, len(chunk) - len(media_items))
+                    in_flight.update(take_filepaths(chunk, media_items))
+                    for media_item in media_items:
+                        yield media_item
+
+            google_photos_content = async_client.download_media_items(
+                fresh_media_items(),
+                download_dir=staging_path,
+                photo_save_mode=self.photo_save_mode,
+                checkpoint=self._checkpoint_callback(),
+                budget=budget,
+            )
+            saved: List[str] = []
 
-                    download = DownloadIndex(
-                        local_filepath=local_filepath,
-                        local_filename=local_filename,
-                        content_id=content_id,
-                        download_run_id=download_run.id,
+            with progress:
+
+                async def save(item: GooglePhotosContent):
+                    media_item = item.media_item
+                    stored_filepath = store_filepath(
+                        store_path, media_item.id, media_item.filename
                     )
+                    filepaths = in_flight.pop(media_item.id)
                     try:
-                        item.save(local_filepath)
-                        session.add(download)
+                        await async_client.save(item, stored_filepath, executor)
                     except ValueError:
-                        # TODO: Seem to have problems with .heic files not downloading properly
-                        # Not sure why PIL is struggling with them...?
-                        print(f"skipping {local_filename}")
+                        skip_content(item)
+                        return
+
+                    with SAVE_SECONDS.time(step="link"):
+                        await asyncio.to_thread(
+                            link_content, stored_filepath, filepaths
+                        )
+
+                    # Runs on the event loop, so the session is never used concurrently.
+                    for local_filepath in filepaths:
+                        session.add(
+                            self._to_download(
+                                media_item.id, local_filepath, download_run
+                            )
+                        )
+                    saved.append(item.media_item.id)
+                    progress.update()
+                    if progress.n % COMMIT_INTERVAL == 0:
+                        self._commit_downloads(session, saved, refreshed)
+                        saved.clear()
+
+                saving: Set[asyncio.Task] = set()
+                try:
+                    async for item in google_photos_content:
+                        task = asyncio.create_task(save(item))
+                        saving.add(task)
+                        task.add_done_callback(saving.discard)
+                finally:
+                    await asyncio.gather(*saving)
+                    # Files that made it into place are recorded even if the run failed.
+                    self._commit_downloads(session, saved, refreshed)
+
+            return async_client.stats()
+
+    def _checkpoint_callback(self) -> Optional[Checkpoint]:
+        # An in-memory index doesn't outlive the run, there is nothing to resume.
+        if self.database_url in IN_MEMORY_SQLITE_URLS:
+            return None
+
+        return self._checkpoint
+
+    def _checkpoint(
+        self, content_id: str, part_filepath: str, offset: int, total_bytes: int
+    ):
+        # Called by download workers, so it writes through a session of its own.
+        with Session(self.engine) as session:
+            upsert(
+                session,
+                PartialDownloadIndex,
+                [
+                    {
+                        "content_id": content_id,
+                        "part_filepath": part_filepath,
+                        "offset": offset,
+                        "total_bytes": total_bytes,
+                        "updated_at": datetime.datetime.utcnow(),
+                    }
+                ],
+                update_columns=["part_filepath", "offset", "total_bytes", "updated_at"],
+            )
+            session.commit()
+
+    def _commit_downloads(
+        self,
+        session: Session,
+        content_ids: List[str],
+        refreshed: "queue.SimpleQueue[Dict[str, Any]]",
+    ):
+        """Commit saved downloads and the base URLs refreshed since the last commit.
+
+        Partial downloads of the saved content are forgotten in the same transaction."""
+        if content_ids:
+            session.execute(
+                delete(PartialDownloadIndex).where(
+                    PartialDownloadIndex.content_id.in_(content_ids)  # type: ignore
+                )
+            )
+
+        rows = []
+        while not refreshed.empty():
+            rows.append(refreshed.get())
+
+        if rows:
+            table = ContentIndex.__table__  # type: ignore
+            session.execute(
+                update(table)
+                .where(table.c.id == bindparam("content_id"))
+                .values(
+                    base_url=bindparam("fresh_base_url"),
+                    download_url=bindparam("fresh_download_url"),
+                    base_url_fetched_at=bindparam("fetched_at"),
+                ),
+                rows,
+            )
+
+        with COMMIT_SECONDS.time():
+            session.commit()
+
+    def _stale_content_ids(self, content: List[MediaItemRecord]) -> List[str]:
+        expired = datetime.datetime.utcnow() - BASE_URL_TTL
+        return [
+            item.id
+            for item in content
+            if item.base_url_fetched_at is None or item.base_url_fetched_at < expired
+        ]
+
+    def _with_fresh_base_urls(
+        self,
+        content: List[MediaItemRecord],
+        stale_ids: List[str],
+        fresh_media_items: List[MediaItem],
+        refreshed: "queue.SimpleQueue[Dict[str, Any]]",
+    ) -> List[MediaItem]:
+        """Convert `content` to media items with the fresh base URLs of stale content.
+
+        This can run on another thread than the session, so the fresh URLs are handed
+        to `refreshed` to be written with the next commit instead of being set on the
+        content. Stale content that batchGet didn't return was deleted or unshared, it
+        is left out because its URL can't be refreshed."""
+        fetched_at = datetime.datetime.utcnow()
+        fresh_by_id = {media_item.id: media_item for media_item in fresh_media_items}
+        stale = set(stale_ids)
+        URL_REFRESHES.inc(len(fresh_by_id), reason="stale")
+        missing = len(stale - fresh_by_id.keys())
+        if missing:
+            URL_REFRESHES.inc(missing, reason="missing")
+            tqdm.write(
+                f"Skipping {missing} media items that are no longer in the library"
+            )
+
+        media_items: List[MediaItem] = []
+        for item in content:
+            media_item = item.to_media_item()
+            if item.id in stale:
+                fresh = fresh_by_id.get(item.id)
+                if fresh is None:
+                    continue
+
+                media_item.base_url = fresh.base_url
+                refreshed.put(
+                    {
+                        "content_id": item.id,
+                        "fresh_base_url": fresh.base_url,
+                        "fresh_download_url": fresh.download_url,
+                        "fetched_at": fetched_at,
+                    }
+                )
+
+            media_items.append(media_item)
+
+        return media_items
+
+    def _plan_filepaths(
+        self, connection: Connection, base_path: str, window: Optional[DateWindow]
+    ) -> None:
+        """Fill the run's `planned_download` table with the file paths to download to.
+
+        Paths depend on the other files in their directory, see `album_filepaths`, so
+        they are planned a directory at a time, from the content missing from it and the
+        files that are already there."""
+        connection.execute(text(CREATE_PLANNED_DOWNLOADS))
+        connection.execute(text(CREATE_PLANNED_DOWNLOADS_INDEX))
+        connection.execute(text(DELETE_PLANNED_DOWNLOADS))
+
+        # Titles that only differ in case share a directory on some filesystems.
+        directories: Dict[str, Dict[Optional[str], Optional[str]]] = defaultdict(dict)
+        statement, parameters = planned_albums(base_path, window)
+        for album_id, title in connection.execute(text(statement), parameters):
+            directories[(title or NO_ALBUM).casefold()][album_id] = title
+
+        for directory, albums in directories.items():
+            members: List[Tuple[Optional[str], str, str, datetime.datetime]] = []
+            for album_id, title in albums.items():
+                statement, parameters = missing_album_content(
+                    base_path, album_id, window
+                )
+                members.extend(
+                    (title, *row)
+                    for row in connection.execute(
+                        text(statement).columns(
+                            ContentIndex.id,
+                            ContentIndex.google_photos_filename,
+                            ContentIndex.content_creation_time,
+                        ),
+                        parameters,
+                    )
+                )
+            taken: Dict[str, str] = {}
+            for title in set(albums.values()):
+                taken.update(
+                    connection.execute(
+                        text(DOWNLOADS_IN_DIRECTORY),
+                        {"directory": f"{base_path}/{title or NO_ALBUM}"},
+                    ).all()
+                )
+
+            planned = [
+                {
+                    "content_id": content_id,
+                    "directory": directory,
+                    "local_filepath": local_filepath,
+                }
+                for content_id, local_filepaths in album_filepaths(
+                    base_path, members, taken
+                ).items()
+                for local_filepath in local_filepaths
+            ]
+            if planned:
+                connection.execute(text(INSERT_PLANNED_DOWNLOAD), planned)
+
+    def _stored_content(
+        self, connection: Connection, store_path: str
+    ) -> List[Tuple[str, str, List[str]]]:
+        """(content ID, stored file path, file paths) of the planned content that is
+        already in the store."""
+        stored = []
+        planned = connection.execute(self._planned_content(by_id))
+        for row, local_filepaths in with_filepaths(planned):
+            stored_filepath = store_filepath(
+                store_path, row.id, row.google_photos_filename
+            )
+            if os.path.exists(stored_filepath):
+                stored.append((row.id, stored_filepath, local_filepaths))
+
+        return stored
+
+    def _planned_content(self, scheduler: DownloadScheduler) -> TextualSelect:
+        return text(scheduler(PLANNED_CONTENT)).columns(
+            ContentIndex.id,
+            ContentIndex.base_url,
+            ContentIndex.mime_type,
+            ContentIndex.google_photos_filename,
+            ContentIndex.content_creation_time,
+            ContentIndex.width,
+            ContentIndex.height,
+            ContentIndex.description,
+            ContentIndex.fps,
+            ContentIndex.status,
+            ContentIndex.base_url_fetched_at,
+            column("local_filepath", String),
+        )
+
+    def _planned_records(
+        self, connection: Connection, order: DownloadOrder = DownloadOrder.INDEX
+    ) -> Iterable[Tuple[MediaItemRecord, List[str]]]:
+        """Records of the planned content with their file paths, in `order`.
+
+        Workers take records in the order they are read, so this is the schedule of the
+        downloads. They are streamed from the planning `connection` while downloads are
+        committed through another one, only the columns downloads need."""
+        statement = self._planned_content(SCHEDULERS[order])
+
+        def stream() -> Iterator[Tuple[MediaItemRecord, List[str]]]:
+            result = connection.execution_options(stream_results=True).execute(
+                statement
+            )
+            for row, local_filepaths in with_filepaths(
+                result.yield_per(self.batch_size)
+            ):
+                yield MediaItemRecord.from_content(row), local_filepaths
+
+        # Every thread has its own in-memory database, read it on this one.
+        if self.database_url in IN_MEMORY_SQLITE_URLS:
+            return list(stream())
+
+        return stream()
+
+    def _to_download(
+        self,
+        content_id: str,
+        local_filepath: str,
+        download_run: DownloadRunIndex,
+    ) -> DownloadIndex:
+        return DownloadIndex(
+            local_filepath=local_filepath,
+            local_filename=os.path.basename(local_filepath),
+            content_id=content_id,
+            download_run_id=download_run.id,
+        )
+
+
+def store_filepath(store_path: str, content_id: str, filename: str) -> str:
+    """Path of the single stored copy of a media item."""
+    _, extension = os.path.splitext(filename)
+    return f"{store_path}/{content_id}{extension}"
+
+
+def album_filepaths(
+    base_path: str,
+    members: Iterable[Tuple[Optional[str], str, str, datetime.datetime]],
+    taken: Optional[Dict[str, str]] = None,
+) -> Dict[str, List[str]]:
+    """Map content IDs to a file path in the directory of each of their albums.
+
+    `members` are (album title, content ID, filename, creation time) rows, with no title
+    for content that isn't in an album. When files in a directory have the same name, the
+    oldest keeps it and the others get a hash of their ID appended. So paths don't depend
+    on the order content is downloaded in. A name that is `taken`, a map of downloaded
+    file paths to their content ID, stays with the content it was downloaded for, so
+    content added later never replaces a file that's already there."""
+    # Compared case-insensitively, since that's how some filesystems compare them.
+    owners = {
+        filepath.casefold(): content_id
+        for filepath, content_id in (taken or {}).items()
+    }
+    by_filepath: Dict[Tuple[str, str], Dict[str, Any]] = defaultdict(dict)
+    for title, content_id, filename, content_creation_time in members:
+        directory = title or NO_ALBUM
+        by_filepath[(directory.casefold(), filename.casefold())][content_id] = (
+            content_creation_time,
+            directory,
+            filename,
+        )
+
+    filepaths: Dict[str, List[str]] = defaultdict(list)
+    for _, files in sorted(by_filepath.items()):
+        oldest_first = sorted(files.items(), key=lambda file: (file[1][0], file[0]))
+        oldest_id, (_, directory, filename) = oldest_first[0]
+        owner = owners.get(f"{base_path}/{directory}/{filename}".casefold(), oldest_id)
+        for content_id, (_, directory, filename) in oldest_first:
+            if content_id != owner:
+                filename = disambiguate_filename(filename, content_id)
+
+            filepaths[content_id].append(f"{base_path}/{directory}/{filename}")
+
+    return filepaths
+
+
+def with_filepaths(rows: Iterable[Any]) -> Iterator[Tuple[Any, List[str]]]:
+    """Group rows of PLANNED_CONTENT, which has a row per file path, by content."""
+    for _, content_rows in itertools.groupby(rows, key=lambda row: row.id):
+        first, *others = content_rows
+        yield first, [row.local_filepath for row in (first, *others)]
+
+
+def take_filepaths(
+    chunk: List[Tuple[MediaItemRecord, List[str]]], media_items: List[MediaItem]
+) -> Dict[str, List[str]]:
+    """File paths of the pending content in `chunk` that is going to be downloaded."""
+    downloading = {media_item.id for media_item in media_items}
+    return {
+        record.id: local_filepaths
+        for record, local_filepaths in chunk
+        if record.id in downloading
+    }
+
+
+def skip_progress(progress: tqdm, num_skipped: int) -> None:
+    """Take media items that won't be downloaded out of the progress total."""
+    if num_skipped and progress.total is not None:
+        progress.total -= num_skipped
+        progress.refresh()
+
+
+def disambiguate_filename(filename: str, content_id: str) -> str:
+    stem, extension = os.path.splitext(filename)
+    digest = hashlib.sha1(content_id.encode()).hexdigest()[:8]
+    return f"{stem} ({digest}){extension}"
+
+
+def link_content(stored_filepath: str, local_filepaths: List[str]) -> None:
+    """Link stored content, and its sidecar if it has one, into album directories."""
+    sidecar_filepath = f"{stored_filepath}.xmp"
+    has_sidecar = os.path.exists(sidecar_filepath)
+    for local_filepath in local_filepaths:
+        create_directories(local_filepath)
+        link_into_place(stored_filepath, local_filepath)
+        if has_sidecar:
+            link_into_place(sidecar_filepath, f"{local_filepath}.xmp")
+
+
+@contextmanager
+def photo_process_pool(processes: int) -> Iterator[Optional[Executor]]:
+    """Pool of worker processes for photo processing, or None to process on threads."""
+    if processes <= 0:
+        yield None
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=processes, initializer=register_image_openers
+    ) as executor:
+        yield executor
+
+
+def discard_content(item: Any):
+    if isinstance(item, GooglePhotosContent):
+        item.discard()
+
 
-                session.commit()
+def skip_content(item: GooglePhotosContent):
+    # PIL can fail to decode some formats (e.g. .heic) when photos are
+    # re-encoded, SaveMode.ORIGINAL never decodes them.
+    SKIPPED_MEDIA_ITEMS.inc()
+    tqdm.write(f"Skipping {item.media_item.filename}, it couldn't be processed")
+    item.discard()
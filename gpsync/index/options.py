@@ -0,0 +1,21 @@
+"""Options of the indexer that the CLI declares before any heavy module is imported."""
+
+from enum import Enum
+
+DEFAULT_DATABASE_URL = "sqlite:///sqlite.db"
+
+
+class DownloadEngine(str, Enum):
+    THREADS = "threads"
+    ASYNCIO = "asyncio"
+
+
+class DownloadOrder(str, Enum):
+    # Whatever order the index returns content in.
+    INDEX = "index"
+    # Smallest estimated size first, the most media items per second.
+    SMALLEST_FIRST = "smallest-first"
+    # Most recently created first.
+    NEWEST_FIRST = "newest-first"
+    # One media item of each album in turn, so no album holds up the others.
+    FAIR_SHARE = "fair-share"
@@ -0,0 +1,175 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, List
+
+from pydantic import BaseModel
+
+from gpsync.metrics import QUEUE_DEPTH
+
+# Sent downstream once a stage has no more items to process.
+_DONE = object()
+
+
+class PipelineLimits(BaseModel):
+    """Worker counts for each stage of the download pipeline."""
+
+    # Downloads in flight, bound by the network.
+    fetch_workers: int = 8
+
+    # Photos having their description embedded, bound by disk reads and CPU.
+    embed_workers: int = 4
+
+    # Files being moved into place, bound by disk writes.
+    write_workers: int = 4
+
+    # Items buffered between two stages.
+    queue_size: int = 64
+
+
+class Stage:
+    """A step of a `Pipeline`, run by `workers` threads.
+
+    `func` returns the item to pass to the next stage, or None to drop it. With `many`,
+    it returns an iterable instead and each of its items is passed on as soon as it is
+    produced, e.g. the pages of a paginated listing."""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        workers: int,
+        many: bool = False,
+    ):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.many = many
+
+
+class Pipeline:
+    """Runs items through stages of worker threads connected by bounded queues.
+
+    Every stage works on different items at the same time, so a slow item only holds
+    up one worker of one stage. The results of the last stage are yielded on the
+    calling thread in the order they complete.
+
+    When a stage fails, no new items are started and the items that were already
+    finished are still yielded before the error is raised. Items that were not
+    finished are passed to `discard`."""
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        queue_size: int = 64,
+        discard: Callable[[Any], None] = lambda item: None,
+    ):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.discard = discard
+
+    def run(self, items: Iterable[Any]) -> Iterator[Any]:
+        queues: List[queue.Queue] = [
+            queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)
+        ]
+        stop = threading.Event()
+        errors: List[BaseException] = []
+        lock = threading.Lock()
+        finished_workers = [0] * len(self.stages)
+
+        def fail(error: BaseException) -> None:
+            with lock:
+                errors.append(error)
+            stop.set()
+
+        def feed() -> None:
+            try:
+                for item in items:
+                    if stop.is_set():
+                        break
+
+                    queues[0].put(item)
+            except BaseException as error:
+                fail(error)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        def work(index: int) -> None:
+            stage = self.stages[index]
+            inbox, outbox = queues[index], queues[index + 1]
+            while True:
+                item = inbox.get()
+                QUEUE_DEPTH.set(inbox.qsize(), queue=stage.name)
+                if item is _DONE:
+                    break
+
+                if stop.is_set():
+                    self.discard(item)
+                    continue
+
+                try:
+                    if stage.many:
+                        for result in stage.func(item):
+                            if stop.is_set():
+                                break
+
+                            outbox.put(result)
+                    else:
+                        result = stage.func(item)
+                        if result is not None:
+                            outbox.put(result)
+                except BaseException as error:
+                    self.discard(item)
+                    fail(error)
+
+            with lock:
+                finished_workers[index] += 1
+                is_last_worker = finished_workers[index] == stage.workers
+
+            if is_last_worker:
+                is_last_stage = index == len(self.stages) - 1
+                num_done = 1 if is_last_stage else self.stages[index + 1].workers
+                for _ in range(num_done):
+                    outbox.put(_DONE)
+
+        threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.extend(
+                threading.Thread(
+                    target=work,
+                    args=(index,),
+                    name=f"pipeline-{stage.name}",
+                    daemon=True,
+                )
+                for _ in range(stage.workers)
+            )
+
+        for thread in threads:
+            thread.start()
+
+        done = False
+        try:
+            while True:
+                result = queues[-1].get()
+                if result is _DONE:
+                    done = True
+                    break
+
+                yield result
+        finally:
+            if not done:
+                # The consumer gave up. Stopped stages discard their inputs, so draining
+                # the last queue is enough to let every stage run to completion.
+                stop.set()
+                while True:
+                    result = queues[-1].get()
+                    if result is _DONE:
+                        break
+
+                    self.discard(result)
+
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
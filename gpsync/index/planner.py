@@ -0,0 +1,316 @@
+"""Plans downloads from the index alone, without the API or the files on disk.
+
+The plan is plain SQL with named parameters, so `download --dry-run` reads it with the
+standard library's sqlite3, without importing SQLAlchemy, and downloads run the same
+statements through SQLAlchemy's `text`."""
+
+import sqlite3
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from gpsync.index.options import DownloadOrder
+from gpsync.index.window import DateWindow
+
+# Directory of content that isn't in any album.
+NO_ALBUM = "No Album"
+
+# Size proxies until the real size of content is known. A 12MP JPEG is about 3MB,
+# videos vary too much with their length to guess better than a constant.
+PHOTO_BYTES_PER_PIXEL = 0.25
+VIDEO_BYTES_ESTIMATE = 50 * 1024 * 1024
+
+# How SQLAlchemy stores datetimes in SQLite, they compare as strings in this format.
+SQLITE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Estimated size of `content` from its dimensions and type.
+ESTIMATED_BYTES = f"""
+CASE
+    WHEN content.mime_type LIKE 'video/%' THEN {VIDEO_BYTES_ESTIMATE}
+    ELSE content.width * content.height * {PHOTO_BYTES_PER_PIXEL}
+END
+"""
+
+# Directories that `album` and content in no album are downloaded to.
+ALBUM_DIRECTORY = "(:base_path || '/' || coalesce(nullif(album.title, ''), :no_album))"
+NO_ALBUM_DIRECTORY = "(:base_path || '/' || :no_album)"
+
+
+def under_directory(directory: str) -> str:
+    """SQL condition on `download` to the files in `directory`, an SQL expression.
+
+    See `database.under_path`, it's a range over the file paths that SQLite can serve
+    from an index."""
+    return (
+        f"download.local_filepath >= {directory} || '/' "
+        f"AND download.local_filepath < {directory} || '0'"
+    )
+
+
+def missing_in_albums(columns: str, condition: str) -> str:
+    """Select `columns` of album links and their content where the content has no
+    download in the album's directory.
+
+    This is an anti-join against `download` on the directory rather than the exact file
+    path, which also depends on the other content of the directory."""
+    return f"""
+SELECT {columns}
+FROM albumcontentlink AS link
+JOIN album ON album.id = link.album_id
+JOIN content ON content.id = link.content_id
+WHERE NOT EXISTS (
+    SELECT 1 FROM download
+    WHERE download.content_id = link.content_id
+    AND {under_directory(ALBUM_DIRECTORY)}
+)
+AND {condition}
+"""
+
+
+def missing_in_no_album(columns: str, condition: str) -> str:
+    """Select `columns` of content in no album that has no download in NO_ALBUM."""
+    return f"""
+SELECT {columns}
+FROM content
+WHERE NOT EXISTS (
+    SELECT 1 FROM albumcontentlink AS link WHERE link.content_id = content.id
+)
+AND NOT EXISTS (
+    SELECT 1 FROM download
+    WHERE download.content_id = content.id
+    AND {under_directory(NO_ALBUM_DIRECTORY)}
+)
+AND {condition}
+"""
+
+
+def in_window(window: Optional[DateWindow]) -> Tuple[str, Dict[str, Any]]:
+    """SQL condition limiting `content` to `window`, and its parameters."""
+    conditions = ["1 = 1"]
+    parameters = {}
+    if window is not None and window.start is not None:
+        conditions.append("content.content_creation_time >= :window_start")
+        parameters["window_start"] = window.start.strftime(SQLITE_DATETIME_FORMAT)
+    if window is not None and window.end is not None:
+        conditions.append("content.content_creation_time < :window_end")
+        parameters["window_end"] = window.end.strftime(SQLITE_DATETIME_FORMAT)
+
+    return " AND ".join(conditions), parameters
+
+
+def planned_downloads(
+    base_path: str, window: Optional[DateWindow] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """SQL of the (album ID, content ID) to download into `base_path`, and its
+    parameters.
+
+    Content gets a row for each album it's missing from. Content in no album has no
+    album ID and belongs in the NO_ALBUM directory."""
+    condition, parameters = in_window(window)
+    statement = (
+        missing_in_albums(
+            "link.album_id AS album_id, content.id AS content_id", condition
+        )
+        + "UNION ALL"
+        + missing_in_no_album("NULL AS album_id, content.id AS content_id", condition)
+    )
+    return statement, {
+        "base_path": base_path.rstrip("/"),
+        "no_album": NO_ALBUM,
+        **parameters,
+    }
+
+
+def planned_albums(
+    base_path: str, window: Optional[DateWindow] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """SQL of the (album ID, title) with content to download into `base_path`.
+
+    A row with no album ID stands for the content in no album."""
+    planned, parameters = planned_downloads(base_path, window)
+    return (
+        f"""
+SELECT DISTINCT planned.album_id, album.title
+FROM ({planned}) AS planned
+LEFT JOIN album ON album.id = planned.album_id
+""",
+        parameters,
+    )
+
+
+def missing_album_content(
+    base_path: str, album_id: Optional[str], window: Optional[DateWindow] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """SQL of the (content ID, filename, creation time) of an album's content to
+    download into its directory under `base_path`.
+
+    Without `album_id`, of the content in no album."""
+    condition, parameters = in_window(window)
+    columns = (
+        "content.id, content.google_photos_filename, content.content_creation_time"
+    )
+    parameters.update(base_path=base_path.rstrip("/"), no_album=NO_ALBUM)
+    if album_id is None:
+        return missing_in_no_album(columns, condition), parameters
+
+    statement = missing_in_albums(columns, f"link.album_id = :album_id AND {condition}")
+    return statement, {**parameters, "album_id": album_id}
+
+
+# Files in a directory, by the :directory parameter.
+DOWNLOADS_IN_DIRECTORY = f"""
+SELECT download.local_filepath, download.content_id
+FROM download
+WHERE {under_directory(":directory")}
+"""
+
+# The file paths that a download run fills in and streams its downloads from, it lives
+# on the connection of the run.
+CREATE_PLANNED_DOWNLOADS = """
+CREATE TEMP TABLE IF NOT EXISTS planned_download (
+    content_id VARCHAR NOT NULL,
+    -- Case-folded, content in the same directory takes turns with FAIR_SHARE.
+    directory VARCHAR NOT NULL,
+    local_filepath VARCHAR NOT NULL
+)
+"""
+CREATE_PLANNED_DOWNLOADS_INDEX = """
+CREATE INDEX IF NOT EXISTS ix_planned_download_content_id
+ON planned_download (content_id)
+"""
+DELETE_PLANNED_DOWNLOADS = "DELETE FROM planned_download"
+INSERT_PLANNED_DOWNLOAD = """
+INSERT INTO planned_download (content_id, directory, local_filepath)
+VALUES (:content_id, :directory, :local_filepath)
+"""
+
+DELETE_PLANNED_DOWNLOAD = """
+DELETE FROM planned_download WHERE content_id = :content_id
+"""
+COUNT_PLANNED_CONTENT = "SELECT count(DISTINCT content_id) FROM planned_download"
+
+# Planned content with the columns downloads need, and a row for each of its file
+# paths. Schedulers order it, which keeps the rows of the same content together.
+PLANNED_CONTENT = """
+SELECT
+    content.id,
+    content.base_url,
+    content.mime_type,
+    content.google_photos_filename,
+    content.content_creation_time,
+    content.width,
+    content.height,
+    content.description,
+    content.fps,
+    content.status,
+    content.base_url_fetched_at,
+    planned.local_filepath
+FROM planned_download AS planned
+JOIN content ON content.id = planned.content_id
+"""
+
+
+def by_id(statement: str) -> str:
+    return f"{statement} ORDER BY content.id"
+
+
+def smallest_first(statement: str) -> str:
+    return f"{statement} ORDER BY {ESTIMATED_BYTES}, content.id"
+
+
+def newest_first(statement: str) -> str:
+    return f"{statement} ORDER BY content.content_creation_time DESC, content.id"
+
+
+# Each media item gets a turn per directory it's downloaded to, numbered from the
+# newest, and is downloaded at its earliest turn.
+TURNS = """
+SELECT ranked.content_id, min(ranked.turn) AS turn
+FROM (
+    SELECT
+        planned.content_id,
+        row_number() OVER (
+            PARTITION BY planned.directory
+            ORDER BY content.content_creation_time DESC, content.id
+        ) AS turn
+    FROM planned_download AS planned
+    JOIN content ON content.id = planned.content_id
+) AS ranked
+GROUP BY ranked.content_id
+"""
+
+
+def fair_share(statement: str) -> str:
+    """Round-robin across album directories, newest first within each of them.
+
+    Content in no album takes turns as one album."""
+    return (
+        f"{statement} JOIN ({TURNS}) AS turns ON turns.content_id = content.id "
+        "ORDER BY turns.turn, content.id"
+    )
+
+
+# Orders PLANNED_CONTENT in the order to download it in.
+DownloadScheduler = Callable[[str], str]
+
+SCHEDULERS: Dict[DownloadOrder, DownloadScheduler] = {
+    DownloadOrder.INDEX: by_id,
+    DownloadOrder.SMALLEST_FIRST: smallest_first,
+    DownloadOrder.NEWEST_FIRST: newest_first,
+    DownloadOrder.FAIR_SHARE: fair_share,
+}
+
+
+class AlbumPlan(NamedTuple):
+    # None for content that isn't in any album.
+    album_id: Optional[str]
+    title: str
+    items: int
+    estimated_bytes: int
+
+
+class DownloadPlan(NamedTuple):
+    base_path: str
+    # Content to download. Content in several albums is downloaded once, so this can
+    # be less than the sum over the albums.
+    items: int
+    estimated_bytes: int
+    albums: List[AlbumPlan]
+
+
+def plan_downloads(
+    connection: sqlite3.Connection, base_path: str, window: Optional[DateWindow] = None
+) -> DownloadPlan:
+    """What a download into `base_path` would fetch, in total and per album."""
+    planned, parameters = planned_downloads(base_path, window)
+    per_album = connection.execute(
+        f"""
+SELECT planned.album_id, album.title, count(*), sum({ESTIMATED_BYTES})
+FROM ({planned}) AS planned
+JOIN content ON content.id = planned.content_id
+LEFT JOIN album ON album.id = planned.album_id
+GROUP BY planned.album_id, album.title
+""",
+        parameters,
+    )
+    albums = [
+        AlbumPlan(
+            album_id=album_id,
+            title=title or NO_ALBUM,
+            items=album_items,
+            estimated_bytes=int(album_bytes or 0),
+        )
+        for album_id, title, album_items, album_bytes in per_album
+    ]
+    items, total_bytes = connection.execute(
+        f"""
+SELECT count(*), sum({ESTIMATED_BYTES})
+FROM content
+WHERE content.id IN (SELECT planned.content_id FROM ({planned}) AS planned)
+""",
+        parameters,
+    ).fetchone()
+    return DownloadPlan(
+        base_path=base_path,
+        items=items,
+        estimated_bytes=int(total_bytes or 0),
+        albums=sorted(albums, key=lambda album: album.title),
+    )
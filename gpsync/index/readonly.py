@@ -0,0 +1,26 @@
+"""Read-only access to an SQLite index through the standard library.
+
+Commands that only read the index use this rather than `database`, so they start
+without importing SQLAlchemy and never create, migrate or tune the database."""
+
+import os
+import pathlib
+import sqlite3
+
+SQLITE_URL_PREFIX = "sqlite:///"
+
+
+def connect_readonly(database_url: str) -> sqlite3.Connection:
+    """Open the SQLite database file of `database_url` for reading only.
+
+    Raises ValueError for URLs of other databases or of in-memory ones, and when the
+    file doesn't exist, rather than creating it."""
+    path = database_url[len(SQLITE_URL_PREFIX) :]
+    if not database_url.startswith(SQLITE_URL_PREFIX) or path in ("", ":memory:"):
+        raise ValueError(f"{database_url} isn't the URL of an SQLite database file")
+    if not os.path.exists(path):
+        raise ValueError(f"There is no index at {path} yet")
+
+    return sqlite3.connect(
+        f"{pathlib.Path(path).absolute().as_uri()}?mode=ro", uri=True
+    )
@@ -0,0 +1,71 @@
+"""Summary of the index, read with the standard library so that `status` starts fast."""
+
+import datetime
+from contextlib import closing
+from typing import NamedTuple, Optional
+
+from gpsync.index.readonly import connect_readonly
+
+ALBUMS = """
+SELECT
+    count(*),
+    -- Same as `Album.needs_sync`.
+    coalesce(
+        sum(
+            synced_at IS NULL
+            OR media_items_count IS NOT synced_media_items_count
+            OR cover_photo_media_item_id IS NOT synced_cover_photo_media_item_id
+        ),
+        0
+    ),
+    max(synced_at)
+FROM album
+"""
+
+# A range over the paths under a directory, see `database.under_path`.
+DOWNLOADED = """
+SELECT count(DISTINCT content_id)
+FROM download
+WHERE local_filepath >= :base_path || '/' AND local_filepath < :base_path || '0'
+"""
+
+
+class IndexStatus(NamedTuple):
+    albums: int
+    # Albums whose content changed since it was last indexed.
+    albums_to_sync: int
+    content: int
+    # Content downloaded under the base path, None without one.
+    downloaded: Optional[int]
+    # Large downloads a later run will resume.
+    partial_downloads: int
+    last_synced_at: Optional[datetime.datetime]
+
+
+def index_status(database_url: str, base_path: Optional[str] = None) -> IndexStatus:
+    """Summarize the index without touching the API, the downloaded files or the
+    database file, which is only read."""
+    with closing(connect_readonly(database_url)) as connection:
+        albums, albums_to_sync, last_synced_at = connection.execute(ALBUMS).fetchone()
+        downloaded = None
+        if base_path is not None:
+            (downloaded,) = connection.execute(
+                DOWNLOADED, {"base_path": base_path.rstrip("/")}
+            ).fetchone()
+        (content,) = connection.execute("SELECT count(*) FROM content").fetchone()
+        (partial_downloads,) = connection.execute(
+            "SELECT count(*) FROM partial_download"
+        ).fetchone()
+
+    return IndexStatus(
+        albums=albums,
+        albums_to_sync=albums_to_sync,
+        content=content,
+        downloaded=downloaded,
+        partial_downloads=partial_downloads,
+        last_synced_at=(
+            datetime.datetime.fromisoformat(last_synced_at)
+            if last_synced_at is not None
+            else None
+        ),
+    )
@@ -0,0 +1,101 @@
+"""Date windows of a sync.
+
+The CLI creates a window before it knows whether the command touches the API or the
+index through SQLAlchemy, e.g. `download --dry-run` does neither. So this is a plain
+dataclass and only the methods that need pydantic schemas or SQLAlchemy import them."""
+
+import datetime
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from gpsync.google_photos.schemas.common import GoogleApiDate
+    from gpsync.google_photos.schemas.media_items import Filters
+
+
+@dataclass(frozen=True)
+class DateWindow:
+    """Creation dates of the content a sync is limited to, e.g. the last 7 days.
+
+    Both ends are inclusive and optional. Creation times are compared in UTC, which is
+    how they are indexed."""
+
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+
+    def __post_init__(self):
+        start_date, end_date = self.start_date, self.end_date
+        if start_date is not None and end_date is not None and start_date > end_date:
+            raise ValueError(f"start_date {start_date} is after end_date {end_date}")
+
+    @property
+    def bounded(self) -> bool:
+        return self.start_date is not None or self.end_date is not None
+
+    @property
+    def start(self) -> Optional[datetime.datetime]:
+        if self.start_date is None:
+            return None
+
+        return datetime.datetime.combine(self.start_date, datetime.time())
+
+    @property
+    def end(self) -> Optional[datetime.datetime]:
+        """Exclusive end of the window, the start of the day after `end_date`."""
+        if self.end_date is None:
+            return None
+
+        return datetime.datetime.combine(
+            self.end_date + datetime.timedelta(days=1), datetime.time()
+        )
+
+    def contains(self, creation_time: datetime.datetime) -> bool:
+        # The index drops time zones, compare the same way.
+        creation_time = creation_time.replace(tzinfo=None)
+        return (self.start is None or creation_time >= self.start) and (
+            self.end is None or creation_time < self.end
+        )
+
+    def where(self, column: Any) -> Any:
+        """Filter `column`, a creation time, to the window."""
+        from sqlalchemy import and_, true
+
+        conditions = []
+        if self.start is not None:
+            conditions.append(column >= self.start)
+        if self.end is not None:
+            conditions.append(column < self.end)
+
+        return and_(*conditions) if conditions else true()
+
+    def to_filters(self) -> Optional["Filters"]:
+        """Search filters that have the API apply the window, None if it's unbounded.
+
+        Album searches can't be filtered, only library searches."""
+        from gpsync.google_photos.schemas.common import GoogleApiDateRange
+        from gpsync.google_photos.schemas.media_items import DateFilter, Filters
+
+        if not self.bounded:
+            return None
+
+        # The API only filters on closed ranges, open ends are the earliest and latest
+        # dates it accepts.
+        start_date = self.start_date or datetime.date.min
+        end_date = self.end_date or datetime.date.max
+        return Filters(
+            date_filter=DateFilter(
+                dates=None,
+                ranges=[
+                    GoogleApiDateRange(
+                        start_date=to_google_api_date(start_date),
+                        end_date=to_google_api_date(end_date),
+                    )
+                ],
+            )
+        )
+
+
+def to_google_api_date(date: datetime.date) -> "GoogleApiDate":
+    from gpsync.google_photos.schemas.common import GoogleApiDate
+
+    return GoogleApiDate(year=date.year, month=date.month, day=date.day)
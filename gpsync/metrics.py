@@ -0,0 +1,369 @@
+"""Counters, gauges and histograms of a sync, in the Prometheus/OpenMetrics text format.
+
+Metrics are process-wide and cumulative, like the ones of `prometheus_client`, which
+this doesn't depend on. They are exported with `TextfileExporter`, for the textfile
+collector of node_exporter, or served by `MetricsServer` for Prometheus to scrape."""
+
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from gpsync.utils import temporary_filepath
+
+# Seconds, from fast database commits to slow video downloads.
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = (
+        (name, value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} has labels {self.labelnames}, got {tuple(labels)}"
+            )
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+    def render(self, const_labels: Dict[str, str]) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{format_labels({**const_labels, **labels})} "
+                f"{format_value(value)}"
+            )
+
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [
+                ("_total", dict(zip(self.labelnames, key)), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [
+                ("", dict(zip(self.labelnames, key)), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label values, the count of each bucket (not cumulative) and the sum.
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe how long the block takes, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        return sum(self._counts.get(self._label_values(labels), []))
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        samples: List[Tuple[str, Dict[str, str], float]] = []
+        with self._lock:
+            for key, counts in sorted(self._counts.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(
+                        ("_bucket", {**labels, "le": format_value(bound)}, cumulative)
+                    )
+                samples.append(("_count", labels, cumulative))
+                samples.append(("_sum", labels, self._sums[key]))
+
+        return samples
+
+
+class MetricsRegistry:
+    """Metrics of the process."""
+
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Any) -> Any:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, labels: Optional[Dict[str, str]] = None) -> str:
+        """The metrics in the text format, every sample with `labels`, e.g. the run
+        that is exporting them."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(labels or {}))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+API_CALLS = REGISTRY.register(
+    Counter(
+        "gpsync_api_calls",
+        "Photos Library API calls, including retries.",
+        ["endpoint"],
+    )
+)
+HTTP_ERRORS = REGISTRY.register(
+    Counter(
+        "gpsync_http_errors",
+        "Expired (403) and throttled (429, 5xx) responses.",
+        ["endpoint_class", "status"],
+    )
+)
+URL_REFRESHES = REGISTRY.register(
+    Counter(
+        "gpsync_url_refreshes",
+        "Base URL refreshes: expired, stale (about to expire) or missing from the "
+        "library, which leaves the media item out of the run.",
+        ["reason"],
+    )
+)
+BYTES_DOWNLOADED = REGISTRY.register(
+    Counter("gpsync_downloaded_bytes", "Bytes of content downloaded.")
+)
+SKIPPED_MEDIA_ITEMS = REGISTRY.register(
+    Counter(
+        "gpsync_skipped_media_items",
+        "Media items that were downloaded but couldn't be saved.",
+    )
+)
+DOWNLOAD_SECONDS = REGISTRY.register(
+    Histogram(
+        "gpsync_download_seconds",
+        "Time to download a media item, including retries and URL refreshes.",
+    )
+)
+SAVE_SECONDS = REGISTRY.register(
+    Histogram(
+        "gpsync_save_seconds",
+        "Time to save a download: process it, move it into the store and link it.",
+        ["step"],
+    )
+)
+COMMIT_SECONDS = REGISTRY.register(
+    Histogram("gpsync_commit_seconds", "Time to commit saved downloads to the index.")
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "gpsync_queue_depth",
+        "Items waiting in front of a stage of the download engine.",
+        ["queue"],
+    )
+)
+
+
+def write_textfile(
+    path: str,
+    registry: MetricsRegistry = REGISTRY,
+    labels: Optional[Dict[str, str]] = None,
+) -> None:
+    """Write the metrics to `path` atomically, a scrape never sees half a file."""
+    staged_filepath = temporary_filepath(path)
+    with open(staged_filepath, "w") as file:
+        file.write(registry.render(labels))
+    os.replace(staged_filepath, path)
+
+
+class TextfileExporter:
+    """Rewrites a textfile of the metrics every `interval` seconds and on exit.
+
+    Every sample is written with `labels`."""
+
+    def __init__(
+        self,
+        path: str,
+        interval: float = 15.0,
+        registry: MetricsRegistry = REGISTRY,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.labels = labels
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            write_textfile(self.path, self.registry, self.labels)
+
+    def __enter__(self) -> "TextfileExporter":
+        self._thread = threading.Thread(
+            target=self._run, name="metrics-textfile", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        write_textfile(self.path, self.registry, self.labels)
+
+
+class MetricsServer:
+    """Serves the metrics at http://host:port/metrics while the sync runs.
+
+    Every sample is served with `labels`."""
+
+    def __init__(
+        self,
+        port: int = 0,
+        host: str = "127.0.0.1",
+        registry: MetricsRegistry = REGISTRY,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        # Only needed by runs that serve their metrics.
+        import http.server
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.render(labels).encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type",
+                    "application/openmetrics-text; version=1.0.0; charset=utf-8",
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.host = host
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self._server.server_port}/metrics"
+
+    def __enter__(self) -> "MetricsServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -3,16 +3,11 @@ import datetime
 import uuid
 from typing import Any, List, Optional
 
-from sqlmodel import Column, Enum, Field, Relationship, SQLModel
+from sqlmodel import Column, Enum, Field, Index, Relationship, SQLModel
 
+from gpsync.google_photos.records import MediaItemRecord
 from gpsync.google_photos.schemas.albums import Album as GooglePhotosAlbum
-from gpsync.google_photos.schemas.media_items import (
-    MediaItem,
-    MediaMetadata,
-    Photo,
-    Video,
-    VideoProcessingStatus,
-)
+from gpsync.google_photos.schemas.media_items import MediaItem, VideoProcessingStatus
 
 
 class AlbumDownloadRunLink(SQLModel, table=True):
@@ -24,24 +19,68 @@ class AlbumDownloadRunLink(SQLModel, table=True):
     )
 
 
+class AlbumContentLink(SQLModel, table=True):
+    """Content in an album. The same content can be in any number of albums."""
+
+    album_id: Optional[str] = Field(
+        default=None, foreign_key="album.id", primary_key=True
+    )
+    content_id: Optional[str] = Field(
+        default=None, foreign_key="content.id", primary_key=True, index=True
+    )
+    # When the album was last indexed with the content in it. Links that the latest
+    # indexing of an album didn't see were removed from the album.
+    indexed_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.utcnow,
+        nullable=False,
+    )
+
+
 class Album(SQLModel, table=True):
     id: str = Field(default=None, primary_key=True)
     title: Optional[str] = None
+    # Last state reported by the API when the albums were listed.
+    media_items_count: Optional[int] = None
+    cover_photo_media_item_id: Optional[str] = None
+    # State of the album when its content was last indexed.
+    synced_media_items_count: Optional[int] = None
+    synced_cover_photo_media_item_id: Optional[str] = None
+    synced_at: Optional[datetime.datetime] = None
     download_runs: List["DownloadRun"] = Relationship(
         back_populates="albums", link_model=AlbumDownloadRunLink
     )
 
+    @property
+    def needs_sync(self) -> bool:
+        """Whether the album changed since its content was last indexed.
+
+        The API has no change feed for albums, the item count and cover photo are the
+        cheapest signals that content was added to or removed from an album."""
+        return (
+            self.synced_at is None
+            or self.media_items_count != self.synced_media_items_count
+            or self.cover_photo_media_item_id != self.synced_cover_photo_media_item_id
+        )
+
+    def mark_synced(self):
+        self.synced_media_items_count = self.media_items_count
+        self.synced_cover_photo_media_item_id = self.cover_photo_media_item_id
+        self.synced_at = datetime.datetime.utcnow()
+
     def to_google_photos_api_album(self) -> "GooglePhotosAlbum":
         return GooglePhotosAlbum(id=self.id, title=self.title)
 
 
 class Content(SQLModel, table=True):
     id: str = Field(primary_key=True)
-    album_id: Optional[str] = Field(default=None, foreign_key="album.id")
     base_url: str
     download_url: str
+    # Base URLs expire, so track when they were obtained.
+    base_url_fetched_at: Optional[datetime.datetime] = Field(
+        default_factory=datetime.datetime.utcnow
+    )
     google_photos_filename: str
-    content_creation_time: datetime.datetime
+    content_creation_time: datetime.datetime = Field(index=True)
     height: int
     width: int
     mime_type: str
@@ -88,40 +127,15 @@ class Content(SQLModel, table=True):
         return content
 
     def to_media_item(self) -> MediaItem:
-        photo: Optional[Photo] = None
-        video: Optional[Video] = None
-
-        if "image" in self.mime_type:
-            photo = Photo()
-        elif "video" in self.mime_type:
-            if self.fps is None or self.status is None:
-                raise ValueError("fps and status cannot be None for videos")
-
-            video = Video(fps=self.fps, status=self.status)
-        else:
-            raise ValueError(
-                "media_item is neither a photo nor a video, this shouldn't happen."
-            )
-
-        media_metadata = MediaMetadata(
-            creation_time=self.content_creation_time.isoformat().replace("+00:00", "Z"),
-            width=str(self.width),
-            height=str(self.height),
-            photo=photo,
-            video=video,
-        )
-        return MediaItem(
-            id=self.id,
-            product_url="",
-            base_url=self.base_url,
-            mime_type=self.mime_type,
-            filename=self.google_photos_filename,
-            description=self.description,
-            media_metadata=media_metadata,
-        )
+        return MediaItemRecord.from_content(self).to_media_item()
 
 
 class Download(SQLModel, table=True):
+    # Covers "has this content been downloaded under this path" lookups.
+    __table_args__ = (
+        Index("ix_download_content_id_local_filepath", "content_id", "local_filepath"),
+    )
+
     local_filepath: str = Field(primary_key=True)
     local_filename: str
     content_id: str = Field(foreign_key="content.id")
@@ -132,6 +146,21 @@ class Download(SQLModel, table=True):
     download_run_id: uuid.UUID = Field(foreign_key="download_run.id")
 
 
+class PartialDownload(SQLModel, table=True):
+    """Progress of a large download that a later run can resume."""
+
+    __tablename__ = "partial_download"
+
+    content_id: str = Field(foreign_key="content.id", primary_key=True)
+    part_filepath: str
+    offset: int
+    total_bytes: int
+    updated_at: datetime.datetime = Field(
+        default_factory=datetime.datetime.utcnow,
+        nullable=False,
+    )
+
+
 class DownloadRun(SQLModel, table=True):
     """Download run for an individual album or piece of content."""
 
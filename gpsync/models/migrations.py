@@ -0,0 +1,60 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Inspector
+from sqlalchemy.future import Engine
+from sqlalchemy.schema import CreateColumn
+from sqlmodel import SQLModel
+
+
+def migrate(engine: Engine) -> None:
+    """Bring an existing index database up to date with the models.
+
+    `SQLModel.metadata.create_all` only creates missing tables, so columns and indexes
+    that were added to the models after a table was created are added here. Added
+    columns must be nullable or have a server default."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                definition = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {preparer.format_table(table)} "
+                        f"ADD COLUMN {definition}"
+                    )
+                )
+
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+
+        backfill_album_content_links(connection, inspector)
+
+
+def backfill_album_content_links(connection: Connection, inspector: Inspector) -> None:
+    """Link content to the album it used to belong to through `content.album_id`.
+
+    The column is left in place, nothing reads it anymore."""
+    if not inspector.has_table("content"):
+        return
+
+    columns = {column["name"] for column in inspector.get_columns("content")}
+    if "album_id" not in columns:
+        return
+
+    if connection.execute(text("SELECT 1 FROM albumcontentlink LIMIT 1")).first():
+        return
+
+    connection.execute(
+        text(
+            "INSERT INTO albumcontentlink (album_id, content_id, indexed_at) "
+            "SELECT album_id, id, CURRENT_TIMESTAMP FROM content "
+            "WHERE album_id IS NOT NULL"
+        )
+    )
@@ -1,7 +1,56 @@
+import errno
 import os
+import shutil
+import uuid
 
 
 def create_directories(filepath: str) -> None:
     directories = "/".join(filepath.split("/")[:-1])
     if directories:
         os.makedirs(directories, exist_ok=True)
+
+
+def temporary_filepath(filepath: str) -> str:
+    """Unique sibling of `filepath`, used to write a file before renaming it into place."""
+    directory, filename = os.path.split(filepath)
+    return os.path.join(directory, f".{filename}.{uuid.uuid4().hex}.tmp")
+
+
+def move_into_place(source: str, destination: str) -> None:
+    """Atomically move `source` to `destination`.
+
+    When the two paths are on different filesystems the file is first copied next to
+    `destination` so that the final step is still an atomic rename."""
+    try:
+        os.replace(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+
+        staged_filepath = temporary_filepath(destination)
+        try:
+            shutil.copyfile(source, staged_filepath)
+            os.replace(staged_filepath, destination)
+        except BaseException:
+            if os.path.exists(staged_filepath):
+                os.remove(staged_filepath)
+            raise
+        os.remove(source)
+
+
+def link_into_place(source: str, destination: str) -> None:
+    """Atomically make `destination` a hard link to `source`.
+
+    Falls back to a copy where hard links aren't supported, e.g. across filesystems or
+    on filesystems without them."""
+    staged_filepath = temporary_filepath(destination)
+    try:
+        try:
+            os.link(source, staged_filepath)
+        except OSError:
+            shutil.copyfile(source, staged_filepath)
+        os.replace(staged_filepath, destination)
+    except BaseException:
+        if os.path.exists(staged_filepath):
+            os.remove(staged_filepath)
+        raise
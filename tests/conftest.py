@@ -0,0 +1,25 @@
+from typing import Iterator
+
+import pytest
+
+from gpsync.google_photos.client import GooglePhotosClient
+from tests.helpers import ContentServer, FakeApi
+
+
+@pytest.fixture
+def content_server() -> Iterator[ContentServer]:
+    server = ContentServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def fake_api() -> FakeApi:
+    return FakeApi()
+
+
+@pytest.fixture
+def client(fake_api: FakeApi) -> Iterator[GooglePhotosClient]:
+    google_photos_client = GooglePhotosClient(client=fake_api)
+    yield google_photos_client
+    google_photos_client.transport.close()
@@ -0,0 +1,139 @@
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import piexif  # type: ignore
+import piexif.helper  # type: ignore
+import pytest
+from PIL import Image
+
+from gpsync.content import content_types
+from gpsync.content.content_types import GooglePhoto, GoogleVideo, SaveMode
+from tests.helpers import make_jpeg, make_media_item
+
+
+def scan_data(jpeg: bytes) -> bytes:
+    """Entropy coded image data, everything after the start of scan marker."""
+    return jpeg[jpeg.index(b"\xff\xda") :]
+
+
+def user_comment(path: str) -> str:
+    exif_dict = piexif.load(path)
+    return piexif.helper.UserComment.load(exif_dict["Exif"][piexif.ExifIFD.UserComment])
+
+
+def make_photo(tmp_path, data: bytes, description=None, save_mode=SaveMode.ORIGINAL):
+    filepath = tmp_path / "download.part"
+    filepath.write_bytes(data)
+    media_item = make_media_item("photo", "http://photos", description=description)
+    return GooglePhoto(
+        media_item=media_item, filepath=str(filepath), save_mode=save_mode
+    )
+
+
+def test_original_jpeg_without_description_is_byte_exact(tmp_path):
+    jpeg = make_jpeg()
+    make_photo(tmp_path, jpeg).save(f"{tmp_path}/photo.jpg")
+
+    assert (tmp_path / "photo.jpg").read_bytes() == jpeg
+    assert sorted(os.listdir(tmp_path)) == ["photo.jpg"]
+
+
+def test_original_jpeg_splices_description_into_exif(tmp_path):
+    jpeg = make_jpeg()
+    make_photo(tmp_path, jpeg, description="Beach ☀").save(f"{tmp_path}/photo.jpg")
+
+    saved = (tmp_path / "photo.jpg").read_bytes()
+    assert scan_data(saved) == scan_data(jpeg)
+    assert user_comment(f"{tmp_path}/photo.jpg") == "Beach ☀"
+    assert piexif.load(saved)["0th"][piexif.ImageIFD.Make] == b"Camera"
+    assert sorted(os.listdir(tmp_path)) == ["photo.jpg"]
+
+
+def test_original_non_jpeg_writes_xmp_sidecar(tmp_path):
+    buffer = io.BytesIO()
+    Image.new("RGB", (2, 2)).save(buffer, format="PNG")
+    png = buffer.getvalue()
+
+    make_photo(tmp_path, png, description="<a & b>").save(f"{tmp_path}/photo.png")
+
+    assert (tmp_path / "photo.png").read_bytes() == png
+    sidecar = (tmp_path / "photo.png.xmp").read_text(encoding="utf-8")
+    assert "&lt;a &amp; b&gt;" in sidecar
+
+
+def test_original_malformed_jpeg_falls_back_to_sidecar(tmp_path):
+    malformed = b"\xff\xd8\xff\xe1\x00\x10Exif\x00\x00garbage"
+    make_photo(tmp_path, malformed, description="kept").save(f"{tmp_path}/photo.jpg")
+
+    assert (tmp_path / "photo.jpg").read_bytes() == malformed
+    assert "kept" in (tmp_path / "photo.jpg.xmp").read_text(encoding="utf-8")
+
+
+def test_original_failed_move_leaves_no_sidecar(tmp_path, monkeypatch):
+    def failing_move(source, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(content_types, "move_into_place", failing_move)
+    photo = make_photo(tmp_path, b"not a jpeg", description="description")
+
+    with pytest.raises(OSError):
+        photo.save(f"{tmp_path}/photo.heic")
+
+    assert not (tmp_path / "photo.heic.xmp").exists()
+
+
+def test_reencode_writes_description(tmp_path):
+    photo = make_photo(
+        tmp_path, make_jpeg(), description="reencoded", save_mode=SaveMode.REENCODE
+    )
+    photo.save(f"{tmp_path}/photo.jpg")
+
+    assert user_comment(f"{tmp_path}/photo.jpg") == "reencoded"
+    assert sorted(os.listdir(tmp_path)) == ["photo.jpg"]
+
+
+def test_video_is_moved_into_place(tmp_path):
+    (tmp_path / "download.part").write_bytes(b"video")
+    media_item = make_media_item("video", "http://videos", video=True)
+    video = GoogleVideo(media_item=media_item, filepath=str(tmp_path / "download.part"))
+
+    video.save(f"{tmp_path}/video.mp4")
+
+    assert (tmp_path / "video.mp4").read_bytes() == b"video"
+    assert sorted(os.listdir(tmp_path)) == ["video.mp4"]
+
+
+@pytest.mark.parametrize("save_mode", list(SaveMode))
+def test_prepare_processes_the_temporary_file_in_place(tmp_path, save_mode):
+    photo = make_photo(tmp_path, make_jpeg(), "in place", save_mode=save_mode)
+
+    photo.prepare()
+
+    assert sorted(os.listdir(tmp_path)) == ["download.part"]
+    assert user_comment(photo.filepath) == "in place"
+
+    photo.commit(f"{tmp_path}/photo.jpg")
+    assert sorted(os.listdir(tmp_path)) == ["photo.jpg"]
+    assert user_comment(f"{tmp_path}/photo.jpg") == "in place"
+
+
+@pytest.mark.parametrize("description", [None, "in a process"])
+@pytest.mark.parametrize("save_mode", list(SaveMode))
+def test_process_pool_output_is_byte_identical(tmp_path, save_mode, description):
+    outputs = []
+    with ProcessPoolExecutor(
+        max_workers=1, initializer=content_types.register_image_openers
+    ) as executor:
+        for name, photo_executor in [("threads", None), ("processes", executor)]:
+            directory = tmp_path / name
+            directory.mkdir()
+            photo = make_photo(directory, make_jpeg(), description, save_mode)
+
+            photo.save(f"{directory}/photo.jpg", photo_executor)
+
+            outputs.append(sorted(os.listdir(directory)))
+            outputs.append((directory / "photo.jpg").read_bytes())
+
+    assert outputs[0] == outputs[2]
+    assert outputs[1] == outputs[3]
@@ -0,0 +1,160 @@
+import asyncio
+import os
+
+import pytest
+
+from gpsync.content.content_types import GooglePhoto
+from gpsync.google_photos.async_client import AsyncGooglePhotosClient, AsyncLimits
+from gpsync.google_photos.schemas.albums import Album
+from tests.helpers import make_media_item, make_media_item_dict
+
+
+def run(coroutine, timeout: float = 5.0):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout))
+
+
+async def collect(async_client, media_items, download_dir):
+    return [
+        content
+        async for content in async_client.download_media_items(
+            media_items, download_dir=download_dir
+        )
+    ]
+
+
+def test_download_media_items_yields_as_completed(client, content_server, tmp_path):
+    slow = make_media_item("slow", content_server.add("/slow", body=b"s", delay=0.5))
+    fast = [
+        make_media_item(f"fast{i}", content_server.add(f"/fast{i}", body=b"f"))
+        for i in range(3)
+    ]
+
+    async def download():
+        async with AsyncGooglePhotosClient(
+            client=client, limits=AsyncLimits(download_concurrency=4)
+        ) as async_client:
+            return await collect(async_client, [slow, *fast], str(tmp_path))
+
+    contents = run(download())
+
+    assert [content.media_item.id for content in contents][-1] == "slow"
+    assert all(isinstance(content, GooglePhoto) for content in contents)
+
+
+def test_download_media_items_accepts_async_iterables(client, content_server, tmp_path):
+    media_items = [
+        make_media_item(f"p{i}", content_server.add(f"/p{i}", body=b"p"))
+        for i in range(5)
+    ]
+
+    async def generate():
+        for media_item in media_items:
+            yield media_item
+
+    async def download():
+        async with AsyncGooglePhotosClient(client=client) as async_client:
+            return await collect(async_client, generate(), str(tmp_path))
+
+    assert {content.media_item.id for content in run(download())} == {
+        media_item.id for media_item in media_items
+    }
+
+
+def test_download_media_items_raises_without_hanging(client, content_server, tmp_path):
+    media_items = [
+        make_media_item(f"p{i}", content_server.add(f"/p{i}", body=b"p"))
+        for i in range(100)
+    ]
+    media_items[10] = make_media_item("broken", content_server.add("/b", status=404))
+
+    async def download():
+        limits = AsyncLimits(download_concurrency=2, queue_size=4)
+        async with AsyncGooglePhotosClient(
+            client=client, limits=limits
+        ) as async_client:
+            async for content in async_client.download_media_items(
+                media_items, download_dir=str(tmp_path)
+            ):
+                content.discard()
+
+    with pytest.raises(RuntimeError):
+        run(download())
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_media_item_refreshes_stale_url(
+    client, fake_api, content_server, tmp_path
+):
+    fresh_url = content_server.add("/fresh", body=b"photo")
+    fake_api.media_items["photo"] = make_media_item_dict("photo", fresh_url)
+    media_item = make_media_item("photo", content_server.add("/stale", status=403))
+
+    async def download():
+        async with AsyncGooglePhotosClient(client=client) as async_client:
+            return await async_client.download_media_item(media_item, str(tmp_path))
+
+    content = run(download())
+
+    assert fake_api.calls == {"mediaItems.get": 1}
+    with open(content.filepath, "rb") as file:
+        assert file.read() == b"photo"
+
+
+def test_download_album_pages_into_downloads(
+    client, fake_api, content_server, tmp_path
+):
+    fake_api.page_size = 2
+    fake_api.add_album(
+        "album",
+        "Album",
+        [
+            make_media_item_dict(f"p{i}", content_server.add(f"/p{i}", body=b"p"))
+            for i in range(5)
+        ],
+    )
+
+    async def download():
+        async with AsyncGooglePhotosClient(client=client) as async_client:
+            album = Album(id="album", title="Album")
+            return [
+                content
+                async for content in async_client.download_album(album, str(tmp_path))
+            ]
+
+    assert len(run(download())) == 5
+    assert fake_api.calls == {"mediaItems.search": 3}
+
+
+def test_save_and_stats(client, content_server, tmp_path):
+    media_items = [
+        make_media_item(f"p{i}", content_server.add(f"/p{i}", body=b"p"))
+        for i in range(10)
+    ]
+
+    async def download():
+        limits = AsyncLimits(download_concurrency=2)
+        async with AsyncGooglePhotosClient(
+            client=client, limits=limits
+        ) as async_client:
+            async for content in async_client.download_media_items(
+                media_items, download_dir=str(tmp_path / "staging")
+            ):
+                await async_client.save(
+                    content, f"{tmp_path}/{content.media_item.filename}"
+                )
+            return async_client.stats()
+
+    stats = run(download())
+
+    assert stats.requests == 10
+    assert 1 <= stats.misses <= 2
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["staging", *(media_item.filename for media_item in media_items)]
+    )
+    assert os.listdir(tmp_path / "staging") == []
+
+
+def test_requires_context_manager(client):
+    with pytest.raises(RuntimeError):
+        AsyncGooglePhotosClient(client=client).http
@@ -0,0 +1,147 @@
+import asyncio
+import datetime
+import os
+
+import pytest
+
+from gpsync.google_photos import client as client_module
+from gpsync.google_photos.async_client import AsyncGooglePhotosClient
+from gpsync.google_photos.bandwidth import (
+    BandwidthLimiter,
+    BandwidthSchedule,
+    BandwidthWindow,
+    ByteBudget,
+    ByteBudgetExhausted,
+    parse_size,
+)
+from tests.google_photos.test_rate_limit import FakeClock
+from tests.helpers import make_media_item
+
+
+class FakeTimeOfDay:
+    def __init__(self, hour: int):
+        self.hour = hour
+
+    def __call__(self) -> datetime.datetime:
+        return datetime.datetime(2022, 1, 1, self.hour)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("500", 500), ("1.5K", 1536), ("2M", 2 * 1024**2), ("10GiB", 10 * 1024**3)],
+)
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+def test_parse_size_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_size("fast")
+
+
+def test_bandwidth_windows_can_run_past_midnight():
+    night = BandwidthWindow.parse("22:00-07:00=unlimited")
+    day = BandwidthWindow.parse("09:00-18:00=1M")
+
+    assert night.bytes_per_second is None
+    assert day.bytes_per_second == 1024**2
+    assert night.contains(datetime.time(23)) and night.contains(datetime.time(6))
+    assert not night.contains(datetime.time(12))
+    assert day.contains(datetime.time(9)) and not day.contains(datetime.time(18))
+
+    with pytest.raises(ValueError):
+        BandwidthWindow.parse("09:00=1M")
+
+
+def test_limiter_paces_bytes_by_time_of_day():
+    clock = FakeClock()
+    time_of_day = FakeTimeOfDay(hour=12)
+    limiter = BandwidthLimiter(
+        BandwidthSchedule(
+            bytes_per_second=100,
+            windows=[BandwidthWindow.parse("22:00-07:00=unlimited")],
+        ),
+        clock=clock,
+        now=time_of_day,
+        sleep=clock.sleep,
+    )
+
+    # A second worth of bytes is allowed in a burst, then bytes are paced.
+    assert limiter.reserve(100) == 0
+    assert limiter.reserve(50) == 0.5
+
+    time_of_day.hour = 23
+    assert limiter.reserve(10**9) == 0
+
+    time_of_day.hour = 12
+    limiter.throttle(50)
+    assert clock.sleeps == [1.0]
+
+
+def test_download_is_throttled(client, content_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(client_module, "DOWNLOAD_CHUNK_SIZE", 10)
+    clock = FakeClock()
+    client.bandwidth_limiter = BandwidthLimiter(
+        BandwidthSchedule(bytes_per_second=10), clock=clock, sleep=clock.sleep
+    )
+    url = content_server.add("/video", body=os.urandom(100))
+
+    client.download_media_item(
+        make_media_item("video", url, video=True), download_dir=str(tmp_path)
+    )
+
+    # The first second was a burst, the other 90 bytes took 9 seconds.
+    assert sum(clock.sleeps) == pytest.approx(9)
+
+
+def test_async_download_is_throttled(client, content_server, tmp_path, monkeypatch):
+    clock = FakeClock()
+    client.bandwidth_limiter = BandwidthLimiter(
+        BandwidthSchedule(bytes_per_second=10), clock=clock
+    )
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    url = content_server.add("/video", body=os.urandom(100))
+
+    async def download():
+        async with AsyncGooglePhotosClient(client=client) as async_client:
+            await async_client.download_media_item(
+                make_media_item("video", url, video=True), download_dir=str(tmp_path)
+            )
+
+    asyncio.run(download())
+
+    assert sum(sleeps) == pytest.approx(9)
+
+
+def test_byte_budget_cuts_downloads_short(client, content_server, tmp_path):
+    budget = ByteBudget(150)
+    first = content_server.add("/first", body=os.urandom(100))
+    second = content_server.add("/second", body=os.urandom(100))
+
+    client.download_media_item(
+        make_media_item("first", first), download_dir=str(tmp_path), budget=budget
+    )
+    assert not budget.exhausted
+
+    with pytest.raises(ByteBudgetExhausted):
+        client.download_media_item(
+            make_media_item("second", second),
+            download_dir=str(tmp_path),
+            budget=budget,
+        )
+    assert budget.exhausted
+    # Too small to resume, the partial download is removed.
+    assert not os.path.exists(f"{tmp_path}/second.part")
+
+    # Nothing else is requested once the budget is spent.
+    num_requests = len(content_server.requests)
+    with pytest.raises(ByteBudgetExhausted):
+        client.download_media_item(
+            make_media_item("first", first), download_dir=str(tmp_path), budget=budget
+        )
+    assert len(content_server.requests) == num_requests
@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from gpsync.content.content_types import GooglePhoto, GoogleVideo
+from gpsync.google_photos import client as client_module
+from gpsync.google_photos.client import remove_temporary_files
+from tests.helpers import make_media_item, make_media_item_dict
+
+
+def test_download_media_item_streams_to_temporary_file(
+    client, content_server, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(client_module, "DOWNLOAD_CHUNK_SIZE", 7)
+    body = os.urandom(100)
+    url = content_server.add("/video", body=body)
+
+    content = client.download_media_item(
+        make_media_item("video", url, video=True), download_dir=str(tmp_path)
+    )
+
+    assert isinstance(content, GoogleVideo)
+    assert os.path.dirname(content.filepath) == str(tmp_path)
+    with open(content.filepath, "rb") as file:
+        assert file.read() == body
+
+    content.save(f"{tmp_path}/video.mp4")
+    with open(f"{tmp_path}/video.mp4", "rb") as file:
+        assert file.read() == body
+    assert os.listdir(tmp_path) == ["video.mp4"]
+
+
+def test_download_media_item_refreshes_stale_url(
+    client, fake_api, content_server, tmp_path
+):
+    stale_url = content_server.add("/stale", status=403)
+    fresh_url = content_server.add("/fresh", body=b"photo")
+    fake_api.media_items["photo"] = make_media_item_dict("photo", fresh_url)
+
+    content = client.download_media_item(
+        make_media_item("photo", stale_url), download_dir=str(tmp_path)
+    )
+
+    assert isinstance(content, GooglePhoto)
+    assert fake_api.calls == {"mediaItems.get": 1}
+    with open(content.filepath, "rb") as file:
+        assert file.read() == b"photo"
+
+
+def test_download_media_item_failure_leaves_no_files(client, content_server, tmp_path):
+    url = content_server.add("/missing", status=404)
+
+    with pytest.raises(RuntimeError):
+        client.download_media_item(
+            make_media_item("p", url), download_dir=str(tmp_path)
+        )
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_media_items_discards_finished_downloads_on_error(
+    client, content_server, tmp_path
+):
+    media_items = [
+        make_media_item(f"p{i}", content_server.add(f"/p{i}", body=b"photo"))
+        for i in range(5)
+    ]
+    media_items.insert(
+        2, make_media_item("broken", content_server.add("/broken", status=404))
+    )
+
+    with pytest.raises(RuntimeError):
+        client.download_media_items(
+            media_items, "test", num_threads=2, download_dir=str(tmp_path)
+        )
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_remove_temporary_files(tmp_path):
+    (tmp_path / "abc.part").write_bytes(b"partial")
+    (tmp_path / "keep.jpg").write_bytes(b"photo")
+
+    remove_temporary_files(str(tmp_path))
+    remove_temporary_files(f"{tmp_path}/missing")
+
+    assert os.listdir(tmp_path) == ["keep.jpg"]
+
+
+def test_batch_get_media_items_requests_at_most_50_ids(client, fake_api):
+    for i in range(120):
+        fake_api.media_items[f"p{i}"] = make_media_item_dict(f"p{i}", f"http://x/{i}")
+
+    media_items = client.batch_get_media_items(
+        [f"p{i}" for i in range(120)] + ["deleted"]
+    )
+
+    assert fake_api.calls == {"mediaItems.batchGet": 3}
+    assert [media_item.id for media_item in media_items] == [
+        f"p{i}" for i in range(120)
+    ]
+
+
+def test_paginators_request_pages_as_they_are_consumed(client, fake_api):
+    fake_api.page_size = 2
+    for album in range(5):
+        fake_api.add_album(
+            f"album{album}",
+            f"Album {album}",
+            [make_media_item_dict(f"a{album}p{i}", "http://photos") for i in range(5)],
+        )
+
+    albums = client.iter_albums()
+    assert next(albums).id == "album0"
+    assert fake_api.calls["albums.list"] == 1
+    assert [album.id for album in albums][-1] == "album4"
+    assert fake_api.calls["albums.list"] == 3
+
+    pages = client.iter_album_media_item_pages(client.list_all_albums()[0])
+    assert [media_item.id for media_item in next(pages)] == ["a0p0", "a0p1"]
+    assert fake_api.calls["mediaItems.search"] == 1
+    assert [len(page) for page in pages] == [2, 1]
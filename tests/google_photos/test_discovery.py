@@ -0,0 +1,85 @@
+import datetime
+import json
+import os
+
+import pytest
+from googleapiclient.discovery import build_from_document
+
+from benchmarks.fake_server import FakeLibraryConfig, FakePhotosServer
+from gpsync.google_photos.client import GooglePhotosClient
+from gpsync.google_photos.discovery import DiscoveryError, load_discovery_document
+
+UNREACHABLE_URL = "http://127.0.0.1:9/$discovery/rest?version=v1"
+
+
+@pytest.fixture
+def server():
+    with FakePhotosServer(FakeLibraryConfig(albums=2, items_per_album=1)) as server:
+        yield server
+
+
+@pytest.fixture
+def discovery_url(server):
+    return server.discovery_url.format(apiVersion="v1")
+
+
+def test_discovery_document_is_cached(server, discovery_url, tmp_path):
+    cache_filepath = f"{tmp_path}/cache/discovery.json"
+
+    document = load_discovery_document(cache_filepath, discovery_url=discovery_url)
+    assert json.loads(document)["name"] == "photoslibrary"
+    with open(cache_filepath) as file:
+        assert file.read() == document
+
+    # Fresh caches are used without reaching the discovery endpoint.
+    assert (
+        load_discovery_document(cache_filepath, discovery_url=UNREACHABLE_URL)
+        == document
+    )
+    assert os.listdir(f"{tmp_path}/cache") == ["discovery.json"]
+
+
+def test_expired_discovery_document_is_refreshed(discovery_url, tmp_path):
+    cache_filepath = f"{tmp_path}/discovery.json"
+    with open(cache_filepath, "w") as file:
+        file.write(json.dumps({"resources": {}, "name": "old"}))
+    os.utime(cache_filepath, (0, 0))
+
+    document = load_discovery_document(
+        cache_filepath, ttl=datetime.timedelta(days=1), discovery_url=discovery_url
+    )
+
+    assert json.loads(document)["name"] == "photoslibrary"
+
+
+def test_expired_discovery_document_is_used_when_endpoint_fails(tmp_path):
+    cache_filepath = f"{tmp_path}/discovery.json"
+    stale = json.dumps({"resources": {}, "name": "old"})
+    with open(cache_filepath, "w") as file:
+        file.write(stale)
+    os.utime(cache_filepath, (0, 0))
+
+    assert (
+        load_discovery_document(cache_filepath, discovery_url=UNREACHABLE_URL) == stale
+    )
+
+
+def test_discovery_failure_without_cache_raises(server, tmp_path):
+    with pytest.raises(DiscoveryError):
+        load_discovery_document(
+            f"{tmp_path}/discovery.json", discovery_url=server.url + "/missing"
+        )
+
+    assert not os.path.exists(f"{tmp_path}/discovery.json")
+
+
+def test_client_built_from_cached_document(server, discovery_url, tmp_path):
+    document = load_discovery_document(
+        f"{tmp_path}/discovery.json", discovery_url=discovery_url
+    )
+    client = GooglePhotosClient(client=build_from_document(document))
+
+    assert [album.id for album in client.list_all_albums()] == [
+        album["id"] for album in server.albums
+    ]
+    client.transport.close()
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from gpsync.google_photos import client as client_module
+from gpsync.google_photos import partial
+from gpsync.google_photos.partial import (
+    IncompleteDownload,
+    PartialFile,
+    parse_content_range,
+)
+from tests.helpers import make_media_item
+
+
+@pytest.fixture
+def resumable(monkeypatch):
+    monkeypatch.setattr(partial, "RESUMABLE_MIN_SIZE", 1)
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 40-99/100") == (40, 100)
+    assert parse_content_range("bytes */100") == (None, 100)
+    assert parse_content_range("bytes 0-9/*") == (0, None)
+    assert parse_content_range(None) == (None, None)
+
+
+def test_finish_checks_content_length(tmp_path):
+    part = PartialFile(str(tmp_path), "item")
+    with part.open(200, {"Content-Length": "10"}) as file:
+        part.write(file, b"12345")
+
+    with pytest.raises(IncompleteDownload):
+        part.finish()
+
+
+def test_download_resumes_partial_file(client, content_server, tmp_path):
+    body = os.urandom(100)
+    url = content_server.add("/video", body=body)
+    with open(f"{tmp_path}/video.part", "wb") as file:
+        file.write(body[:40])
+
+    content = client.download_media_item(
+        make_media_item("video", url, video=True), download_dir=str(tmp_path)
+    )
+
+    assert content_server.requests[0]["headers"]["Range"] == "bytes=40-"
+    with open(content.filepath, "rb") as file:
+        assert file.read() == body
+
+
+def test_download_restarts_when_range_is_ignored(client, content_server, tmp_path):
+    body = os.urandom(100)
+    url = content_server.add("/video", body=body, ranges=False)
+    with open(f"{tmp_path}/video.part", "wb") as file:
+        file.write(b"stale bytes")
+
+    content = client.download_media_item(
+        make_media_item("video", url, video=True), download_dir=str(tmp_path)
+    )
+
+    with open(content.filepath, "rb") as file:
+        assert file.read() == body
+
+
+def test_interrupted_download_is_checkpointed_and_resumed(
+    client, content_server, tmp_path, resumable, monkeypatch
+):
+    monkeypatch.setattr(client_module, "DOWNLOAD_CHUNK_SIZE", 10)
+    body = os.urandom(100)
+    route_url = content_server.add("/video", body=body, truncate=60)
+    media_item = make_media_item("video", route_url, video=True)
+    checkpoints = []
+
+    def checkpoint(*args):
+        checkpoints.append(args)
+
+    with pytest.raises(Exception):
+        client.download_media_item(
+            media_item, download_dir=str(tmp_path), checkpoint=checkpoint
+        )
+
+    part_filepath = f"{tmp_path}/video.part"
+    assert checkpoints[-1] == ("video", part_filepath, 60, 100)
+    assert os.path.getsize(part_filepath) == 60
+
+    content_server.routes["/video"].truncate = None
+    content = client.download_media_item(
+        media_item, download_dir=str(tmp_path), checkpoint=checkpoint
+    )
+
+    assert content_server.requests[-1]["headers"]["Range"] == "bytes=60-"
+    with open(content.filepath, "rb") as file:
+        assert file.read() == body
+
+
+def test_small_interrupted_download_is_removed(client, content_server, tmp_path):
+    url = content_server.add("/video", body=os.urandom(100), truncate=60)
+
+    with pytest.raises(Exception):
+        client.download_media_item(
+            make_media_item("video", url, video=True),
+            download_dir=str(tmp_path),
+            checkpoint=lambda *args: None,
+        )
+
+    assert os.listdir(tmp_path) == []
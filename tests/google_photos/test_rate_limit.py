@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from gpsync.google_photos.async_client import AsyncGooglePhotosClient
+from gpsync.google_photos.client import GooglePhotosClient
+from gpsync.google_photos.rate_limit import (
+    AimdConcurrency,
+    EndpointClass,
+    RateLimiter,
+    RateLimitExceeded,
+    Throttled,
+    TokenBucket,
+    parse_retry_after,
+)
+from tests.helpers import make_media_item
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_allows_bursts_then_paces():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=2, clock=clock)
+
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0.1, 0.2]
+
+    clock.now += 1
+    assert bucket.reserve() == 0
+
+
+def test_token_bucket_rate_change_keeps_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, capacity=2, clock=clock)
+    assert bucket.reserve(4) == 0.2
+
+    bucket.set_rate(rate=1, capacity=1)
+
+    assert bucket.reserve() == 3
+
+
+def test_aimd_concurrency_halves_once_per_burst_and_grows_by_one_per_window():
+    clock = FakeClock()
+    concurrency = AimdConcurrency(maximum=16, clock=clock)
+
+    concurrency.on_throttle()
+    concurrency.on_throttle()
+    assert concurrency.limit == 8
+
+    clock.now += 2
+    concurrency.on_throttle()
+    assert concurrency.limit == 4
+
+    for _ in range(5):
+        concurrency.on_success()
+    assert int(concurrency.limit) == 5
+
+    for _ in range(5):
+        assert concurrency.try_acquire()
+    assert not concurrency.try_acquire()
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("120") == 120
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+
+
+def test_rate_limiter_retries_with_retry_after_and_pauses_endpoint():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+    responses = [Throttled(429, retry_after=30), "ok"]
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call(EndpointClass.API, request) == "ok"
+    assert clock.sleeps == [30]
+    assert int(limiter.concurrency(EndpointClass.API).limit) == 4
+
+
+def test_rate_limiter_gives_up_after_max_retries():
+    clock = FakeClock()
+    limiter = RateLimiter(clock=clock, sleep=clock.sleep)
+
+    def request():
+        raise Throttled(503)
+
+    with pytest.raises(RateLimitExceeded):
+        limiter.call(EndpointClass.CONTENT, request)
+
+    assert len(clock.sleeps) == limiter.limits.max_retries
+
+
+def test_api_requests_are_retried_when_throttled(fake_api):
+    clock = FakeClock()
+    client = GooglePhotosClient(
+        client=fake_api, rate_limiter=RateLimiter(clock=clock, sleep=clock.sleep)
+    )
+    fake_api.add_album("album", "Album", [])
+    fake_api.failures = [429, 503]
+
+    assert [album.id for album in client.list_all_albums()] == ["album"]
+    assert fake_api.calls["albums.list"] == 3
+
+
+def test_downloads_are_retried_when_throttled(client, content_server, tmp_path):
+    url = content_server.add(
+        "/photo", body=b"photo", failures=[429, 503], headers={"Retry-After": "0"}
+    )
+
+    content = client.download_media_item(
+        make_media_item("photo", url), download_dir=str(tmp_path)
+    )
+
+    with open(content.filepath, "rb") as file:
+        assert file.read() == b"photo"
+    assert len(content_server.requests) == 3
+
+
+def test_async_downloads_are_retried_when_throttled(client, content_server, tmp_path):
+    url = content_server.add(
+        "/photo", body=b"photo", failures=[429], headers={"Retry-After": "0"}
+    )
+
+    async def download():
+        async with AsyncGooglePhotosClient(client=client) as async_client:
+            return await async_client.download_media_item(
+                make_media_item("photo", url), str(tmp_path)
+            )
+
+    content = asyncio.run(asyncio.wait_for(download(), 5))
+
+    with open(content.filepath, "rb") as file:
+        assert file.read() == b"photo"
+    assert len(content_server.requests) == 2
+    assert int(client.rate_limiter.concurrency(EndpointClass.CONTENT).limit) == 32
@@ -0,0 +1,70 @@
+import datetime
+
+import pytest
+
+from gpsync.google_photos.records import MediaItemRecord
+from gpsync.google_photos.schemas.media_items import MediaItem
+from gpsync.models.index import Content
+from tests.helpers import make_media_item_dict
+
+
+@pytest.mark.parametrize("video", [False, True])
+def test_record_matches_pydantic_path(video):
+    item = make_media_item_dict(
+        "id", "http://photos/id", video=video, description="description"
+    )
+    updated_at = datetime.datetime(2023, 1, 1)
+
+    record = MediaItemRecord.from_api(item, updated_at)
+
+    expected = Content.from_media_item(MediaItem(**item)).dict()
+    row = record.to_content_row(updated_at)
+    for column in ["base_url_fetched_at", "created_at", "updated_at"]:
+        del expected[column]
+        del row[column]
+    assert row == expected
+    assert record.download_url == MediaItem(**item).download_url
+    assert (
+        record.to_media_item()
+        == Content.from_media_item(MediaItem(**item)).to_media_item()
+    )
+
+
+def test_record_round_trips_through_content():
+    item = make_media_item_dict("id", "http://photos/id", video=True)
+    content = Content.from_media_item(MediaItem(**item))
+
+    record = MediaItemRecord.from_content(content)
+
+    assert record.is_video
+    assert record.download_url == "http://photos/id=dv"
+    assert record.to_media_item() == content.to_media_item()
+
+
+def test_record_is_slotted():
+    record = MediaItemRecord.from_api(make_media_item_dict("id", "http://photos/id"))
+
+    assert not hasattr(record, "__dict__")
+
+
+def without_metadata(item):
+    del item["mediaMetadata"]
+
+
+def with_bad_creation_time(item):
+    item["mediaMetadata"]["creationTime"] = "not a time"
+
+
+def neither_photo_nor_video(item):
+    del item["mediaMetadata"]["photo"]
+
+
+@pytest.mark.parametrize(
+    "corrupt", [without_metadata, with_bad_creation_time, neither_photo_nor_video]
+)
+def test_malformed_media_item_raises_value_error(corrupt):
+    item = make_media_item_dict("id", "http://photos/id")
+    corrupt(item)
+
+    with pytest.raises(ValueError):
+        MediaItemRecord.from_api(item)
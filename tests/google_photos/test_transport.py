@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gpsync.google_photos.transport import (
+    HttpxTransport,
+    RequestsTransport,
+    TransportStats,
+    create_transport,
+)
+
+
+@pytest.fixture(params=[False, True], ids=["requests", "httpx"])
+def transport(request):
+    transport = create_transport(pool_size=2, http2=request.param)
+    yield transport
+    transport.close()
+
+
+def test_create_transport():
+    assert isinstance(create_transport(http2=False), RequestsTransport)
+    assert isinstance(create_transport(http2=True), HttpxTransport)
+
+
+def test_stream(transport, content_server):
+    url = content_server.add("/photo", body=b"0123456789", headers={"X-Test": "yes"})
+
+    with transport.stream(url, headers={"Range": "bytes=4-"}) as response:
+        assert response.status_code == 206
+        assert response.headers["X-Test"] == "yes"
+        assert b"".join(response.iter_content(chunk_size=3)) == b"456789"
+
+
+def test_stats_count_pool_hits_and_misses(transport, content_server):
+    url = content_server.add("/photo", body=b"photo")
+
+    def download(_):
+        with transport.stream(url) as response:
+            return b"".join(response.iter_content(chunk_size=1024))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert set(executor.map(download, range(20))) == {b"photo"}
+
+    stats = transport.stats()
+    assert stats.requests == 20
+    assert 1 <= stats.misses <= 2
+    assert stats.hits == stats.requests - stats.misses
+
+
+def test_transport_stats_properties():
+    stats = TransportStats(requests=10, connections=3)
+    assert stats.hits == 7
+    assert stats.misses == 3
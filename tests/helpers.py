@@ -0,0 +1,292 @@
+"""Fakes for the Google Photos Library API and content host shared by the tests."""
+
+import http.server
+import io
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import httplib2  # type: ignore
+import piexif  # type: ignore
+from googleapiclient.discovery import Resource  # type: ignore
+from googleapiclient.errors import HttpError  # type: ignore
+from PIL import Image
+
+from gpsync.google_photos.schemas.media_items import MediaItem
+
+
+class Route:
+    def __init__(
+        self,
+        body: bytes = b"",
+        status: int = 200,
+        delay: float = 0.0,
+        headers: Optional[Dict[str, str]] = None,
+        failures: Optional[List[int]] = None,
+        ranges: bool = True,
+        truncate: Optional[int] = None,
+    ):
+        self.body = body
+        self.status = status
+        # Statuses returned, in order, before the route starts returning `status`.
+        self.failures = list(failures or [])
+        # Whether Range requests are honoured.
+        self.ranges = ranges
+        # Drop the connection after sending this many bytes of the body.
+        self.truncate = truncate
+        self.delay = delay
+        self.headers = headers or {}
+
+
+class ContentServer:
+    """Local HTTP/1.1 keep-alive server standing in for the Google content host."""
+
+    def __init__(self):
+        self.routes: Dict[str, Route] = {}
+        self.requests: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                path = self.path.split("=")[0]
+                with server._lock:
+                    server.requests.append(
+                        {"path": path, "headers": dict(self.headers)}
+                    )
+
+                route = server.routes.get(path, Route(status=404))
+                if route.delay:
+                    time.sleep(route.delay)
+
+                body = route.body
+                status = route.status
+                headers = dict(route.headers)
+                with server._lock:
+                    if route.failures:
+                        status = route.failures.pop(0)
+                        body = b""
+
+                range_header = self.headers.get("Range")
+                if range_header and status == 200 and route.ranges:
+                    start = int(range_header.split("=")[1].split("-")[0])
+                    headers["Content-Range"] = (
+                        f"bytes {start}-{len(body) - 1}/{len(body)}"
+                    )
+                    body = body[start:]
+                    status = 206
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if route.truncate is not None:
+                    self.wfile.write(body[: route.truncate])
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add(self, path: str, **kwargs: Any) -> str:
+        self.routes[path] = Route(**kwargs)
+        return f"{self.base_url}{path}"
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeRequest:
+    def __init__(self, api: "FakeApi", name: str, func: Callable[[], Any]):
+        self._api = api
+        self._name = name
+        self._func = func
+        self.methodId = f"photoslibrary.{name}"
+
+    def execute(self, http: Any = None) -> Any:
+        api = self._api
+        with api.lock:
+            api.calls[self._name] = api.calls.get(self._name, 0) + 1
+            api.in_flight += 1
+            api.max_in_flight = max(api.max_in_flight, api.in_flight)
+
+        try:
+            if api.delay:
+                time.sleep(api.delay)
+            with api.lock:
+                failure = api.failures.pop(0) if api.failures else None
+            if failure is not None:
+                raise HttpError(
+                    httplib2.Response({"status": failure, "retry-after": "0"}), b""
+                )
+            return self._func()
+        finally:
+            with api.lock:
+                api.in_flight -= 1
+
+
+class FakeApi(Resource):
+    """Stand-in for the discovery based Photos Library `Resource`."""
+
+    def __init__(self):
+        self.albums_by_id: Dict[str, Dict[str, Any]] = {}
+        self.album_media_items: Dict[str, List[Dict[str, Any]]] = {}
+        self.media_items: Dict[str, Dict[str, Any]] = {}
+        self.calls: Dict[str, int] = {}
+        self.page_size: Optional[int] = None
+        self.delay = 0.0
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Statuses the next API requests fail with, in order.
+        self.failures: List[int] = []
+
+    def add_album(self, album_id: str, title: str, items: List[Dict[str, Any]]):
+        self.albums_by_id[album_id] = {
+            "id": album_id,
+            "title": title,
+            "mediaItemsCount": str(len(items)),
+        }
+        self.album_media_items[album_id] = items
+        for item in items:
+            self.media_items[item["id"]] = item
+
+    def add_media_item(self, album_id: str, item: Dict[str, Any]):
+        self.album_media_items[album_id].append(item)
+        self.media_items[item["id"]] = item
+        self.albums_by_id[album_id]["mediaItemsCount"] = str(
+            len(self.album_media_items[album_id])
+        )
+
+    def _page(self, items: List[Any], page_token: Optional[str], page_size: int):
+        page_size = self.page_size or page_size
+        start = int(page_token or 0)
+        end = start + page_size
+        return items[start:end], (str(end) if end < len(items) else None)
+
+    def albums(self) -> Any:
+        api = self
+
+        class Albums:
+            def list(self, pageSize: int = 50, pageToken: Optional[str] = None, **_):
+                def execute() -> Dict[str, Any]:
+                    albums, token = api._page(
+                        list(api.albums_by_id.values()), pageToken, pageSize
+                    )
+                    response: Dict[str, Any] = {"albums": albums}
+                    if token is not None:
+                        response["nextPageToken"] = token
+                    return response
+
+                return FakeRequest(api, "albums.list", execute)
+
+        return Albums()
+
+    def sharedAlbums(self) -> Any:
+        api = self
+
+        class SharedAlbums:
+            def list(self, **_):
+                return FakeRequest(
+                    api, "sharedAlbums.list", lambda: {"sharedAlbums": []}
+                )
+
+        return SharedAlbums()
+
+    def mediaItems(self) -> Any:
+        api = self
+
+        class MediaItems:
+            def search(self, body: Dict[str, Any]):
+                def execute() -> Dict[str, Any]:
+                    items, token = api._page(
+                        api.album_media_items[body["albumId"]],
+                        body.get("pageToken"),
+                        body.get("pageSize", 100),
+                    )
+                    response: Dict[str, Any] = {"mediaItems": items}
+                    if token is not None:
+                        response["nextPageToken"] = token
+                    return response
+
+                return FakeRequest(api, "mediaItems.search", execute)
+
+            def batchGet(self, mediaItemIds: List[str]):
+                def execute() -> Dict[str, Any]:
+                    assert len(mediaItemIds) <= 50
+                    return {
+                        "mediaItemResults": [
+                            (
+                                {"mediaItem": api.media_items[media_item_id]}
+                                if media_item_id in api.media_items
+                                else {"status": {"code": 5, "message": "NOT_FOUND"}}
+                            )
+                            for media_item_id in mediaItemIds
+                        ]
+                    }
+
+                return FakeRequest(api, "mediaItems.batchGet", execute)
+
+            def get(self, mediaItemId: str):
+                return FakeRequest(
+                    api, "mediaItems.get", lambda: api.media_items[mediaItemId]
+                )
+
+        return MediaItems()
+
+
+def make_media_item_dict(
+    media_item_id: str,
+    base_url: str,
+    video: bool = False,
+    description: Optional[str] = None,
+    filename: Optional[str] = None,
+    creation_time: str = "2022-01-01T00:00:00Z",
+) -> Dict[str, Any]:
+    media_metadata: Dict[str, Any] = {
+        "creationTime": creation_time,
+        "width": "4",
+        "height": "3",
+    }
+    if video:
+        media_metadata["video"] = {"fps": 30, "status": "READY"}
+    else:
+        media_metadata["photo"] = {}
+
+    extension = "mp4" if video else "jpg"
+    return {
+        "id": media_item_id,
+        "productUrl": "",
+        "baseUrl": base_url,
+        "mimeType": "video/mp4" if video else "image/jpeg",
+        "mediaMetadata": media_metadata,
+        "filename": filename or f"{media_item_id}.{extension}",
+        "description": description,
+    }
+
+
+def make_media_item(*args: Any, **kwargs: Any) -> MediaItem:
+    return MediaItem(**make_media_item_dict(*args, **kwargs))
+
+
+def make_jpeg(color=(200, 10, 10)) -> bytes:
+    exif = piexif.dump({"0th": {piexif.ImageIFD.Make: b"Camera"}, "Exif": {}})
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 3), color).save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from benchmarks.e2e import create_client, run, unthrottled_limits
+from benchmarks.fake_server import FakeLibraryConfig, FakePhotosServer
+from gpsync.index.indexer import DownloadEngine
+
+
+@pytest.fixture
+def server():
+    config = FakeLibraryConfig(
+        albums=3,
+        shared_albums=1,
+        items_per_album=7,
+        shared_item_fraction=0.3,
+        photo_size=4096,
+        video_size=8192,
+        max_page_size=3,
+        throttle_rate=0.2,
+        expired_rate=0.2,
+    )
+    with FakePhotosServer(config) as fake_server:
+        yield fake_server
+
+
+def test_client_pages_through_fake_server(server):
+    client = create_client(server.url, rate_limits=unthrottled_limits(4))
+
+    albums = client.list_all_albums(include_shared=True)
+    assert len(albums) == 4
+
+    media_items = [
+        item
+        for album in albums
+        for item in client.search_non_archived_album_media_items(album)
+    ]
+    assert {item.id for item in media_items} == set(server.media_items)
+
+    ids = sorted(server.media_items)[:5]
+    assert [item.id for item in client.batch_get_media_items(ids)] == ids
+    client.transport.close()
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_sync_against_fake_server(server, tmp_path, engine):
+    result = run(
+        server.url,
+        str(tmp_path),
+        engine=engine,
+        num_threads=4,
+        rate_limits=unthrottled_limits(4),
+    )
+
+    assert result["items"] == server.num_media_items
+    assert result["api_calls"]["albums.list"] >= 1
+    assert result["api_calls"]["mediaItems.search"] >= 4
+
+    store = tmp_path / "photos" / ".gpsync" / "store"
+    for media_item_id, item in server.media_items.items():
+        (filename,) = [f for f in os.listdir(store) if f.startswith(media_item_id)]
+        size = os.path.getsize(store / filename)
+        if item["mimeType"] == "video/mp4":
+            assert size == server.config.video_size
+        elif "description" not in item:
+            assert size == server.config.photo_size
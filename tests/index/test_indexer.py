@@ -0,0 +1,663 @@
+import datetime
+import functools
+import os
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, SQLModel, select
+
+from benchmarks.e2e import create_client
+from benchmarks.fake_server import FakeLibraryConfig, FakePhotosServer
+from gpsync.google_photos import async_client as async_client_module
+from gpsync.google_photos import client as client_module
+from gpsync.google_photos import partial
+from gpsync.google_photos.async_client import AsyncLimits
+from gpsync.index import indexer as indexer_module
+from gpsync.index.indexer import DownloadEngine, GooglePhotosIndexer, get_engine
+from gpsync.index.options import DownloadOrder
+from gpsync.index.pipeline import PipelineLimits
+from gpsync.index.window import DateWindow
+from gpsync.metrics import URL_REFRESHES
+from gpsync.models.index import (
+    Album,
+    AlbumContentLink,
+    Content,
+    Download,
+    DownloadRun,
+    PartialDownload,
+)
+from tests.helpers import make_jpeg, make_media_item_dict
+
+
+@pytest.fixture
+def library(fake_api, content_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fake_api.page_size = 3
+    jpeg = make_jpeg()
+    for album in range(3):
+        fake_api.add_album(
+            f"album{album}",
+            f"Album {album}",
+            [
+                make_media_item_dict(
+                    f"a{album}p{i}",
+                    content_server.add(f"/a{album}p{i}", body=jpeg),
+                    description="description",
+                )
+                for i in range(5)
+            ],
+        )
+    fake_api.add_album(
+        "videos",
+        "Videos",
+        [
+            make_media_item_dict(
+                "v", content_server.add("/v", body=b"video"), video=True
+            )
+        ],
+    )
+    return fake_api
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_index_and_download(client, library, tmp_path, engine):
+    indexer = GooglePhotosIndexer(client=client)
+    base_path = f"{tmp_path}/photos"
+
+    indexer.index_albums()
+    indexer.index_all_album_content(engine=engine)
+    stats = indexer.download_indexed_content(base_path, engine=engine)
+
+    assert stats.requests == 16
+    assert sorted(os.listdir(base_path)) == [
+        ".gpsync",
+        "Album 0",
+        "Album 1",
+        "Album 2",
+        "Videos",
+    ]
+    assert len(os.listdir(f"{base_path}/Album 1")) == 5
+    assert os.listdir(f"{base_path}/.gpsync") == ["store"]
+    assert len(os.listdir(f"{base_path}/.gpsync/store")) == 16
+    with open(f"{base_path}/Videos/v.mp4", "rb") as file:
+        assert file.read() == b"video"
+
+    with Session(indexer.engine) as session:
+        assert len(session.exec(select(Download)).all()) == 16
+
+    stats = indexer.download_indexed_content(base_path, engine=engine)
+    assert stats.requests == 0
+
+
+def test_download_sweeps_stale_temporary_files(client, library, tmp_path):
+    base_path = f"{tmp_path}/photos"
+    os.makedirs(f"{base_path}/.gpsync")
+    with open(f"{base_path}/.gpsync/killed.part", "wb") as file:
+        file.write(b"partial")
+
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.download_indexed_content(base_path)
+
+    assert os.listdir(f"{base_path}/.gpsync") == ["store"]
+
+
+def test_index_all_album_content_pages_albums_concurrently(client, library):
+    library.delay = 0.05
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+
+    indexer.index_all_album_content(num_threads=4)
+
+    assert library.max_in_flight > 1
+    with Session(indexer.engine) as session:
+        album_ids = session.exec(select(AlbumContentLink.album_id)).all()
+    assert sorted(album_ids) == sorted(
+        album_id for album_id, items in library.album_media_items.items() for _ in items
+    )
+
+
+def test_index_all_album_content_is_serial_with_one_thread(client, library):
+    library.delay = 0.01
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+
+    indexer.index_all_album_content(num_threads=1)
+
+    assert library.max_in_flight == 1
+
+
+@pytest.fixture
+def statements():
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(Engine, "before_cursor_execute", record)
+
+
+def test_index_album_content_upserts_in_batches(client, library, statements):
+    indexer = GooglePhotosIndexer(client=client, batch_size=2)
+    indexer.index_albums()
+    indexer.index_album_content("album0")
+
+    statements.clear()
+    for item in library.album_media_items["album0"]:
+        item["baseUrl"] += "-refreshed"
+    indexer.index_album_content("album0")
+
+    inserts = [s for s in statements if s.startswith("INSERT INTO content")]
+    assert len(inserts) == 3
+    assert "ON CONFLICT" in inserts[0]
+    assert not any(s.startswith("SELECT content") for s in statements)
+
+    with Session(indexer.engine) as session:
+        contents = session.exec(select(Content)).all()
+    assert len(contents) == 5
+    assert all(content.base_url.endswith("-refreshed") for content in contents)
+    assert all(content.download_url.endswith("-refreshed=d") for content in contents)
+
+
+def test_index_albums_keeps_existing_albums(client, library):
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    library.albums_by_id["album0"]["title"] = "Renamed"
+    indexer.index_albums()
+
+    with Session(indexer.engine) as session:
+        assert session.get(Album, "album0").title == "Album 0"
+        assert len(session.exec(select(Album)).all()) == 4
+
+
+def test_download_does_not_query_per_item(client, library, tmp_path, statements):
+    indexer = GooglePhotosIndexer(client=client, batch_size=4)
+    indexer.index_albums()
+    indexer.index_all_album_content()
+
+    statements.clear()
+    indexer.download_indexed_content(f"{tmp_path}/photos")
+
+    selects = [s for s in statements if s.lstrip().startswith("SELECT")]
+    # The planned albums, then the content missing from each album directory and the
+    # files already in it, stored content, albums, partial downloads, the number of
+    # planned items and the streamed records. Only the album directories add queries.
+    assert len(selects) == 1 + 2 * 4 + 5
+    # No IN (...) lists of IDs that grow with the library either.
+    assert not any("?, ?, ?" in select for select in selects)
+    assert len(os.listdir(f"{tmp_path}/photos/Album 0")) == 5
+
+
+def test_indexer_creates_engine_and_schema_once(client, library, tmp_path, monkeypatch):
+    create_all_calls = []
+    create_all = SQLModel.metadata.create_all
+    monkeypatch.setattr(
+        SQLModel.metadata,
+        "create_all",
+        lambda engine: create_all_calls.append(engine) or create_all(engine),
+    )
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{tmp_path}/index.db"
+    )
+
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    indexer.index_album_content("album0")
+    indexer.download_indexed_content(f"{tmp_path}/photos")
+
+    assert len(create_all_calls) == 1
+    assert os.path.exists(f"{tmp_path}/index.db")
+    assert not os.path.exists(f"{tmp_path}/sqlite.db")
+
+
+def test_sqlite_engine_is_tuned_for_concurrent_readers(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path}/index.db")
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA cache_size").scalar() == -64000
+
+    with engine.connect() as writer:
+        transaction = writer.begin()
+        writer.exec_driver_sql("INSERT INTO album (id, title) VALUES ('a', 'A')")
+
+        # Under WAL a reader sees the last committed state instead of blocking.
+        with engine.connect() as reader:
+            count = reader.exec_driver_sql("SELECT count(*) FROM album").scalar()
+            assert count == 0
+
+        transaction.commit()
+
+
+def test_in_memory_engine(tmp_path):
+    engine = get_engine("sqlite://")
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM album").scalar() == 0
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_index_all_album_content_skips_unchanged_albums(client, library, engine):
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    indexer.index_all_album_content(engine=engine)
+    searches = library.calls["mediaItems.search"]
+
+    indexer.index_albums()
+    indexer.index_all_album_content(engine=engine)
+    assert library.calls["mediaItems.search"] == searches
+
+    library.add_media_item(
+        "album1",
+        make_media_item_dict(
+            "new", "http://localhost/new", creation_time="2023-05-01T00:00:00Z"
+        ),
+    )
+    indexer.index_albums()
+    indexer.index_all_album_content(engine=engine)
+
+    # album1 now has 6 items, paged 3 at a time.
+    assert library.calls["mediaItems.search"] == searches + 2
+    with Session(indexer.engine) as session:
+        assert session.get(AlbumContentLink, ("album1", "new")) is not None
+        album = session.get(Album, "album1")
+        assert album.synced_media_items_count == 6
+
+
+def test_index_all_album_content_full_sync(client, library):
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    searches = library.calls["mediaItems.search"]
+
+    indexer.index_all_album_content(full=True)
+
+    assert library.calls["mediaItems.search"] == 2 * searches
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_download_refreshes_stale_base_urls_in_batches(
+    client, library, content_server, tmp_path, capsys, engine
+):
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    indexer.index_all_album_content()
+
+    expired = content_server.add("/expired", status=403)
+    with Session(indexer.engine) as session:
+        for content in session.exec(select(Content)).all():
+            content.base_url = expired
+            content.download_url = f"{expired}=d"
+            content.base_url_fetched_at = datetime.datetime.utcnow() - (
+                datetime.timedelta(hours=2)
+            )
+            session.add(content)
+        session.commit()
+    # Deleted from the library since it was indexed.
+    del library.media_items["a1p0"]
+    missing = URL_REFRESHES.value(reason="missing")
+
+    indexer.download_indexed_content(f"{tmp_path}/photos", engine=engine)
+
+    assert library.calls["mediaItems.batchGet"] == 1
+    assert "mediaItems.get" not in library.calls
+    assert not any(r["path"] == "/expired" for r in content_server.requests)
+    assert len(os.listdir(f"{tmp_path}/photos/Album 2")) == 5
+    assert len(os.listdir(f"{tmp_path}/photos/Album 1")) == 4
+    assert URL_REFRESHES.value(reason="missing") == missing + 1
+    output = capsys.readouterr()
+    assert "Skipping 1 media items that are no longer in the library" in output.out
+    # Left out of the progress total.
+    assert "15/15" in output.err
+    with Session(indexer.engine) as session:
+        content = session.get(Content, "a0p0")
+        assert content.base_url == library.media_items["a0p0"]["baseUrl"]
+        assert content.base_url_fetched_at > datetime.datetime.utcnow() - (
+            datetime.timedelta(minutes=1)
+        )
+
+
+def test_download_skips_fresh_base_urls(client, library, tmp_path):
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    indexer.index_all_album_content()
+
+    indexer.download_indexed_content(f"{tmp_path}/photos")
+
+    assert "mediaItems.batchGet" not in library.calls
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_download_resumes_interrupted_download(
+    client, library, content_server, tmp_path, monkeypatch, engine
+):
+    monkeypatch.setattr(partial, "RESUMABLE_MIN_SIZE", 1)
+    monkeypatch.setattr(client_module, "DOWNLOAD_CHUNK_SIZE", 10)
+    monkeypatch.setattr(async_client_module, "DOWNLOAD_CHUNK_SIZE", 10)
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{tmp_path}/index.db"
+    )
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    base_path = f"{tmp_path}/photos"
+    video = content_server.routes["/v"]
+    video.body = os.urandom(100)
+    video.truncate = 30
+
+    with pytest.raises(Exception):
+        indexer.download_indexed_content(base_path, engine=engine)
+
+    with Session(indexer.engine) as session:
+        partial_download = session.get(PartialDownload, "v")
+        assert (partial_download.offset, partial_download.total_bytes) == (30, 100)
+
+    video.truncate = None
+    indexer.download_indexed_content(base_path, engine=engine)
+
+    video_requests = [r for r in content_server.requests if r["path"] == "/v"]
+    assert video_requests[-1]["headers"]["Range"] == "bytes=30-"
+    with open(f"{base_path}/Videos/v.mp4", "rb") as file:
+        assert file.read() == video.body
+    with Session(indexer.engine) as session:
+        assert session.exec(select(PartialDownload)).all() == []
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_download_stops_after_byte_budget(client, library, tmp_path, engine, capsys):
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{tmp_path}/index.db"
+    )
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    base_path = f"{tmp_path}/photos"
+    download = functools.partial(
+        indexer.download_indexed_content,
+        base_path,
+        engine=engine,
+        pipeline_limits=PipelineLimits(fetch_workers=1),
+        async_limits=AsyncLimits(download_concurrency=1),
+        order=DownloadOrder.SMALLEST_FIRST,
+    )
+
+    # Two photos fit, the third one is cut short.
+    download(byte_budget=2 * len(make_jpeg()) + 1)
+
+    # Reported without breaking the progress bar.
+    assert "Stopped after the byte budget" in capsys.readouterr().out
+    with Session(indexer.engine) as session:
+        assert len(session.exec(select(Download)).all()) == 2
+    assert [
+        filename
+        for filename in os.listdir(f"{base_path}/.gpsync")
+        if filename.endswith(".part")
+    ] == []
+
+    download()
+
+    with Session(indexer.engine) as session:
+        assert len(session.exec(select(Download)).all()) == 16
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_download_processes_photos_in_worker_processes(
+    client, library, tmp_path, engine
+):
+    indexer = GooglePhotosIndexer(client=client)
+    base_path = f"{tmp_path}/photos"
+    indexer.index_albums()
+    indexer.index_all_album_content()
+
+    indexer.download_indexed_content(base_path, engine=engine, photo_processes=2)
+
+    assert len(os.listdir(f"{base_path}/Album 1")) == 5
+    assert os.listdir(f"{base_path}/.gpsync") == ["store"]
+    with Session(indexer.engine) as session:
+        assert len(session.exec(select(Download)).all()) == 16
+
+
+def test_shared_content_is_downloaded_once_and_linked(
+    client, library, content_server, tmp_path
+):
+    shared = make_media_item_dict(
+        "shared", content_server.add("/shared", body=b"shared"), description=None
+    )
+    library.add_media_item("album0", shared)
+    library.add_media_item("album2", shared)
+    indexer = GooglePhotosIndexer(client=client)
+    base_path = f"{tmp_path}/photos"
+    indexer.index_albums()
+    indexer.index_all_album_content()
+
+    stats = indexer.download_indexed_content(base_path)
+
+    assert stats.requests == 17
+    stored = os.stat(f"{base_path}/.gpsync/store/shared.jpg")
+    for album in ["Album 0", "Album 2"]:
+        assert os.stat(f"{base_path}/{album}/shared.jpg").st_ino == stored.st_ino
+    assert not os.path.exists(f"{base_path}/Album 1/shared.jpg")
+
+    library.add_media_item("album1", shared)
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    stats = indexer.download_indexed_content(base_path)
+
+    # Linked from the store rather than downloaded again.
+    assert stats.requests == 0
+    assert os.stat(f"{base_path}/Album 1/shared.jpg").st_ino == stored.st_ino
+    with Session(indexer.engine) as session:
+        downloads = session.exec(
+            select(Download).where(Download.content_id == "shared")
+        ).all()
+    assert len(downloads) == 3
+
+
+def test_colliding_filenames_get_distinct_deterministic_paths(
+    client, fake_api, content_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    items = [
+        make_media_item_dict(
+            content_id,
+            content_server.add(f"/{content_id}", body=content_id.encode()),
+            filename="IMG_0001.jpg",
+            creation_time=creation_time,
+        )
+        for content_id, creation_time in [
+            ("newer", "2022-02-01T00:00:00Z"),
+            ("older", "2022-01-01T00:00:00Z"),
+        ]
+    ]
+    fake_api.add_album("album", "Album", items)
+    indexer = GooglePhotosIndexer(client=client)
+    base_path = f"{tmp_path}/photos"
+    indexer.index_albums()
+    indexer.index_all_album_content()
+
+    indexer.download_indexed_content(base_path)
+
+    assert sorted(os.listdir(f"{base_path}/Album")) == [
+        "IMG_0001 (1d47386a).jpg",
+        "IMG_0001.jpg",
+    ]
+    with open(f"{base_path}/Album/IMG_0001.jpg", "rb") as file:
+        assert file.read() == b"older"
+    with open(f"{base_path}/Album/IMG_0001 (1d47386a).jpg", "rb") as file:
+        assert file.read() == b"newer"
+
+
+def test_colliding_filename_added_later_keeps_downloaded_file(
+    client, fake_api, content_server, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    newer, older = [
+        make_media_item_dict(
+            content_id,
+            content_server.add(f"/{content_id}", body=content_id.encode()),
+            filename="IMG_0001.jpg",
+            creation_time=creation_time,
+        )
+        for content_id, creation_time in [
+            ("newer", "2022-02-01T00:00:00Z"),
+            ("older", "2022-01-01T00:00:00Z"),
+        ]
+    ]
+    fake_api.add_album("album", "Album", [newer])
+    indexer = GooglePhotosIndexer(client=client)
+    base_path = f"{tmp_path}/photos"
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    indexer.download_indexed_content(base_path)
+
+    fake_api.add_media_item("album", older)
+    for _ in range(2):
+        indexer.index_albums()
+        indexer.index_all_album_content()
+        indexer.download_indexed_content(base_path)
+
+    # The downloaded file keeps its name, the content added later gets a new one.
+    with open(f"{base_path}/Album/IMG_0001.jpg", "rb") as file:
+        assert file.read() == b"newer"
+    older_filename = indexer_module.disambiguate_filename("IMG_0001.jpg", "older")
+    with open(f"{base_path}/Album/{older_filename}", "rb") as file:
+        assert file.read() == b"older"
+    with Session(indexer.engine) as session:
+        assert sorted(
+            (download.content_id, download.local_filename)
+            for download in session.exec(select(Download))
+        ) == [("newer", "IMG_0001.jpg"), ("older", older_filename)]
+
+
+def test_album_filepaths_ignore_case_and_order():
+    created = datetime.datetime(2022, 1, 1)
+    members = [
+        ("Trip", "b", "a.jpg", created),
+        ("Trip", "a", "A.JPG", created),
+        ("Beach", "a", "A.JPG", created),
+        (None, "c", "c.mp4", created),
+    ]
+
+    filepaths = indexer_module.album_filepaths("/photos", members)
+
+    assert filepaths == indexer_module.album_filepaths("/photos", members[::-1])
+    assert sorted(filepaths["a"]) == ["/photos/Beach/A.JPG", "/photos/Trip/A.JPG"]
+    assert filepaths["b"] == [
+        f"/photos/Trip/{indexer_module.disambiguate_filename('a.jpg', 'b')}"
+    ]
+    assert filepaths["c"] == ["/photos/No Album/c.mp4"]
+
+
+def test_index_unlinks_content_removed_from_album(client, library):
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    indexer.index_all_album_content()
+
+    removed = library.album_media_items["album1"].pop()
+    indexer.index_all_album_content(full=True)
+
+    with Session(indexer.engine) as session:
+        assert session.get(AlbumContentLink, ("album1", removed["id"])) is None
+        assert session.get(Content, removed["id"]) is not None
+        links = session.exec(
+            select(AlbumContentLink).where(AlbumContentLink.album_id == "album1")
+        ).all()
+    assert len(links) == 4
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_index_all_album_content_writes_pages_as_they_arrive(
+    client, library, engine, monkeypatch
+):
+    library.add_album(
+        "large",
+        "Large",
+        [make_media_item_dict(f"l{i}", "http://localhost/l") for i in range(30)],
+    )
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    searches_at_first_write = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO content") and not searches_at_first_write:
+            searches_at_first_write.append(library.calls["mediaItems.search"])
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        indexer.index_all_album_content(num_threads=1, engine=engine)
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+    # 46 media items paged 3 at a time.
+    assert library.calls["mediaItems.search"] == 17
+    assert searches_at_first_write[0] < 17
+    with Session(indexer.engine) as session:
+        links = session.exec(
+            select(AlbumContentLink).where(AlbumContentLink.album_id == "large")
+        ).all()
+    assert len(links) == 30
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_windowed_album_sync(
+    client, fake_api, content_server, tmp_path, monkeypatch, engine
+):
+    monkeypatch.chdir(tmp_path)
+
+    def item(media_item_id: str, day: int):
+        return make_media_item_dict(
+            media_item_id,
+            content_server.add(f"/{media_item_id}", body=make_jpeg()),
+            creation_time=f"2022-01-{day:02d}T12:00:00Z",
+        )
+
+    fake_api.add_album("album", "Album", [item("a", 1), item("b", 5), item("c", 10)])
+    indexer = GooglePhotosIndexer(client=client)
+    indexer.index_albums()
+    indexer.index_all_album_content(engine=engine)
+
+    # "a" and "b" left the album and "d" was added to it.
+    fake_api.add_album("album", "Album", [fake_api.media_items["c"], item("d", 6)])
+    window = DateWindow(
+        start_date=datetime.date(2022, 1, 4), end_date=datetime.date(2022, 1, 7)
+    )
+    indexer.index_albums()
+    indexer.index_all_album_content(engine=engine, window=window)
+
+    with Session(indexer.engine) as session:
+        links = session.exec(select(AlbumContentLink.content_id)).all()
+        album = session.get(Album, "album")
+        # Only the window was indexed: "b" is unlinked, "a" is outside of it.
+        assert sorted(links) == ["a", "c", "d"]
+        assert album.synced_media_items_count == 3
+        assert album.needs_sync
+
+    indexer.download_indexed_content(f"{tmp_path}/photos", engine=engine, window=window)
+
+    assert os.listdir(f"{tmp_path}/photos/Album") == ["d.jpg"]
+    with Session(indexer.engine) as session:
+        download_run = session.exec(select(DownloadRun)).one()
+        assert download_run.start_date == window.start_date
+        assert download_run.end_date == window.end_date
+
+
+def test_library_sync_pushes_date_window_to_api(tmp_path):
+    config = FakeLibraryConfig(albums=1, items_per_album=72, max_page_size=100)
+    with FakePhotosServer(config) as server:
+        client = create_client(server.url)
+        indexer = GooglePhotosIndexer(
+            client=client, database_url=f"sqlite:///{tmp_path}/index.db"
+        )
+        day = datetime.date(2010, 1, 2)
+
+        indexer.index_library_content(DateWindow(start_date=day, end_date=day))
+        client.transport.close()
+
+        assert server.calls == {"mediaItems.search": 1}
+
+    with Session(indexer.engine) as session:
+        creation_times = session.exec(select(Content.content_creation_time)).all()
+
+    # The fake library has a media item every hour from 2010-01-01.
+    assert len(creation_times) == 24
+    assert {time.date() for time in creation_times} == {day}
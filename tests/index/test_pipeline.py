@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+
+from gpsync.index.pipeline import Pipeline, Stage
+
+
+def test_pipeline_runs_items_through_every_stage():
+    pipeline = Pipeline(
+        [
+            Stage("double", lambda item: item * 2, workers=3),
+            Stage("filter", lambda item: None if item % 20 else item, workers=2),
+            Stage("negate", lambda item: -item, workers=1),
+        ],
+        queue_size=2,
+    )
+
+    results = sorted(pipeline.run(range(100)))
+
+    assert results == sorted(-item for item in range(0, 200, 20))
+
+
+def test_slow_item_does_not_hold_up_the_others():
+    def fetch(item):
+        if item == 0:
+            time.sleep(0.3)
+        return item
+
+    pipeline = Pipeline([Stage("fetch", fetch, workers=4)])
+
+    assert list(pipeline.run(range(10)))[-1] == 0
+
+
+def test_stages_overlap():
+    active = set()
+    overlapped = threading.Event()
+    lock = threading.Lock()
+
+    def busy(name):
+        def func(item):
+            with lock:
+                active.add(name)
+                if len(active) == 2:
+                    overlapped.set()
+            time.sleep(0.01)
+            with lock:
+                active.discard(name)
+            return item
+
+        return func
+
+    pipeline = Pipeline(
+        [Stage("fetch", busy("fetch"), 1), Stage("write", busy("write"), 1)]
+    )
+    assert len(list(pipeline.run(range(20)))) == 20
+    assert overlapped.is_set()
+
+
+def test_failure_yields_finished_items_and_discards_the_rest():
+    discarded = []
+    release = threading.Event()
+
+    def fetch(item):
+        if item == 5:
+            raise RuntimeError("broken")
+        if item > 5:
+            release.wait(1)
+        return item
+
+    def write(item):
+        if item == 0:
+            release.set()
+        return item
+
+    pipeline = Pipeline(
+        [Stage("fetch", fetch, 2), Stage("write", write, 1)],
+        queue_size=1,
+        discard=discarded.append,
+    )
+
+    results = []
+    with pytest.raises(RuntimeError, match="broken"):
+        for item in pipeline.run(range(100)):
+            results.append(item)
+
+    assert 5 in discarded
+    assert not set(results) & set(discarded)
+    assert len(results) + len(discarded) < 100
+
+
+def test_consumer_stopping_early_does_not_hang():
+    discarded = []
+    pipeline = Pipeline(
+        [Stage("fetch", lambda item: item, 2), Stage("write", lambda item: item, 2)],
+        queue_size=1,
+        discard=discarded.append,
+    )
+
+    num_threads = threading.active_count()
+    results = pipeline.run(range(1000))
+    assert next(results) is not None
+    results.close()
+
+    assert len(discarded) < 1000
+    assert threading.active_count() == num_threads
+
+
+def test_many_stage_passes_on_items_as_they_are_produced():
+    produced = []
+
+    def pages(item):
+        for page in range(3):
+            produced.append((item, page))
+            yield item, page
+
+    pipeline = Pipeline([Stage("page", pages, workers=1, many=True)], queue_size=1)
+    results = pipeline.run(["a", "b"])
+
+    assert next(results) == ("a", 0)
+    # Bounded by the queue, the rest of the pages weren't produced yet.
+    assert len(produced) <= 3
+    assert sorted(results) == [("a", 1), ("a", 2), ("b", 0), ("b", 1), ("b", 2)]
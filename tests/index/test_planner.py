@@ -0,0 +1,184 @@
+import datetime
+from contextlib import closing
+
+import pytest
+from sqlmodel import Session
+
+from gpsync.google_photos.async_client import AsyncLimits
+from gpsync.google_photos.records import MediaItemRecord
+from gpsync.index.indexer import DownloadEngine, GooglePhotosIndexer
+from gpsync.index.options import DownloadOrder
+from gpsync.index.pipeline import PipelineLimits
+from gpsync.index.planner import (
+    NO_ALBUM,
+    PHOTO_BYTES_PER_PIXEL,
+    SCHEDULERS,
+    VIDEO_BYTES_ESTIMATE,
+    plan_downloads,
+)
+from gpsync.index.readonly import connect_readonly
+from tests.helpers import make_jpeg, make_media_item_dict
+
+
+@pytest.fixture
+def indexer(client, fake_api, content_server, tmp_path):
+    def item(media_item_id, **kwargs):
+        return make_media_item_dict(
+            media_item_id,
+            content_server.add(f"/{media_item_id}", body=make_jpeg()),
+            **kwargs,
+        )
+
+    fake_api.add_album("trip", "Trip", [item("a"), item("b"), item("v", video=True)])
+    fake_api.add_album("family", "Family", [fake_api.media_items["a"], item("c")])
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{tmp_path}/index.db"
+    )
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    return indexer
+
+
+def plan(indexer, base_path):
+    with closing(connect_readonly(indexer.database_url)) as connection:
+        return plan_downloads(connection, base_path)
+
+
+def test_plan_before_download(indexer, tmp_path):
+    photo_bytes = int(4 * 3 * PHOTO_BYTES_PER_PIXEL)
+
+    download_plan = plan(indexer, f"{tmp_path}/photos")
+
+    # "a" is in both albums and only downloaded once.
+    assert download_plan.items == 4
+    assert download_plan.estimated_bytes == 3 * photo_bytes + VIDEO_BYTES_ESTIMATE
+    assert [
+        (album.title, album.items, album.estimated_bytes)
+        for album in download_plan.albums
+    ] == [
+        ("Family", 2, 2 * photo_bytes),
+        ("Trip", 3, 2 * photo_bytes + VIDEO_BYTES_ESTIMATE),
+    ]
+
+
+def test_plan_after_download_is_empty(indexer, tmp_path):
+    base_path = f"{tmp_path}/photos"
+    indexer.download_indexed_content(base_path)
+
+    download_plan = plan(indexer, base_path)
+
+    assert download_plan.items == 0
+    assert download_plan.albums == []
+    # Other destinations are planned independently.
+    assert plan(indexer, f"{tmp_path}/elsewhere").items == 4
+
+
+def test_plan_content_added_to_album_and_library(
+    indexer, fake_api, content_server, tmp_path
+):
+    base_path = f"{tmp_path}/photos"
+    indexer.download_indexed_content(base_path)
+
+    fake_api.add_media_item("family", fake_api.media_items["b"])
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    with Session(indexer.engine) as session:
+        # Content in no album, e.g. from a library sync.
+        indexer._index_media_items(
+            session,
+            None,
+            [
+                MediaItemRecord.from_api(
+                    make_media_item_dict(
+                        "loose", content_server.add("/loose", body=make_jpeg())
+                    )
+                )
+            ],
+            datetime.datetime.utcnow(),
+        )
+        session.commit()
+
+    download_plan = plan(indexer, base_path)
+
+    assert download_plan.items == 2
+    assert [(album.title, album.items) for album in download_plan.albums] == [
+        ("Family", 1),
+        (NO_ALBUM, 1),
+    ]
+
+
+@pytest.fixture
+def scheduled(client, fake_api, content_server, tmp_path):
+    def item(media_item_id, day, width=4, video=False):
+        media_item = make_media_item_dict(
+            media_item_id,
+            content_server.add(f"/{media_item_id}", body=make_jpeg()),
+            video=video,
+            creation_time=f"2022-01-0{day}T00:00:00Z",
+        )
+        media_item["mediaMetadata"]["width"] = str(width)
+        return media_item
+
+    fake_api.add_album(
+        "videos", "Videos", [item("v1", 3, video=True), item("v2", 4, video=True)]
+    )
+    fake_api.add_album(
+        "photos",
+        "Photos",
+        [item("p1", 1, width=40), item("p2", 2, width=4), item("p3", 5, width=400)],
+    )
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{tmp_path}/index.db"
+    )
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    return indexer
+
+
+@pytest.mark.parametrize(
+    "order,expected",
+    [
+        (DownloadOrder.SMALLEST_FIRST, ["p2", "p1", "p3", "v1", "v2"]),
+        (DownloadOrder.NEWEST_FIRST, ["p3", "v2", "v1", "p2", "p1"]),
+        # Newest of each album in turn, the photos album has a turn left at the end.
+        (DownloadOrder.FAIR_SHARE, ["p3", "v2", "p2", "v1", "p1"]),
+    ],
+)
+def test_schedulers(scheduled, tmp_path, order, expected):
+    assert order in SCHEDULERS
+
+    with scheduled.engine.connect() as connection:
+        scheduled._plan_filepaths(connection, f"{tmp_path}/photos", window=None)
+        records = list(scheduled._planned_records(connection, order))
+
+    assert [record.id for record, _ in records] == expected
+
+
+def test_planned_records_carry_their_filepaths(indexer, tmp_path):
+    base_path = f"{tmp_path}/photos"
+
+    with indexer.engine.connect() as connection:
+        indexer._plan_filepaths(connection, base_path, window=None)
+        records = list(indexer._planned_records(connection))
+
+    # Content in several albums is read once, with a file path in each of them.
+    assert {record.id: sorted(filepaths) for record, filepaths in records} == {
+        "a": [f"{base_path}/Family/a.jpg", f"{base_path}/Trip/a.jpg"],
+        "b": [f"{base_path}/Trip/b.jpg"],
+        "c": [f"{base_path}/Family/c.jpg"],
+        "v": [f"{base_path}/Trip/v.mp4"],
+    }
+
+
+@pytest.mark.parametrize("engine", list(DownloadEngine))
+def test_downloads_follow_order(scheduled, content_server, tmp_path, engine):
+    scheduled.download_indexed_content(
+        f"{tmp_path}/photos",
+        engine=engine,
+        pipeline_limits=PipelineLimits(fetch_workers=1),
+        async_limits=AsyncLimits(download_concurrency=1),
+        order=DownloadOrder.SMALLEST_FIRST,
+    )
+
+    paths = [request["path"] for request in content_server.requests]
+    assert sorted(set(paths), key=paths.index) == ["/p2", "/p1", "/p3", "/v1", "/v2"]
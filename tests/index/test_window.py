@@ -0,0 +1,78 @@
+import datetime
+
+import pytest
+from sqlmodel import Session, select
+
+from gpsync.index.indexer import get_engine
+from gpsync.index.window import DateWindow
+from gpsync.models.index import Content
+
+START = datetime.date(2022, 1, 4)
+END = datetime.date(2022, 1, 7)
+
+
+def test_window_contains_whole_days():
+    window = DateWindow(start_date=START, end_date=END)
+
+    assert window.contains(datetime.datetime(2022, 1, 4))
+    assert window.contains(
+        datetime.datetime(2022, 1, 7, 23, 59, tzinfo=datetime.timezone.utc)
+    )
+    assert not window.contains(datetime.datetime(2022, 1, 3, 23, 59))
+    assert not window.contains(datetime.datetime(2022, 1, 8))
+
+
+def test_open_ended_windows():
+    assert not DateWindow().bounded
+    assert DateWindow().contains(datetime.datetime(1900, 1, 1))
+    assert DateWindow(start_date=START).contains(datetime.datetime(9000, 1, 1))
+    assert not DateWindow(end_date=END).contains(datetime.datetime(2022, 1, 8))
+
+
+def test_window_must_be_ordered():
+    with pytest.raises(ValueError):
+        DateWindow(start_date=END, end_date=START)
+
+
+def test_window_filters():
+    assert DateWindow().to_filters() is None
+
+    filters = DateWindow(start_date=START).to_filters()
+    (date_range,) = filters.dict(by_alias=True)["dateFilter"]["ranges"]
+    assert date_range == {
+        "startDate": {"year": 2022, "month": 1, "day": 4},
+        "endDate": {"year": 9999, "month": 12, "day": 31},
+    }
+
+
+def test_window_where_matches_contains():
+    engine = get_engine("sqlite://")
+    times = [datetime.datetime(2022, 1, day, 12) for day in range(1, 11)]
+    with Session(engine) as session:
+        for i, time in enumerate(times):
+            session.add(
+                Content(
+                    id=str(i),
+                    base_url="",
+                    download_url="",
+                    google_photos_filename="",
+                    content_creation_time=time,
+                    height=1,
+                    width=1,
+                    mime_type="image/jpeg",
+                )
+            )
+        session.commit()
+
+        for window in [
+            DateWindow(start_date=START, end_date=END),
+            DateWindow(start_date=START),
+            DateWindow(end_date=END),
+            DateWindow(),
+        ]:
+            selected = session.exec(
+                select(Content.content_creation_time).where(
+                    window.where(Content.content_creation_time)
+                )
+            ).all()
+            assert sorted(selected) == [time for time in times if window.contains(time)]
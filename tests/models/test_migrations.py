@@ -0,0 +1,129 @@
+import datetime
+import uuid
+
+from sqlalchemy import create_engine, inspect, text
+from sqlmodel import Session, select
+
+from gpsync.index.database import get_engine, under_path
+from gpsync.models.index import Album, AlbumContentLink, Download
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_migrate_adds_indexes_to_existing_tables(tmp_path):
+    url = f"sqlite:///{tmp_path}/old.db"
+    old = create_engine(url)
+    with old.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE content (id VARCHAR PRIMARY KEY, album_id VARCHAR,"
+                " content_creation_time DATETIME)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE download (id INTEGER PRIMARY KEY, content_id VARCHAR,"
+                " local_filepath VARCHAR)"
+            )
+        )
+    old.dispose()
+
+    engine = get_engine(url)
+
+    assert "ix_content_content_creation_time" in index_names(engine, "content")
+    assert "ix_download_content_id_local_filepath" in index_names(engine, "download")
+
+
+def test_downloaded_lookup_uses_index(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path}/index.db")
+    statement = (
+        select(Download.content_id)
+        .where(Download.content_id.in_(["a", "b"]))  # type: ignore
+        .where(under_path(Download.local_filepath, "/photos"))
+    )
+    compiled = statement.compile(
+        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+
+    with engine.connect() as connection:
+        plan = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+
+    assert "ix_download_content_id_local_filepath" in plan[0][-1]
+
+
+def test_under_path_matches_only_descendants(tmp_path):
+    engine = get_engine(f"sqlite:///{tmp_path}/index.db")
+    with Session(engine) as session:
+        for path in [
+            "/photos/a.jpg",
+            "/photos/album/b.jpg",
+            "/photos2/c.jpg",
+            "/d.jpg",
+        ]:
+            session.add(
+                Download(
+                    local_filepath=path,
+                    local_filename=path.rsplit("/", 1)[-1],
+                    content_id=path,
+                    timestamp=datetime.datetime.now(),
+                    download_run_id=uuid.uuid4(),
+                )
+            )
+        session.commit()
+
+        paths = session.exec(
+            select(Download.local_filepath).where(
+                under_path(Download.local_filepath, "/photos")
+            )
+        ).all()
+
+    assert sorted(paths) == ["/photos/a.jpg", "/photos/album/b.jpg"]
+
+
+def test_migrate_adds_missing_columns(tmp_path):
+    url = f"sqlite:///{tmp_path}/old.db"
+    old = create_engine(url)
+    with old.begin() as connection:
+        connection.execute(
+            text("CREATE TABLE album (id VARCHAR PRIMARY KEY, title VARCHAR)")
+        )
+        connection.execute(text("INSERT INTO album (id, title) VALUES ('a', 'A')"))
+    old.dispose()
+
+    engine = get_engine(url)
+
+    with Session(engine) as session:
+        album = session.get(Album, "a")
+    assert album.title == "A"
+    assert album.synced_at is None
+    assert album.needs_sync
+
+
+def test_migrate_links_content_to_its_album(tmp_path):
+    url = f"sqlite:///{tmp_path}/old.db"
+    old = get_engine(url)
+    with old.begin() as connection:
+        connection.execute(text("ALTER TABLE content ADD COLUMN album_id VARCHAR"))
+        for content_id, album_id in [("a", "x"), ("b", None)]:
+            connection.execute(
+                text(
+                    "INSERT INTO content (id, album_id, base_url, download_url,"
+                    " google_photos_filename, content_creation_time, height, width,"
+                    " mime_type, created_at, updated_at) VALUES (:id, :album_id, '',"
+                    " '', '', '2022-01-01', 1, 1, 'image/jpeg', '2022-01-01',"
+                    " '2022-01-01')"
+                ),
+                {"id": content_id, "album_id": album_id},
+            )
+    old.dispose()
+
+    engine = get_engine(url)
+    # Only backfilled once, later links are left alone.
+    engine.dispose()
+    engine = get_engine(url)
+
+    with Session(engine) as session:
+        links = session.exec(select(AlbumContentLink)).all()
+    assert [(link.album_id, link.content_id) for link in links] == [("x", "a")]
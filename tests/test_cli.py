@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import subprocess
+import sys
+from contextlib import closing
+from typing import Set
+
+import pytest
+from typer.testing import CliRunner
+
+from cli import app
+from gpsync.index.indexer import GooglePhotosIndexer, get_engine
+from tests.helpers import make_jpeg, make_media_item_dict
+
+HEAVY_MODULES = [
+    "PIL",
+    "piexif",
+    "pillow_heif",
+    "googleapiclient",
+    "google_auth_oauthlib",
+    "sqlalchemy",
+    "sqlmodel",
+    "tqdm",
+    "httpx",
+    "requests",
+    "httplib2",
+]
+
+# Commands that only read the index also do without pydantic.
+READ_ONLY_HEAVY_MODULES = HEAVY_MODULES + ["pydantic"]
+
+
+def imported_modules(*args: str) -> Set[str]:
+    """Top-level modules imported by a fresh process that runs the CLI with `args`."""
+    code = (
+        "import sys\n"
+        "from cli import app\n"
+        "app(sys.argv[1:], standalone_mode=False)\n"
+        "print(*sys.modules, file=sys.stderr)\n"
+    )
+    stderr = subprocess.run(
+        [sys.executable, "-c", code, *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    return {module.split(".")[0] for module in stderr.split()}
+
+
+def test_cli_import_is_lazy():
+    modules = subprocess.run(
+        [sys.executable, "-c", "import sys, cli; print(*sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    imported = {module.split(".")[0] for module in modules}
+    assert imported.isdisjoint(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize("command", [["status"], ["download", "--dry-run"]])
+def test_read_only_commands_import_only_light_modules(tmp_path, command):
+    database_url = f"sqlite:///{tmp_path}/index.db"
+    get_engine(database_url).dispose()
+
+    imported = imported_modules(*command, "--database-url", database_url)
+
+    assert imported.isdisjoint(READ_ONLY_HEAVY_MODULES)
+
+
+def test_status(client, fake_api, content_server, tmp_path):
+    database_url = f"sqlite:///{tmp_path}/index.db"
+    fake_api.add_album(
+        "album",
+        "Album",
+        [
+            make_media_item_dict(
+                f"p{i}", content_server.add(f"/p{i}", body=make_jpeg())
+            )
+            for i in range(3)
+        ],
+    )
+    fake_api.add_album("empty", "Empty", [])
+    indexer = GooglePhotosIndexer(client=client, database_url=database_url)
+    indexer.index_albums()
+    indexer.index_album_content("album")
+    indexer.download_indexed_content(f"{tmp_path}/photos")
+
+    result = CliRunner().invoke(
+        app,
+        [
+            "status",
+            "--database-url",
+            database_url,
+            "--download-path",
+            f"{tmp_path}/photos",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Albums: 2 (1 to sync)" in result.output
+    assert "Indexed media items: 3" in result.output
+    assert f"Downloaded under {tmp_path}/photos: 3" in result.output
+    assert "Partial downloads: 0" in result.output
+    assert "Last synced: never" not in result.output
+
+
+def test_status_does_not_create_or_migrate_the_index(tmp_path):
+    database_filepath = f"{tmp_path}/index.db"
+
+    result = CliRunner().invoke(
+        app, ["status", "--database-url", f"sqlite:///{database_filepath}"]
+    )
+
+    assert result.exit_code == 2, result.output
+    assert "There is no index" in result.output
+    assert not os.path.exists(database_filepath)
+
+    # Indexes missing from the schema are left for the next download to create.
+    get_engine(f"sqlite:///{database_filepath}").dispose()
+    with closing(sqlite3.connect(database_filepath)) as connection:
+        connection.execute("DROP INDEX ix_download_content_id_local_filepath")
+    result = CliRunner().invoke(
+        app, ["status", "--database-url", f"sqlite:///{database_filepath}"]
+    )
+
+    assert result.exit_code == 0, result.output
+    with closing(sqlite3.connect(database_filepath)) as connection:
+        indexes = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        ).fetchall()
+    assert ("ix_download_content_id_local_filepath",) not in indexes
+
+
+def test_download_dry_run(client, fake_api, content_server, tmp_path):
+    database_url = f"sqlite:///{tmp_path}/index.db"
+    fake_api.add_album(
+        "album",
+        "Album",
+        [
+            make_media_item_dict(
+                f"p{i}", content_server.add(f"/p{i}", body=make_jpeg())
+            )
+            for i in range(3)
+        ],
+    )
+    indexer = GooglePhotosIndexer(client=client, database_url=database_url)
+    indexer.index_albums()
+    indexer.index_album_content("album")
+
+    # No credentials are needed.
+    result = CliRunner().invoke(
+        app,
+        [
+            "download",
+            "--dry-run",
+            "--database-url",
+            database_url,
+            "--download-path",
+            f"{tmp_path}/photos",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "Album: 3 media items" in result.output
+    assert "Total: 3 media items to download" in result.output
+    assert not (tmp_path / "photos").exists()
+
+
+def test_download_dry_run_does_not_write_the_index(client, fake_api, tmp_path):
+    database_filepath = f"{tmp_path}/index.db"
+    fake_api.add_album("album", "Album", [])
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{database_filepath}"
+    )
+    indexer.index_albums()
+    # Closing the last connection checkpoints the index, before it's compared.
+    indexer.engine.dispose()
+    dry_run = ["download", "--dry-run", "--download-path", f"{tmp_path}/photos"]
+
+    result = CliRunner().invoke(
+        app, [*dry_run, "--database-url", f"sqlite:///{tmp_path}/missing.db"]
+    )
+
+    assert result.exit_code == 2, result.output
+    assert "There is no index" in result.output
+    assert not os.path.exists(f"{tmp_path}/missing.db")
+
+    with open(database_filepath, "rb") as file:
+        before = file.read()
+    result = CliRunner().invoke(
+        app, [*dry_run, "--database-url", f"sqlite:///{database_filepath}"]
+    )
+
+    assert result.exit_code == 0, result.output
+    with open(database_filepath, "rb") as file:
+        assert file.read() == before
+
+
+def test_download_rejects_invalid_bandwidth_options(tmp_path):
+    for option, value in [
+        ("--byte-budget", "lots"),
+        ("--bandwidth-limit", "fast"),
+        ("--bandwidth-schedule", "09:00=1M"),
+    ]:
+        result = CliRunner().invoke(
+            app,
+            [
+                "download",
+                option,
+                value,
+                "--database-url",
+                f"sqlite:///{tmp_path}/index.db",
+            ],
+        )
+
+        assert result.exit_code == 2, result.output
+        assert value in result.output
@@ -0,0 +1,141 @@
+import urllib.error
+import urllib.request
+import uuid
+
+import pytest
+from sqlmodel import Session, select
+
+from gpsync.index.indexer import GooglePhotosIndexer
+from gpsync.metrics import (
+    API_CALLS,
+    BYTES_DOWNLOADED,
+    COMMIT_SECONDS,
+    DOWNLOAD_SECONDS,
+    HTTP_ERRORS,
+    SAVE_SECONDS,
+    URL_REFRESHES,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsRegistry,
+    MetricsServer,
+    TextfileExporter,
+    write_textfile,
+)
+from gpsync.models.index import DownloadRun
+from tests.helpers import make_jpeg, make_media_item_dict
+
+LABELS = {"download_run": "run"}
+
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry()
+    requests = registry.register(Counter("requests", "Requests.", ["status"]))
+    requests.inc(status=200)
+    requests.inc(2, status=429)
+    registry.register(Gauge("depth", "Depth.")).set(3)
+    latency = registry.register(Histogram("latency", "Latency.", buckets=[0.1, 1]))
+    latency.observe(0.1)
+    latency.observe(0.5)
+    return registry
+
+
+def test_render_openmetrics(registry):
+    assert registry.render(LABELS).splitlines() == [
+        "# HELP requests Requests.",
+        "# TYPE requests counter",
+        'requests_total{download_run="run",status="200"} 1.0',
+        'requests_total{download_run="run",status="429"} 2.0',
+        "# HELP depth Depth.",
+        "# TYPE depth gauge",
+        'depth{download_run="run"} 3.0',
+        "# HELP latency Latency.",
+        "# TYPE latency histogram",
+        'latency_bucket{download_run="run",le="0.1"} 1.0',
+        'latency_bucket{download_run="run",le="1.0"} 2.0',
+        'latency_bucket{download_run="run",le="+Inf"} 2.0',
+        'latency_count{download_run="run"} 2.0',
+        'latency_sum{download_run="run"} 0.6',
+        "# EOF",
+    ]
+
+
+def test_labels_must_match():
+    counter = Counter("requests", "Requests.", ["status"])
+
+    with pytest.raises(ValueError):
+        counter.inc(endpoint="search")
+
+
+def test_textfile_exporter_writes_on_exit(registry, tmp_path):
+    path = f"{tmp_path}/gpsync.prom"
+
+    with TextfileExporter(path, interval=60, registry=registry, labels=LABELS):
+        registry.metrics[1].set(5)
+
+    with open(path) as file:
+        assert 'depth{download_run="run"} 5' in file.read()
+    write_textfile(path, registry)
+    with open(path) as file:
+        assert "depth 5" in file.read()
+    assert sorted(tmp_path.iterdir()) == [tmp_path / "gpsync.prom"]
+
+
+def test_metrics_server(registry):
+    with MetricsServer(registry=registry, labels=LABELS) as server:
+        with urllib.request.urlopen(server.url) as response:
+            body = response.read().decode()
+            content_type = response.headers["Content-Type"]
+
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(server.url.replace("/metrics", "/other"))
+
+    assert content_type.startswith("application/openmetrics-text")
+    assert body == registry.render(LABELS)
+
+
+def test_sync_is_instrumented(client, fake_api, content_server, tmp_path):
+    jpeg = make_jpeg()
+    fake_api.add_album(
+        "album",
+        "Album",
+        [
+            make_media_item_dict(
+                f"p{i}", content_server.add(f"/p{i}", body=jpeg), description=None
+            )
+            for i in range(3)
+        ],
+    )
+    content_server.add("/p0", body=jpeg, failures=[429])
+    content_server.add("/p1", body=jpeg, failures=[403])
+    indexer = GooglePhotosIndexer(
+        client=client, database_url=f"sqlite:///{tmp_path}/index.db"
+    )
+    searches = API_CALLS.value(endpoint="mediaItems.search")
+    throttled = HTTP_ERRORS.value(endpoint_class="content", status=429)
+    expired = HTTP_ERRORS.value(endpoint_class="content", status=403)
+    refreshes = URL_REFRESHES.value(reason="expired")
+    downloaded_bytes = BYTES_DOWNLOADED.value()
+    downloads = DOWNLOAD_SECONDS.count()
+    links = SAVE_SECONDS.count(step="link")
+    commits = COMMIT_SECONDS.count()
+
+    indexer.index_albums()
+    indexer.index_all_album_content()
+    download_run_id = uuid.uuid4()
+    indexer.download_indexed_content(
+        f"{tmp_path}/photos", download_run_id=download_run_id
+    )
+
+    assert API_CALLS.value(endpoint="mediaItems.search") == searches + 1
+    assert HTTP_ERRORS.value(endpoint_class="content", status=429) == throttled + 1
+    assert BYTES_DOWNLOADED.value() == downloaded_bytes + 3 * len(jpeg)
+    assert DOWNLOAD_SECONDS.count() == downloads + 3
+    assert SAVE_SECONDS.count(step="link") == links + 3
+    assert COMMIT_SECONDS.count() > commits
+    assert HTTP_ERRORS.value(endpoint_class="content", status=403) == expired + 1
+    assert URL_REFRESHES.value(reason="expired") == refreshes + 1
+    # The run is recorded with the ID that its metrics are exported with.
+    with Session(indexer.engine) as session:
+        assert session.exec(select(DownloadRun.id)).all() == [download_run_id]
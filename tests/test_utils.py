@@ -0,0 +1,94 @@
+import errno
+import os
+
+import pytest
+
+from gpsync import utils
+from gpsync.utils import (
+    create_directories,
+    link_into_place,
+    move_into_place,
+    temporary_filepath,
+)
+
+
+def test_create_directories(tmp_path):
+    filepath = f"{tmp_path}/a/b/file.jpg"
+    create_directories(filepath)
+    assert os.path.isdir(f"{tmp_path}/a/b")
+
+
+def test_temporary_filepath_is_hidden_sibling(tmp_path):
+    filepath = temporary_filepath(f"{tmp_path}/photo.jpg")
+    assert os.path.dirname(filepath) == str(tmp_path)
+    assert os.path.basename(filepath).startswith(".photo.jpg.")
+    assert filepath != temporary_filepath(f"{tmp_path}/photo.jpg")
+
+
+def test_move_into_place(tmp_path):
+    source = tmp_path / "source"
+    source.write_bytes(b"content")
+    destination = tmp_path / "destination"
+    destination.write_bytes(b"old")
+
+    move_into_place(str(source), str(destination))
+
+    assert destination.read_bytes() == b"content"
+    assert not source.exists()
+
+
+def test_move_into_place_across_filesystems(tmp_path, monkeypatch):
+    source = tmp_path / "source"
+    source.write_bytes(b"content")
+    destination = tmp_path / "destination"
+
+    replace = os.replace
+    replaced = []
+
+    def cross_device_replace(src, dst):
+        if src == str(source):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        replaced.append((src, dst))
+        replace(src, dst)
+
+    monkeypatch.setattr(utils.os, "replace", cross_device_replace)
+
+    move_into_place(str(source), str(destination))
+
+    assert destination.read_bytes() == b"content"
+    assert not source.exists()
+    # The copy is staged next to the destination and renamed into place.
+    assert replaced[0][1] == str(destination)
+    assert os.path.dirname(replaced[0][0]) == str(tmp_path)
+    assert sorted(os.listdir(tmp_path)) == ["destination"]
+
+
+def test_move_into_place_raises_other_errors(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        move_into_place(f"{tmp_path}/missing", f"{tmp_path}/destination")
+
+
+def test_link_into_place_hard_links(tmp_path):
+    source = tmp_path / "source"
+    source.write_bytes(b"content")
+    (tmp_path / "destination").write_bytes(b"old")
+
+    link_into_place(str(source), str(tmp_path / "destination"))
+
+    assert (tmp_path / "destination").read_bytes() == b"content"
+    assert (tmp_path / "destination").stat().st_ino == source.stat().st_ino
+    assert sorted(os.listdir(tmp_path)) == ["destination", "source"]
+
+
+def test_link_into_place_copies_without_hard_links(tmp_path, monkeypatch):
+    def failing_link(source, destination):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", failing_link)
+    source = tmp_path / "source"
+    source.write_bytes(b"content")
+
+    link_into_place(str(source), str(tmp_path / "destination"))
+
+    assert (tmp_path / "destination").read_bytes() == b"content"
+    assert (tmp_path / "destination").stat().st_ino != source.stat().st_ino